@@ -0,0 +1,79 @@
+"""
+Search latency and recall of the per-user IVF index as a corpus grows.
+
+Fills an ANN index with synthetic clustered 1536-d vectors (no Mongo),
+compacts it the way the background task does (training the centroids)
+and times searches over the user's whole library against an exact scan.
+
+Usage: python benchmarks/ann_search_latency.py [--sizes 25000 50000 100000] [--queries 200]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.ann_index import _UserIndex
+
+DIMENSIONS = 1536
+DOCUMENT_CHUNKS = 500
+
+
+def synthetic_embeddings(rng, count: int, clusters: int = 200) -> np.ndarray:
+    centroids = rng.standard_normal((clusters, DIMENSIONS)).astype(np.float32)
+    vectors = centroids[rng.integers(0, clusters, count)] + 0.8 * rng.standard_normal((count, DIMENSIONS)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))] * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--sizes', type=int, nargs='+', default=[25000, 50000, 100000])
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--nprobe', type=int, default=16)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    for size in args.sizes:
+        vectors = synthetic_embeddings(rng, size + args.queries)
+        corpus, queries = vectors[:size], vectors[size:]
+
+        index = _UserIndex()
+        hashes = []
+        for start in range(0, size, DOCUMENT_CHUNKS):
+            hashes.append(f"doc{start}")
+            ids = [str(i) for i in range(start, min(size, start + DOCUMENT_CHUNKS))]
+            index.add(hashes[-1], 'v1', ids, corpus[start:start + DOCUMENT_CHUNKS])
+        started = time.perf_counter()
+        index = index.compacted(min_train=0)
+        train_s = time.perf_counter() - started
+
+        exact_times, ann_times, recall = [], [], 0.0
+        for query in queries:
+            started = time.perf_counter()
+            truth = index.search(query, hashes, args.top_k, args.nprobe, exact_limit=size)
+            exact_times.append(time.perf_counter() - started)
+            started = time.perf_counter()
+            found = index.search(query, hashes, args.top_k, args.nprobe, exact_limit=0)
+            ann_times.append(time.perf_counter() - started)
+            recall += len({i for i, _ in truth} & {i for i, _ in found}) / args.top_k
+
+        print(
+            f"{size:7d} chunks  lists={len(index.centroids):4d}  train={train_s:5.1f}s  "
+            f"exact p50/p99={percentile(exact_times, 0.5):6.1f}/{percentile(exact_times, 0.99):6.1f} ms  "
+            f"ivf p50/p99={percentile(ann_times, 0.5):5.1f}/{percentile(ann_times, 0.99):5.1f} ms  "
+            f"recall@{args.top_k}={recall / len(queries):.3f}"
+        )
+
+
+if __name__ == '__main__':
+    main()
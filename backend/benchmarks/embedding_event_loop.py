@@ -0,0 +1,131 @@
+"""
+Event-loop responsiveness while documents are being embedded.
+
+Runs several concurrent "ingestions" against a simulated embeddings API
+(fixed per-request latency, no network) and measures how late a 10 ms
+heartbeat task wakes up, i.e. how long other requests would be stalled.
+
+  before: blocking openai.OpenAI client called from a coroutine
+  after:  RAGService with its pooled openai.AsyncOpenAI client
+
+Usage: python benchmarks/embedding_event_loop.py [--ingestions 4] [--batches 10] [--latency 0.05]
+"""
+
+import argparse
+import asyncio
+import base64
+import json
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+import openai
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.rag_service import RAGService
+
+DIMENSIONS = 1536
+TICK = 0.01
+_VECTOR = base64.b64encode(bytes(4 * DIMENSIONS)).decode()
+
+
+def _embedding_response(request: httpx.Request) -> httpx.Response:
+    # The client asks for base64-encoded float32 vectors by default
+    texts = json.loads(request.content)['input']
+    return httpx.Response(200, json={
+        'object': 'list',
+        'model': 'text-embedding-3-small',
+        'data': [
+            {'object': 'embedding', 'index': i, 'embedding': _VECTOR}
+            for i in range(len(texts))
+        ],
+        'usage': {'prompt_tokens': 0, 'total_tokens': 0}
+    })
+
+
+async def measure_lag(workload) -> dict:
+    lags = []
+    done = asyncio.Event()
+
+    async def heartbeat():
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append((time.perf_counter() - started - TICK) * 1000)
+
+    ticker = asyncio.create_task(heartbeat())
+    started = time.perf_counter()
+    await workload()
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ticker
+
+    lags.sort()
+    return {
+        'wall_s': round(elapsed, 2),
+        'lag_p50_ms': round(statistics.median(lags), 1),
+        'lag_p99_ms': round(lags[int(len(lags) * 0.99) - 1], 1),
+        'lag_max_ms': round(lags[-1], 1)
+    }
+
+
+async def run_before(args, texts):
+    def handler(request):
+        time.sleep(args.latency)
+        return _embedding_response(request)
+
+    client = openai.OpenAI(api_key='bench', max_retries=0,
+                           http_client=httpx.Client(transport=httpx.MockTransport(handler)))
+
+    async def ingest():
+        for _ in range(args.batches):
+            client.embeddings.create(model='text-embedding-3-small', input=texts)
+
+    async def workload():
+        await asyncio.gather(*(ingest() for _ in range(args.ingestions)))
+
+    return await measure_lag(workload)
+
+
+async def run_after(args, texts):
+    async def handler(request):
+        await asyncio.sleep(args.latency)
+        return _embedding_response(request)
+
+    rag_service = RAGService(db=None)
+    rag_service._http_client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    rag_service._openai_client = openai.AsyncOpenAI(api_key='bench', max_retries=0,
+                                                    http_client=rag_service._http_client)
+
+    async def ingest():
+        for _ in range(args.batches):
+            await rag_service._embed_batch(texts)
+
+    async def workload():
+        await asyncio.gather(*(ingest() for _ in range(args.ingestions)))
+
+    try:
+        return await measure_lag(workload)
+    finally:
+        await rag_service.aclose()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--ingestions', type=int, default=4, help='concurrent documents being ingested')
+    parser.add_argument('--batches', type=int, default=10, help='embedding requests per document')
+    parser.add_argument('--batch-size', type=int, default=64, help='texts per embedding request')
+    parser.add_argument('--latency', type=float, default=0.05, help='simulated API latency in seconds')
+    args = parser.parse_args()
+
+    texts = ['chunk text'] * args.batch_size
+    for name, runner in (('before (sync client)', run_before), ('after (async client)', run_after)):
+        result = asyncio.run(runner(args, texts))
+        print(f"{name:24s} " + '  '.join(f"{key}={value}" for key, value in result.items()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+"""
+Recall and size of the embedding storage formats.
+
+Builds LocalVectorIndex segments from synthetic clustered 1536-d vectors
+(no Mongo) and compares int8 search against exact float32 search:
+
+  recall@k (int8)      overlap of the int8 top k with the exact top k
+  recall@k (rescored)  same after rescoring top_k * factor int8 candidates
+                       in float32, as LocalVectorIndex does
+
+Also reports the BSON size of one chunk's embedding fields per format and
+the in-memory index bytes per chunk.
+
+Usage: python benchmarks/embedding_quantization_recall.py [--chunks 20000] [--queries 200] [--top-k 5]
+"""
+
+import argparse
+import sys
+import time
+from pathlib import Path
+
+import bson
+import numpy as np
+
+sys.path.append(str(Path(__file__).parent.parent))
+
+from services.embedding_codec import encode_embedding
+from services.vector_index import LocalVectorIndex
+
+DIMENSIONS = 1536
+
+
+def synthetic_embeddings(rng, count: int, clusters: int = 50) -> np.ndarray:
+    # Topic centroids plus noise, roughly like chunks of a few textbooks
+    centroids = rng.standard_normal((clusters, DIMENSIONS)).astype(np.float32)
+    vectors = centroids[rng.integers(0, clusters, count)] + 0.8 * rng.standard_normal((count, DIMENSIONS)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--chunks', type=int, default=20000)
+    parser.add_argument('--queries', type=int, default=200)
+    parser.add_argument('--top-k', type=int, default=5)
+    parser.add_argument('--rescore-factor', type=int, default=4)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = synthetic_embeddings(rng, args.chunks + args.queries)
+    corpus, queries = vectors[:args.chunks], vectors[args.chunks:]
+
+    for mode in ('array', 'float32', 'int8'):
+        size = len(bson.encode(encode_embedding(corpus[0].tolist(), mode)))
+        print(f"{mode:8s} stored embedding: {size:6d} bytes/chunk")
+
+    chunks = [{'id': str(i), **encode_embedding(vector.tolist(), 'int8')} for i, vector in enumerate(corpus)]
+    exact = LocalVectorIndex(db=None, max_bytes=1, quantized=False)._build_segment(chunks)
+    quantized = LocalVectorIndex(db=None, max_bytes=1, quantized=True)._build_segment(chunks)
+    print(f"float32  index memory: {exact.nbytes / args.chunks:.0f} bytes/chunk")
+    print(f"int8     index memory: {quantized.nbytes / args.chunks:.0f} bytes/chunk")
+
+    k = args.top_k
+    candidates = k * args.rescore_factor
+    recall_int8 = recall_rescored = 0.0
+    exact_s = quantized_s = 0.0
+    for query in queries:
+        started = time.perf_counter()
+        truth = set(np.argpartition(-exact.scores(query), k - 1)[:k])
+        exact_s += time.perf_counter() - started
+
+        started = time.perf_counter()
+        scores = quantized.scores(query)
+        quantized_s += time.perf_counter() - started
+        recall_int8 += len(truth & set(np.argpartition(-scores, k - 1)[:k])) / k
+        pool = np.argpartition(-scores, candidates - 1)[:candidates]
+        rescored = pool[np.argsort(-(corpus[pool] @ query))[:k]]
+        recall_rescored += len(truth & set(rescored)) / k
+
+    n = len(queries)
+    print(f"recall@{k} int8: {recall_int8 / n:.3f}  rescored (x{args.rescore_factor}): {recall_rescored / n:.3f}")
+    print(f"scoring time per query: float32 {exact_s / n * 1000:.1f} ms, int8 {quantized_s / n * 1000:.1f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -20,13 +20,25 @@ async def clear_all_data():
         'sessions_data',
         'chat_messages',
         'documents',
-        'study_materials'
+        'study_materials',
+        'blobs',
+        'document_chunks',
+        'chunk_postings',
+        'answer_cache',
+        'material_cache',
+        'section_summaries',
+        'generation_locks',
+        'ingestion_jobs',
+        'pregeneration_jobs'
     ]
     
     for collection in collections_to_clear:
         result = await db[collection].delete_many({})
         print(f"✓ Cleared {collection}: {result.deleted_count} documents")
     
+    # Credits reserved by the cleared pre-generation jobs
+    await db.users.update_many({}, {'$unset': {'reserved_credits': ''}})
+    
     # Clear upload directories
     upload_dirs = [
         Path('/app/backend/uploads/documents'),
@@ -0,0 +1,70 @@
+"""
+Rewrite document_chunks embeddings into another storage format.
+
+Converts every chunk that has an embedding to EMBEDDING_STORAGE (or
+--mode) in place, e.g. from the original BSON double arrays to packed
+float32. int8 is stored as float32, so converting to it drops the int8
+codes earlier versions stored. Already converted chunks are rewritten
+idempotently, so the script can be stopped and re-run.
+
+Usage: python migrate_embeddings.py [--mode float32|int8|array] [--batch-size 500]
+"""
+
+from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import UpdateOne
+import argparse
+import asyncio
+import os
+from dotenv import load_dotenv
+from pathlib import Path
+
+from services.embedding_codec import EMBEDDING_STORAGE, EMBEDDING_FIELDS, HAS_EMBEDDING, decode_float32, encode_embedding
+
+ROOT_DIR = Path(__file__).parent
+load_dotenv(ROOT_DIR / '.env')
+
+MONGO_URL = os.environ.get('MONGO_URL')
+
+async def migrate_embeddings(mode: str, batch_size: int):
+    client = AsyncIOMotorClient(MONGO_URL)
+    db = client.studysage
+    
+    print(f"Converting chunk embeddings to {mode}...")
+    
+    converted = 0
+    cursor = db.document_chunks.find(
+        HAS_EMBEDDING,
+        {'_id': 1, 'embedding': 1, 'embedding_f32': 1}
+    ).batch_size(batch_size)
+    
+    operations = []
+    async for chunk in cursor:
+        fields = encode_embedding(decode_float32(chunk).tolist(), mode)
+        stale = {field: '' for field in EMBEDDING_FIELDS if field not in fields}
+        update = {'$set': fields}
+        if stale:
+            update['$unset'] = stale
+        operations.append(UpdateOne({'_id': chunk['_id']}, update))
+        
+        if len(operations) >= batch_size:
+            await db.document_chunks.bulk_write(operations, ordered=False)
+            converted += len(operations)
+            operations = []
+            print(f"  {converted} chunks converted")
+    
+    if operations:
+        await db.document_chunks.bulk_write(operations, ordered=False)
+        converted += len(operations)
+    
+    stats = await db.command('collStats', 'document_chunks')
+    print(f"\n✅ Converted {converted} chunks; document_chunks is now {stats['size'] / 1024 ** 2:.1f} MB")
+    if mode != 'array':
+        print("Atlas $vectorSearch needs EMBEDDING_STORAGE=array; use VECTOR_SEARCH_BACKEND=local")
+    client.close()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0].strip())
+    parser.add_argument('--mode', choices=['array', 'float32', 'int8'], default=EMBEDDING_STORAGE)
+    parser.add_argument('--batch-size', type=int, default=500)
+    args = parser.parse_args()
+    asyncio.run(migrate_embeddings(args.mode, args.batch_size))
@@ -64,12 +64,16 @@ class DocumentChunk(BaseModel):
     model_config = ConfigDict(populate_by_name=True)
     
     id: str
-    document_id: str
-    user_id: str
+    content_hash: str
     chunk_index: int
     content: str
     page_number: Optional[int] = None
-    embedding: List[float] = []
+    page_end: Optional[int] = None  # Last page when the chunk spans pages
+    embedding: List[float] = []  # Only with EMBEDDING_STORAGE=array
+    embedding_f32: Optional[bytes] = None  # Packed little-endian float32
+    embedding_q8: Optional[bytes] = None  # int8 codes, only on chunks from earlier int8 versions
+    embedding_scale: Optional[float] = None
+    embedding_status: str = "ok"  # ok, failed
     created_at: datetime = Field(default_factory=datetime.now)
 
 class PaymentOrder(BaseModel):
@@ -3,6 +3,7 @@ from fastapi.responses import FileResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import BulkWriteError, DuplicateKeyError
 import os
 import logging
 from pathlib import Path
@@ -13,13 +14,10 @@ from datetime import datetime, timezone, timedelta
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 import razorpay
-from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
 import phonenumbers
 from phonenumbers import NumberParseException
 import json
 import random
-import PyPDF2
-from docx import Document as DocxDocument
 from PIL import Image
 import io
 import base64
@@ -28,6 +26,19 @@ import base64
 # Import services
 from services.rag_service import RAGService
 from services.payment_service import PaymentService
+from services.ingestion_service import IngestionService
+from services.extraction import TEXT_FILE_TYPES, delete_page_artifact, shutdown_executor
+from services.uploads import save_upload, UploadTooLarge
+from services.blob_store import BlobStore
+from services.answer_cache import AnswerCache
+from services.document_scope import DocumentScopeResolver
+from services.streaming import sse_event, sse_response
+from services.llm_gateway import LlmGateway
+from services.single_flight import SingleFlight
+from services.material_cache import MaterialCache
+from services.section_summaries import SectionSummarizer
+from services.pregeneration import PregenerationScheduler
+from services.study_pack import Flashcard, MindmapNode, STUDY_PACK_PARTS, parse_study_pack
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -56,18 +67,23 @@ razorpay_client = razorpay.Client(
     auth=(os.environ.get('RAZORPAY_KEY_ID', ''), os.environ.get('RAZORPAY_KEY_SECRET', ''))
 )
 
-# Emergent LLM Key
-EMERGENT_LLM_KEY = os.environ.get('EMERGENT_LLM_KEY', 'sk-emergent-736B924DfA44eB0D93')
-
-
 # Initialize services
-rag_service = RAGService(db)
+llm_gateway = LlmGateway()
+rag_service = RAGService(db, llm_gateway)
 payment_service = PaymentService(db)
+pregeneration = PregenerationScheduler(db, llm_gateway)
+ingestion_service = IngestionService(db, rag_service, pregeneration)
+answer_cache = AnswerCache(db)
+document_scopes = DocumentScopeResolver(db)
+generation_flights = SingleFlight(db)
+material_cache = MaterialCache(db, generation_flights)
+section_summaries = SectionSummarizer(db, llm_gateway, generation_flights)
 
 
 # File upload directory
 UPLOAD_DIR = Path("/app/uploads")
 UPLOAD_DIR.mkdir(exist_ok=True)
+blob_store = BlobStore(db, UPLOAD_DIR)
 
 # In-memory OTP storage (in production, use Redis)
 otp_storage = {}
@@ -88,6 +104,7 @@ class User(BaseModel):
     subscription_status: str = "inactive"  # active, inactive, expired
     subscription_end_date: Optional[datetime] = None
     credits: int = 10  # For metered usage (changed from 0 to 10)
+    reserved_credits: int = 0  # Held by queued pre-generation jobs
     total_usage: int = 0
     theme: str = "dark"  # dark, light
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
@@ -119,9 +136,12 @@ class Document(BaseModel):
     file_path: str
     file_size: int
     content_preview: Optional[str] = None
+    page_count: Optional[int] = None
+    content_hash: Optional[str] = None  # SHA-256 of the stored file
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
     is_exam_prep: bool = False
     is_global: bool = True  # If True, accessible across sessions
+    ingestion_job_id: Optional[str] = None  # Set when the file is queued for RAG processing
 
 class StudySession(BaseModel):
     model_config = ConfigDict(extra="ignore")
@@ -152,6 +172,7 @@ class StudyMaterial(BaseModel):
     document_id: str
     type: str  # summary, flashcard, mindmap, qa
     content: dict
+    cache_key: Optional[str] = None  # material_cache entry the content came from
     created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
 
 class Subscription(BaseModel):
@@ -236,7 +257,8 @@ async def check_credits(user: User, required_credits: int = 1):
         if subscription_end and subscription_end > datetime.now(timezone.utc):
             return True
     
-    if user.credits < required_credits:
+    # Credits held for pre-generation jobs are not spendable
+    if user.credits - user.reserved_credits < required_credits:
         raise HTTPException(
             status_code=402, 
             detail=f"Insufficient credits. Need {required_credits} credits (₹{required_credits * 5}). Please purchase more credits or subscribe."
@@ -249,33 +271,8 @@ async def deduct_credits(user_id: str, credits: int = 1):
         {"$inc": {"credits": -credits, "total_usage": credits}}
     )
 
-def extract_text_from_file(file_path: str, file_type: str) -> str:
-    """Extract text from PDF, DOCX, TXT, or image files"""
-    try:
-        if file_type == "application/pdf":
-            with open(file_path, "rb") as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                text = ""
-                # Store page info for citations
-                page_texts = []
-                for i, page in enumerate(pdf_reader.pages):
-                    page_text = page.extract_text()
-                    page_texts.append(f"[Page {i+1}] {page_text[:500]}")
-                    text += page_text
-                return text[:5000]  # Limit preview
-        
-        elif file_type == "application/vnd.openxmlformats-officedocument.wordprocessingml.document":
-            doc = DocxDocument(file_path)
-            text = "\n".join([para.text for para in doc.paragraphs])
-            return text[:5000]
-        
-        elif file_type == "text/plain":
-            with open(file_path, "r", encoding="utf-8") as file:
-                return file.read()[:5000]
-        
-        return "Text extraction not supported for this file type"
-    except Exception as e:
-        return f"Error extracting text: {str(e)}"
+async def load_study_material(material_id: str):
+    return await db.study_materials.find_one({"id": material_id}, {"_id": 0})
 
 # Routes
 @api_router.get("/")
@@ -687,17 +684,25 @@ async def upload_document(
         if not session:
             raise HTTPException(status_code=404, detail="Session not found")
     
-    # Save file
+    # Save file, then store it by content hash; a duplicate upload just
+    # references the existing blob, its chunks and embeddings
     file_id = str(uuid.uuid4())
     file_extension = file.filename.split('.')[-1]
-    file_path = UPLOAD_DIR / f"{file_id}.{file_extension}"
+    upload_path = UPLOAD_DIR / f"{file_id}.upload"
     
-    content = await file.read()
-    with open(file_path, "wb") as f:
-        f.write(content)
+    try:
+        saved = await save_upload(file, upload_path)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
+    
+    blob, created = await blob_store.acquire(
+        upload_path, saved['sha256'], file.content_type, saved['size'], file_extension
+    )
     
-    # Extract text preview
-    content_preview = extract_text_from_file(str(file_path), file.content_type)
+    # Text files get their preview from the ingestion job's single parse
+    content_preview = blob.get('content_preview')
+    if file.content_type not in TEXT_FILE_TYPES:
+        content_preview = "Text extraction not supported for this file type"
     
     # Create document record
     document = Document(
@@ -705,32 +710,93 @@ async def upload_document(
         session_id=session_id,
         filename=file.filename,
         file_type=file.content_type,
-        file_path=str(file_path),
-        file_size=len(content),
+        file_path=blob['file_path'],
+        file_size=saved['size'],
+        content_hash=saved['sha256'],
         content_preview=content_preview,
+        page_count=blob.get('page_count'),
         is_exam_prep=is_exam_prep,
         is_global=is_global
     )
     
+    # Queue parsing and RAG processing once per blob; progress is reported
+    # by GET /documents/{id}/ingestion
+    if file.content_type in TEXT_FILE_TYPES:
+        if created:
+            job = await ingestion_service.enqueue(
+                content_hash=blob['content_hash'],
+                file_path=blob['file_path'],
+                file_type=file.content_type
+            )
+            await blob_store.set_ingestion_job(blob['content_hash'], job['id'])
+            document.ingestion_job_id = job['id']
+        elif blob.get('ingestion_job_id'):
+            document.ingestion_job_id = blob['ingestion_job_id']
+            await ingestion_service.retry_failed(blob['ingestion_job_id'])
+    
     doc_dict = document.model_dump()
     doc_dict['uploaded_at'] = doc_dict['uploaded_at'].isoformat()
     
     await db.documents.insert_one(doc_dict)
-    
-    # Process document with RAG (asynchronously in background)
-    if file.content_type == "application/pdf":
-        try:
-            await rag_service.process_document(
-                document_id=document.id,
-                user_id=current_user.id,
-                file_path=str(file_path),
-                file_type=file.content_type
+    await document_scopes.invalidate(current_user.id)
+    await answer_cache.invalidate_scope(current_user.id, session_id, is_global)
+    
+    # The shared parse may have finished between acquiring the blob and
+    # inserting this record, after it updated the existing documents
+    if document.content_preview is None and not created:
+        blob = await blob_store.get(document.content_hash)
+        if blob and blob.get('content_preview') is not None:
+            document.content_preview = blob['content_preview']
+            document.page_count = blob.get('page_count')
+            await db.documents.update_one(
+                {"id": document.id},
+                {"$set": {"content_preview": document.content_preview, "page_count": document.page_count}}
             )
-        except Exception as e:
-            print(f"Error processing document for RAG: {e}")
+    
+    # A duplicate upload of an already ingested file gets no ingestion
+    # callback of its own
+    if pregeneration.enabled and not created:
+        blob = await blob_store.get(document.content_hash)
+        if blob and blob.get('ingested_at'):
+            await pregeneration.document_added(doc_dict)
     
     return document
 
+@api_router.get("/documents/{document_id}/ingestion")
+async def get_document_ingestion(
+    document_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    document = await db.documents.find_one(
+        {"id": document_id, "user_id": current_user.id},
+        {"_id": 0, "content_hash": 1, "ingestion_job_id": 1}
+    )
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    # The blob holds the current job, which may have been started by another upload
+    job_id = document.get('ingestion_job_id')
+    if document.get('content_hash'):
+        blob = await blob_store.get(document['content_hash'])
+        if blob and blob.get('ingestion_job_id'):
+            job_id = blob['ingestion_job_id']
+    
+    job = await ingestion_service.get_job(job_id) if job_id else None
+    if not job:
+        raise HTTPException(status_code=404, detail="No ingestion job for this document")
+    
+    return {
+        "job_id": job['id'],
+        "document_id": document_id,
+        "state": job['state'],
+        "attempts": job['attempts'],
+        "progress": job['progress'],
+        "error": job.get('error'),
+        "created_at": job['created_at'],
+        "updated_at": job['updated_at'],
+        "completed_at": job.get('completed_at')
+    }
+
 @api_router.get("/documents", response_model=List[Document])
 async def get_documents(
     is_exam_prep: Optional[bool] = None,
@@ -757,20 +823,178 @@ async def delete_document(
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Delete file
-    file_path = Path(document['file_path'])
-    if file_path.exists():
-        file_path.unlink()
-    
     # Delete document record
     await db.documents.delete_one({"id": document_id})
+    await document_scopes.invalidate(current_user.id)
+    await answer_cache.invalidate_document(current_user.id, document_id)
+    
+    if document.get('content_hash'):
+        # The file, chunks and any ingestion in flight go with the last reference
+        if await blob_store.release(document['content_hash']):
+            await ingestion_service.cancel(document['content_hash'])
+        await rag_service.document_removed(current_user.id, document['content_hash'])
+    else:
+        # Uploaded before content-addressed storage
+        file_path = Path(document['file_path'])
+        if file_path.exists():
+            file_path.unlink()
+        delete_page_artifact(document['file_path'])
+        await db.document_chunks.delete_many({"document_id": document_id})
     
     # Delete related study materials
+    await pregeneration.cancel_document(document_id)
     await db.study_materials.delete_many({"document_id": document_id})
     
     return {"message": "Document deleted successfully"}
 
 # AI Features
+# Bump a prompt's version whenever its wording changes, so material
+# cached under the old prompt is generated afresh
+STUDY_MATERIAL_PROMPTS = {
+    "summary": {
+        "version": 1,
+        "text": "Create a comprehensive summary of this document '{filename}'. Include key points, main ideas, and important details. Format it in a clear, structured way.",
+        "system_message": "You are an expert study assistant. Create comprehensive yet concise summaries of documents."
+    },
+    "flashcard": {
+        "version": 1,
+        "text": "Create 10-15 flashcards from this document. Return them in JSON format as an array of objects with 'question' and 'answer' fields. Example: [{{\"question\": \"What is...\", \"answer\": \"...\"}}, ...]",
+        "system_message": "You are an expert study assistant. Create effective flashcards from documents."
+    },
+    "mindmap": {
+        "version": 1,
+        "text": "Create a mindmap from this document. Return it in JSON format with a hierarchical structure: {{\"title\": \"Main Topic\", \"children\": [{{\"title\": \"Subtopic 1\", \"children\": [...]}}, ...]}}",
+        "system_message": "You are an expert study assistant. Create hierarchical mindmaps from documents."
+    }
+}
+
+async def complete_about_document(document: dict, text: str, system_message: str) -> str:
+    """Reply to a prompt about the document: from its outline once it is
+    ingested (see services.section_summaries), otherwise with the file
+    attached"""
+    if await section_summaries.applies(document.get('content_hash')):
+        outline = await section_summaries.outline(document['content_hash'])
+        return await llm_gateway.complete(
+            text=f"{text}\n\nThe document in page order, as its text or, where it is long, as summaries of its sections:\n\n{outline}",
+            system_message=system_message
+        )
+    return await llm_gateway.complete(
+        text=text,
+        system_message=system_message,
+        files=[(document['file_path'], document['file_type'])]
+    )
+
+async def complete_study_prompt(material_type: str, document: dict) -> str:
+    prompt = STUDY_MATERIAL_PROMPTS[material_type]
+    return await complete_about_document(
+        document, prompt["text"].format(filename=document['filename']), prompt["system_message"]
+    )
+
+async def create_study_material(user_id: str, document: dict, material_type: str, generate_content):
+    """The user's study material of this type for the document: their
+    existing row, or a new one whose content comes from the shared
+    material cache, generated by `generate_content()` on a miss.
+    Returns (material, material id) for SingleFlight."""
+    existing = await db.study_materials.find_one({
+        "document_id": document['id'],
+        "user_id": user_id,
+        "type": material_type
+    }, {"_id": 0})
+    
+    if existing:
+        return existing, existing['id']
+    
+    content, cache_key, generated = await material_cache.get_or_generate(
+        document.get('content_hash'),
+        material_type,
+        STUDY_MATERIAL_PROMPTS[material_type]["version"],
+        llm_gateway.model,
+        generate_content
+    )
+    
+    study_material = StudyMaterial(
+        user_id=user_id,
+        document_id=document['id'],
+        type=material_type,
+        content={**content, "document_name": document['filename']},
+        cache_key=cache_key
+    )
+    
+    material_dict = study_material.model_dump()
+    material_dict['created_at'] = material_dict['created_at'].isoformat()
+    try:
+        await db.study_materials.insert_one(material_dict)
+    except DuplicateKeyError:
+        # A study pack stored this type meanwhile; it is the user's material
+        existing = await db.study_materials.find_one({
+            "document_id": document['id'],
+            "user_id": user_id,
+            "type": material_type
+        }, {"_id": 0})
+        return existing, existing['id']
+    
+    if generated or material_cache.bill_hits:
+        await deduct_credits(user_id, 2)
+    
+    return study_material, study_material.id
+
+# Create AI summary using Gemini (supports files)
+async def generate_summary_content(document: dict) -> dict:
+    response = await complete_study_prompt("summary", document)
+    return {"summary": response}
+
+# Create flashcards using AI
+async def generate_flashcards_content(document: dict) -> dict:
+    response = await complete_study_prompt("flashcard", document)
+    
+    # Parse flashcards. A reply that can't be parsed raises, so no row,
+    # cache entry or charge is created from it and the next request retries
+    import re
+    json_match = re.search(r'\[.*\]', response, re.DOTALL)
+    if not json_match:
+        raise ValueError("The model's reply contains no flashcard list")
+    flashcards = [Flashcard.model_validate(card).model_dump() for card in json.loads(json_match.group())]
+    if not flashcards:
+        raise ValueError("The model returned no flashcards")
+    
+    return {"flashcards": flashcards}
+
+# Create mindmap using AI
+async def generate_mindmap_content(document: dict) -> dict:
+    response = await complete_study_prompt("mindmap", document)
+    
+    # Parse mindmap; like flashcards, an unparseable reply raises
+    import re
+    json_match = re.search(r'\{.*\}', response, re.DOTALL)
+    if not json_match:
+        raise ValueError("The model's reply contains no mindmap object")
+    mindmap = MindmapNode.model_validate(json.loads(json_match.group())).model_dump()
+    
+    return {"mindmap": mindmap}
+
+STUDY_MATERIAL_GENERATORS = {
+    "summary": generate_summary_content,
+    "flashcard": generate_flashcards_content,
+    "mindmap": generate_mindmap_content
+}
+
+async def generate_study_material(user_id: str, document: dict, material_type: str):
+    """create_study_material, coalesced with identical requests from
+    other requests, workers and pre-generation jobs"""
+    async def generate():
+        return await create_study_material(
+            user_id, document, material_type, lambda: STUDY_MATERIAL_GENERATORS[material_type](document)
+        )
+    
+    return await generation_flights.run(
+        f"{material_type}:{user_id}:{document['id']}", generate, load_study_material
+    )
+
+async def run_pregeneration_job(job: dict):
+    document = await db.documents.find_one({"id": job['document_id'], "user_id": job['user_id']}, {"_id": 0})
+    if document:
+        await generate_study_material(job['user_id'], document, job['type'])
+
 @api_router.post("/ai/summarize/{document_id}")
 async def summarize_document(
     document_id: str,
@@ -782,52 +1006,9 @@ async def summarize_document(
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Check if summary already exists
-    existing_summary = await db.study_materials.find_one({
-        "document_id": document_id,
-        "user_id": current_user.id,
-        "type": "summary"
-    })
-    
-    if existing_summary:
-        return existing_summary
-    
-    # Create AI summary using Gemini (supports files)
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"summary_{document_id}",
-        system_message="You are an expert study assistant. Create comprehensive yet concise summaries of documents."
-    ).with_model("gemini", "gemini-2.0-flash")
-    
-    file_content = FileContentWithMimeType(
-        file_path=document['file_path'],
-        mime_type=document['file_type']
-    )
-    
-    user_message = UserMessage(
-        text=f"Create a comprehensive summary of this document '{document['filename']}'. Include key points, main ideas, and important details. Format it in a clear, structured way.",
-        file_contents=[file_content]
-    )
-    
+    # Concurrent requests for the same material share one generation and one charge
     try:
-        response = await chat.send_message(user_message)
-        
-        # Save summary
-        study_material = StudyMaterial(
-            user_id=current_user.id,
-            document_id=document_id,
-            type="summary",
-            content={"summary": response, "document_name": document['filename']}
-        )
-        
-        material_dict = study_material.model_dump()
-        material_dict['created_at'] = material_dict['created_at'].isoformat()
-        await db.study_materials.insert_one(material_dict)
-        
-        await deduct_credits(current_user.id, 2)
-        
-        return study_material
-    
+        return await generate_study_material(current_user.id, document, "summary")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating summary: {str(e)}")
 
@@ -842,54 +1023,9 @@ async def create_flashcards(
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Create flashcards using AI
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"flashcards_{document_id}",
-        system_message="You are an expert study assistant. Create effective flashcards from documents."
-    ).with_model("gemini", "gemini-2.0-flash")
-    
-    file_content = FileContentWithMimeType(
-        file_path=document['file_path'],
-        mime_type=document['file_type']
-    )
-    
-    user_message = UserMessage(
-        text="Create 10-15 flashcards from this document. Return them in JSON format as an array of objects with 'question' and 'answer' fields. Example: [{\"question\": \"What is...\", \"answer\": \"...\"}, ...]",
-        file_contents=[file_content]
-    )
-    
+    # Concurrent requests for the same material share one generation and one charge
     try:
-        response = await chat.send_message(user_message)
-        
-        # Parse flashcards
-        flashcards = []
-        try:
-            # Try to extract JSON from response
-            import re
-            json_match = re.search(r'\[.*\]', response, re.DOTALL)
-            if json_match:
-                flashcards = json.loads(json_match.group())
-        except:
-            # Fallback: parse manually
-            flashcards = [{"question": "Question 1", "answer": response}]
-        
-        # Save flashcards
-        study_material = StudyMaterial(
-            user_id=current_user.id,
-            document_id=document_id,
-            type="flashcard",
-            content={"flashcards": flashcards, "document_name": document['filename']}
-        )
-        
-        material_dict = study_material.model_dump()
-        material_dict['created_at'] = material_dict['created_at'].isoformat()
-        await db.study_materials.insert_one(material_dict)
-        
-        await deduct_credits(current_user.id, 2)
-        
-        return study_material
-    
+        return await generate_study_material(current_user.id, document, "flashcard")
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error generating flashcards: {str(e)}")
 
@@ -898,6 +1034,7 @@ async def ask_question(
     request: Request,
     current_user: User = Depends(get_current_user)
 ):
+    """Q&A endpoint; `"stream": true` answers with Server-Sent Events"""
     await check_credits(current_user, 1)
     
     data = await request.json()
@@ -909,35 +1046,67 @@ async def ask_question(
     
     # Get document if provided
     context_message = question
-    file_content = None
+    files = []
     
     if document_id:
         document = await db.documents.find_one({"id": document_id, "user_id": current_user.id})
         if document:
-            file_content = FileContentWithMimeType(
-                file_path=document['file_path'],
-                mime_type=document['file_type']
-            )
+            files.append((document['file_path'], document['file_type']))
     
     # Answer question using AI
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"qa_{current_user.id}",
-        system_message="You are an expert homework assistant. Provide detailed, educational answers to questions. Explain concepts clearly."
-    ).with_model("gemini", "gemini-2.0-flash")
-    
-    user_message = UserMessage(
-        text=context_message,
-        file_contents=[file_content] if file_content else []
-    )
+    system_message = "You are an expert homework assistant. Provide detailed, educational answers to questions. Explain concepts clearly."
+    
+    if data.get('stream'):
+        async def events():
+            yield sse_event('start', {'question': question})
+            try:
+                answer = []
+                async for delta in llm_gateway.stream(text=context_message, system_message=system_message, files=files):
+                    answer.append(delta)
+                    yield sse_event('delta', {'text': delta})
+                
+                await deduct_credits(current_user.id, 1)
+                
+                yield sse_event('done', {
+                    'answer': ''.join(answer),
+                    'question': question,
+                    'credits_used': 1,
+                    'credits_remaining': current_user.credits - 1
+                })
+            except Exception as e:
+                yield sse_event('error', {'detail': f"Error answering question: {str(e)}"})
+        
+        return sse_response(events())
+    
+    try:
+        response = await llm_gateway.complete(text=context_message, system_message=system_message, files=files)
+        
+        await deduct_credits(current_user.id, 1)
+        
+        return {"answer": response, "question": question}
+    
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
 
+def format_rag_sources(sources: List[dict], documents: List[dict]) -> List[dict]:
+    # Get document filenames for sources
+    doc_map = {doc['id']: doc['filename'] for doc in documents}
+    return [
+        {
+            "document_id": source['document_id'],
+            "filename": doc_map.get(source['document_id'], 'Unknown'),
+            "page": source.get('page'),
+            "page_end": source.get('page_end')
+        }
+        for source in sources
+    ]
 
 @api_router.post("/ai/qa-rag")
 async def ask_question_rag(
     request: Request,
     current_user: User = Depends(get_current_user)
 ):
-    """RAG-enhanced Q&A endpoint"""
+    """RAG-enhanced Q&A endpoint; `"stream": true` answers with Server-Sent Events"""
     await check_credits(current_user, 1)
     
     data = await request.json()
@@ -949,68 +1118,103 @@ async def ask_question_rag(
     
     try:
         # Get documents for this session
-        documents = await db.documents.find({
-            "user_id": current_user.id,
-            "$or": [
-                {"session_id": session_id},
-                {"is_global": True}
-            ]
-        }).to_list(100)
+        documents = await document_scopes.resolve(current_user.id, session_id)
         
         if not documents:
             raise HTTPException(status_code=400, detail="No documents found. Please upload documents first.")
         
-        document_ids = [doc['id'] for doc in documents]
-        
-        # Search for relevant chunks
-        relevant_chunks = await rag_service.search_similar_chunks(
-            query=question,
-            document_ids=document_ids,
-            user_id=current_user.id,
-            top_k=5
+        # A near-identical question about the same documents reuses the
+        # cached answer without retrieval or an LLM call. The question is
+        # only embedded when the cache or vector retrieval will use it.
+        query_embedding = None
+        if answer_cache.enabled or rag_service.needs_query_embedding:
+            query_embedding = await rag_service.embed_query(question)
+        scope_key = await answer_cache.scope_key(
+            documents, rag_service.answer_system_message(current_user.age), rag_service.answer_model
         )
+        result = await answer_cache.lookup(current_user.id, scope_key, query_embedding)
+        cached = result is not None
+        credits_used = 1 if not cached or answer_cache.bill_hits else 0
         
-        if not relevant_chunks:
-            raise HTTPException(status_code=404, detail="No relevant information found in documents")
+        relevant_chunks = None
+        if not cached:
+            # Search for relevant chunks
+            relevant_chunks = await rag_service.retrieve_context(
+                query=question,
+                documents=documents,
+                user_id=current_user.id,
+                query_embedding=query_embedding
+            )
+            
+            if not relevant_chunks:
+                raise HTTPException(status_code=404, detail="No relevant information found in documents")
         
-        # Generate answer with context
-        result = await rag_service.generate_answer_with_context(
-            query=question,
-            relevant_chunks=relevant_chunks,
-            age=current_user.age
-        )
+        if data.get('stream'):
+            async def events():
+                yield sse_event('start', {'question': question, 'cached': cached})
+                try:
+                    if cached:
+                        final = result
+                        yield sse_event('delta', {'text': result['answer']})
+                    else:
+                        answer = []
+                        async for delta in rag_service.stream_answer_with_context(
+                            query=question,
+                            relevant_chunks=relevant_chunks,
+                            age=current_user.age
+                        ):
+                            answer.append(delta)
+                            yield sse_event('delta', {'text': delta})
+                        final = {
+                            'answer': ''.join(answer),
+                            'sources': rag_service.answer_sources(relevant_chunks),
+                            'context_used': len(relevant_chunks)
+                        }
+                        await answer_cache.store(
+                            current_user.id, session_id, scope_key, documents, question, query_embedding, final
+                        )
+                    
+                    if credits_used:
+                        await deduct_credits(current_user.id, credits_used)
+                    
+                    yield sse_event('done', {
+                        'answer': final['answer'],
+                        'question': question,
+                        'sources': format_rag_sources(final['sources'], documents),
+                        'context_chunks_used': final['context_used'],
+                        'cached': cached,
+                        'credits_used': credits_used,
+                        'credits_remaining': current_user.credits - credits_used
+                    })
+                except Exception as e:
+                    yield sse_event('error', {'detail': f"Error answering question: {str(e)}"})
+            
+            return sse_response(events())
         
-        await deduct_credits(current_user.id, 1)
+        if not cached:
+            # Generate answer with context
+            result = await rag_service.generate_answer_with_context(
+                query=question,
+                relevant_chunks=relevant_chunks,
+                age=current_user.age
+            )
+            await answer_cache.store(
+                current_user.id, session_id, scope_key, documents, question, query_embedding, result
+            )
         
-        # Get document filenames for sources
-        doc_map = {doc['id']: doc['filename'] for doc in documents}
-        sources = [
-            {
-                "document_id": source['document_id'],
-                "filename": doc_map.get(source['document_id'], 'Unknown'),
-                "page": source.get('page')
-            }
-            for source in result['sources']
-        ]
+        if credits_used:
+            await deduct_credits(current_user.id, credits_used)
         
         return {
             "answer": result['answer'],
             "question": question,
-            "sources": sources,
-            "context_chunks_used": result['context_used']
+            "sources": format_rag_sources(result['sources'], documents),
+            "context_chunks_used": result['context_used'],
+            "cached": cached
         }
     
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
-
-    
-    try:
-        response = await chat.send_message(user_message)
-        
-        await deduct_credits(current_user.id, 1)
-        
-        return {"answer": response, "question": question}
-    
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error answering question: {str(e)}")
 
@@ -1025,54 +1229,147 @@ async def create_mindmap(
     if not document:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    # Create mindmap using AI
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"mindmap_{document_id}",
-        system_message="You are an expert study assistant. Create hierarchical mindmaps from documents."
-    ).with_model("gemini", "gemini-2.0-flash")
-    
-    file_content = FileContentWithMimeType(
-        file_path=document['file_path'],
-        mime_type=document['file_type']
-    )
-    
-    user_message = UserMessage(
-        text="Create a mindmap from this document. Return it in JSON format with a hierarchical structure: {\"title\": \"Main Topic\", \"children\": [{\"title\": \"Subtopic 1\", \"children\": [...]}, ...]}",
-        file_contents=[file_content]
+    # Concurrent requests for the same material share one generation and one charge
+    try:
+        return await generate_study_material(current_user.id, document, "mindmap")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error generating mindmap: {str(e)}")
+
+
+# Study pack: summary, flashcards and mindmap from one structured call.
+# Parts are stored under the single-material prompt versions, so the
+# individual endpoints and the pack share cached material.
+STUDY_PACK_ATTEMPTS = int(os.environ.get('STUDY_PACK_ATTEMPTS', '2'))
+
+async def generate_study_pack(document: dict, material_types: List[str]) -> dict:
+    parts = "\n".join(f'- "{STUDY_PACK_PARTS[t][0]}": {STUDY_PACK_PARTS[t][1]}' for t in material_types)
+    text = (
+        f"Create study material from this document '{document['filename']}'. "
+        f"Return only one JSON object, without markdown fences, with exactly these fields:\n{parts}"
     )
+    system_message = "You are an expert study assistant. Create summaries, flashcards and mindmaps from documents, and reply with strictly valid JSON."
+    error = None
+    for attempt in range(STUDY_PACK_ATTEMPTS):
+        prompt = text if error is None else f"{text}\n\nYour previous reply was invalid ({error}). Follow the format exactly."
+        response = await complete_about_document(document, prompt, system_message)
+        try:
+            return parse_study_pack(response, material_types)
+        except ValueError as e:
+            # pydantic's ValidationError is a ValueError
+            error = ' '.join(str(e).split())[:300]
+    raise ValueError(f"Invalid study pack after {STUDY_PACK_ATTEMPTS} attempts: {error}")
+
+@api_router.post("/ai/study-pack/{document_id}")
+async def create_study_pack(
+    document_id: str,
+    current_user: User = Depends(get_current_user)
+):
+    """Summary, flashcards and mindmap of a document. Materials the user
+    already has, or that the shared material cache holds, are reused; the
+    rest come from one LLM call and are stored in one bulk write."""
+    document = await db.documents.find_one({"id": document_id, "user_id": current_user.id})
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
     
-    try:
-        response = await chat.send_message(user_message)
+    async def load_materials():
+        materials = await db.study_materials.find({
+            "document_id": document_id,
+            "user_id": current_user.id,
+            "type": {"$in": list(STUDY_PACK_PARTS)}
+        }, {"_id": 0}).sort("created_at", 1).to_list(None)
+        pack = {}
+        for material in materials:
+            pack.setdefault(material['type'], material)
+        return pack
+    
+    async def load_pack(_):
+        pack = await load_materials()
+        return pack if len(pack) == len(STUDY_PACK_PARTS) else None
+    
+    # Only the parts the user does not have yet are paid for
+    pack = await load_materials()
+    missing = [material_type for material_type in STUDY_PACK_PARTS if material_type not in pack]
+    if not missing:
+        return pack
+    await check_credits(current_user, 2 * len(missing))
+    
+    async def generate():
+        pack = await load_materials()
+        missing = [material_type for material_type in STUDY_PACK_PARTS if material_type not in pack]
+        if not missing:
+            return pack, document_id
         
-        # Parse mindmap
-        mindmap = {}
-        try:
-            import re
-            json_match = re.search(r'\{.*\}', response, re.DOTALL)
-            if json_match:
-                mindmap = json.loads(json_match.group())
-        except:
-            mindmap = {"title": document['filename'], "children": []}
+        content_hash = document.get('content_hash')
+        use_cache = material_cache.enabled and bool(content_hash)
+        contents, cache_keys = {}, {}
+        for material_type in missing:
+            if use_cache:
+                key = material_cache.key(content_hash, material_type, STUDY_MATERIAL_PROMPTS[material_type]["version"], llm_gateway.model)
+                content = await material_cache.get(key)
+                if content is not None:
+                    contents[material_type] = content
+                    cache_keys[material_type] = key
         
-        # Save mindmap
-        study_material = StudyMaterial(
-            user_id=current_user.id,
-            document_id=document_id,
-            type="mindmap",
-            content={"mindmap": mindmap, "document_name": document['filename']}
-        )
+        to_generate = [material_type for material_type in missing if material_type not in contents]
+        if to_generate:
+            generated = await generate_study_pack(document, to_generate)
+            for material_type in to_generate:
+                content = generated[material_type]
+                if use_cache:
+                    version = STUDY_MATERIAL_PROMPTS[material_type]["version"]
+                    content = await material_cache.put(content_hash, material_type, version, llm_gateway.model, content)
+                    cache_keys[material_type] = material_cache.key(content_hash, material_type, version, llm_gateway.model)
+                contents[material_type] = content
         
-        material_dict = study_material.model_dump()
-        material_dict['created_at'] = material_dict['created_at'].isoformat()
-        await db.study_materials.insert_one(material_dict)
+        study_materials = [
+            StudyMaterial(
+                user_id=current_user.id,
+                document_id=document_id,
+                type=material_type,
+                content={**contents[material_type], "document_name": document['filename']},
+                cache_key=cache_keys.get(material_type)
+            )
+            for material_type in missing
+        ]
+        material_dicts = []
+        for study_material in study_materials:
+            material_dict = study_material.model_dump()
+            material_dict['created_at'] = material_dict['created_at'].isoformat()
+            material_dicts.append(material_dict)
+        try:
+            await db.study_materials.insert_many(material_dicts, ordered=False)
+            inserted = study_materials
+        except BulkWriteError as e:
+            if any(error.get('code') != 11000 for error in e.details.get('writeErrors', [])):
+                raise
+            # The single-material endpoints run under their own flights and
+            # may have stored a part meanwhile; theirs is kept, and this
+            # request is not charged for it
+            stored = await load_materials()
+            pack.update(stored)
+            inserted = [
+                study_material for study_material in study_materials
+                if stored.get(study_material.type, {}).get('id') == study_material.id
+            ]
         
-        await deduct_credits(current_user.id, 2)
+        charged = sum(
+            1 for study_material in inserted
+            if study_material.type in to_generate or material_cache.bill_hits
+        )
+        if charged:
+            await deduct_credits(current_user.id, 2 * charged)
         
-        return study_material
+        for study_material in inserted:
+            pack[study_material.type] = study_material
+        return pack, document_id
     
+    # Concurrent requests for the same pack share one generation and one charge
+    try:
+        return await generation_flights.run(
+            f"study_pack:{current_user.id}:{document_id}", generate, load_pack
+        )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error generating mindmap: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Error generating study pack: {str(e)}")
 
 
 @api_router.post("/homework/solve")
@@ -1095,9 +1392,10 @@ async def solve_homework(
     file_extension = Path(file.filename).suffix
     file_path = upload_dir / f"{file_id}{file_extension}"
     
-    with file_path.open("wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
+    try:
+        await save_upload(file, file_path)
+    except UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail=str(e))
     
     # Save homework image as a message
     image_message = {
@@ -1111,24 +1409,12 @@ async def solve_homework(
     await db.chat_messages.insert_one(image_message)
     
     # Use AI to solve homework from image
-    chat = LlmChat(
-        api_key=EMERGENT_LLM_KEY,
-        session_id=f"homework_{file_id}",
-        system_message=f"You are an expert homework tutor. Analyze the homework question in the image and provide a clear, step-by-step solution. The student is {current_user.age} years old, so tailor the explanation appropriately."
-    ).with_model("gemini", "gemini-2.0-flash")
-    
-    file_content = FileContentWithMimeType(
-        file_path=str(file_path),
-        mime_type=file.content_type
-    )
-    
-    user_message = UserMessage(
-        text="Please analyze this homework question and provide a detailed solution with step-by-step explanations. Include the final answer clearly.",
-        file_contents=[file_content]
-    )
-    
     try:
-        solution = await chat.send_message(user_message)
+        solution = await llm_gateway.complete(
+            text="Please analyze this homework question and provide a detailed solution with step-by-step explanations. Include the final answer clearly.",
+            system_message=f"You are an expert homework tutor. Analyze the homework question in the image and provide a clear, step-by-step solution. The student is {current_user.age} years old, so tailor the explanation appropriately.",
+            files=[(str(file_path), file.content_type)]
+        )
         
         # Save solution as assistant message
         solution_message = {
@@ -1450,6 +1736,46 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def ensure_study_material_indexes():
+    """At most one summary, flashcard set and mindmap per user and
+    document. Duplicates stored before the index existed keep their
+    oldest row."""
+    types = list(STUDY_PACK_PARTS)
+    duplicates = await db.study_materials.aggregate([
+        {"$match": {"type": {"$in": types}}},
+        {"$sort": {"created_at": 1}},
+        {"$group": {
+            "_id": {"user_id": "$user_id", "document_id": "$document_id", "type": "$type"},
+            "ids": {"$push": "$id"}
+        }},
+        {"$match": {"ids.1": {"$exists": True}}}
+    ]).to_list(None)
+    for duplicate in duplicates:
+        await db.study_materials.delete_many({"id": {"$in": duplicate["ids"][1:]}})
+    await db.study_materials.create_index(
+        [("user_id", 1), ("document_id", 1), ("type", 1)],
+        unique=True,
+        partialFilterExpression={"type": {"$in": types}}
+    )
+
+@app.on_event("startup")
+async def start_ingestion_workers():
+    await ensure_study_material_indexes()
+    await blob_store.ensure_indexes()
+    await rag_service.ensure_indexes()
+    await answer_cache.ensure_indexes()
+    await document_scopes.ensure_indexes()
+    await generation_flights.ensure_indexes()
+    await material_cache.ensure_indexes()
+    await section_summaries.ensure_indexes()
+    await rag_service.start()
+    await ingestion_service.start()
+    await pregeneration.start(run_pregeneration_job)
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    await pregeneration.stop()
+    await ingestion_service.stop()
+    await rag_service.aclose()
+    shutdown_executor()
     client.close()
\ No newline at end of file
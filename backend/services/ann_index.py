@@ -0,0 +1,447 @@
+"""
+Per-user approximate nearest neighbour index over document_chunks.
+
+Each user gets an IVF (inverted file) index: chunk vectors are grouped
+under k-means centroids and a query only scores the lists of the
+`ANN_NPROBE` closest centroids, so latency follows the size of the probed
+lists rather than the whole corpus. Scopes small enough to scan exactly
+(`ANN_EXACT_LIMIT` chunks) skip the centroids altogether.
+
+Mongo stays the source of truth. An index records the `ingested_at` of
+every blob it holds and is reconciled against `blobs` and `documents` on
+load and before each search, so indexes are rebuilt incrementally after
+a crash, a lost file or ingestion in another process. Removed blobs are
+tombstoned; compaction (dropping tombstones and retraining centroids as
+the index grows) runs in a worker thread in the background. Indexes are
+written to ANN_INDEX_DIR every ANN_FLUSH_INTERVAL seconds and on shutdown.
+"""
+
+import os
+import re
+import asyncio
+import logging
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+from services.embedding_codec import EMBEDDING_FIELDS, HAS_EMBEDDING, decode_float32
+
+logger = logging.getLogger(__name__)
+
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1, norms)
+
+
+def _nearest(vectors: np.ndarray, centroids: np.ndarray, block_rows: int = 8192) -> np.ndarray:
+    return np.concatenate([
+        np.argmax(vectors[start:start + block_rows] @ centroids.T, axis=1)
+        for start in range(0, len(vectors), block_rows)
+    ]).astype(np.int32)
+
+
+def _train_centroids(vectors: np.ndarray, count: int, iterations: int = 8, seed: int = 0) -> np.ndarray:
+    """Spherical k-means on a sample of `vectors` (unit rows)"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), min(len(vectors), count * 40), replace=False)]
+    centroids = sample[rng.choice(len(sample), count, replace=False)].copy()
+    for _ in range(iterations):
+        assign = _nearest(sample, centroids)
+        order = np.argsort(assign, kind='stable')
+        clusters, starts = np.unique(assign[order], return_index=True)
+        centroids[clusters] = _normalize(np.add.reduceat(sample[order], starts, axis=0))
+    return centroids
+
+
+class _UserIndex:
+    """IVF lists over one user's chunk vectors, with tombstones"""
+
+    def __init__(self):
+        self.size = 0
+        self.vectors = np.zeros((0, 0), dtype=np.float32)
+        self.owners = np.zeros(0, dtype=np.int32)
+        self.deleted = np.zeros(0, dtype=bool)
+        self.assign = np.zeros(0, dtype=np.int32)
+        self.ids: List[str] = []
+        self.hashes: List[str] = []
+        self.hash_codes: Dict[str, int] = {}
+        self.versions: Dict[str, str] = {}
+        self.centroids: Optional[np.ndarray] = None
+        self.lists: List[np.ndarray] = []
+        self.trained_on = 0
+        self.tombstones = 0
+        self.dirty = False
+        self.compacting = False
+
+    @property
+    def live(self) -> int:
+        return self.size - self.tombstones
+
+    @property
+    def nbytes(self) -> int:
+        return self.vectors.nbytes + self.owners.nbytes + self.deleted.nbytes + self.assign.nbytes
+
+    def _reserve(self, rows: int, dimensions: int):
+        if self.vectors.shape[1] != dimensions and self.size == 0:
+            self.vectors = np.zeros((0, dimensions), dtype=np.float32)
+        needed = self.size + rows
+        if needed <= len(self.vectors):
+            return
+        capacity = max(needed, 2 * len(self.vectors), 1024)
+
+        def grow(array: np.ndarray) -> np.ndarray:
+            grown = np.zeros((capacity,) + array.shape[1:], dtype=array.dtype)
+            grown[:self.size] = array[:self.size]
+            return grown
+
+        self.vectors = grow(self.vectors)
+        self.owners = grow(self.owners)
+        self.deleted = grow(self.deleted)
+        self.assign = grow(self.assign)
+
+    def add(self, content_hash: str, version: str, ids: List[str], matrix: np.ndarray):
+        """Replace the chunks of `content_hash` with `ids`/`matrix`"""
+        self.remove(content_hash)
+        self.versions[content_hash] = version
+        if not ids:
+            return
+        if content_hash not in self.hash_codes:
+            self.hash_codes[content_hash] = len(self.hashes)
+            self.hashes.append(content_hash)
+
+        matrix = _normalize(matrix.astype(np.float32))
+        self._reserve(len(ids), matrix.shape[1])
+        rows = np.arange(self.size, self.size + len(ids))
+        self.vectors[rows] = matrix
+        self.owners[rows] = self.hash_codes[content_hash]
+        self.deleted[rows] = False
+        self.ids.extend(ids)
+        self.size += len(ids)
+
+        if self.centroids is not None:
+            assign = _nearest(matrix, self.centroids)
+            self.assign[rows] = assign
+            for cluster in np.unique(assign):
+                self.lists[cluster] = np.concatenate([self.lists[cluster], rows[assign == cluster]])
+        self.dirty = True
+
+    def remove(self, content_hash: str):
+        self.versions.pop(content_hash, None)
+        code = self.hash_codes.get(content_hash)
+        if code is None:
+            return
+        rows = np.flatnonzero((self.owners[:self.size] == code) & ~self.deleted[:self.size])
+        if len(rows):
+            self.deleted[rows] = True
+            self.tombstones += len(rows)
+            self.dirty = True
+
+    def search(self, query: np.ndarray, content_hashes: List[str], top_k: int,
+               nprobe: int, exact_limit: int) -> List[tuple]:
+        """(chunk id, cosine score) of the best chunks owned by `content_hashes`"""
+        codes = [self.hash_codes[h] for h in content_hashes if h in self.hash_codes]
+        if not codes or self.size == 0:
+            return []
+        in_scope = np.isin(self.owners[:self.size], codes) & ~self.deleted[:self.size]
+
+        in_scope_count = np.count_nonzero(in_scope)
+        if in_scope_count > self.size // 2 and (self.centroids is None or in_scope_count <= exact_limit):
+            # Mostly in scope: one contiguous matmul beats gathering rows
+            scores = self.vectors[:self.size] @ query
+            rows = np.flatnonzero(in_scope)
+            scores = scores[rows]
+        elif self.centroids is None or in_scope_count <= exact_limit:
+            rows = np.flatnonzero(in_scope)
+            scores = self.vectors[rows] @ query
+        else:
+            # Widen the probe when the scope is a small part of the index
+            order = np.argsort(-(self.centroids @ query))
+            probe = nprobe
+            while True:
+                rows = np.concatenate([self.lists[cluster] for cluster in order[:probe]])
+                rows = rows[in_scope[rows]]
+                if len(rows) >= 4 * top_k or probe >= len(order):
+                    break
+                probe *= 2
+            scores = self.vectors[rows] @ query
+        if not len(rows):
+            return []
+
+        k = min(top_k, len(rows))
+        top = np.argpartition(-scores, k - 1)[:k]
+        return [(self.ids[rows[i]], float(scores[i])) for i in top]
+
+    def needs_compaction(self, min_train: int) -> bool:
+        if self.tombstones > 0.25 * self.size:
+            return True
+        if self.centroids is None:
+            return self.live >= min_train
+        return self.live > 2 * self.trained_on
+
+    def compacted(self, min_train: int) -> '_UserIndex':
+        """Copy without tombstones, with centroids retrained for its size"""
+        keep = np.flatnonzero(~self.deleted[:self.size])
+        index = _UserIndex()
+        index.vectors = self.vectors[keep].copy()
+        index.size = len(keep)
+        index.ids = [self.ids[row] for row in keep]
+        live_codes = np.unique(self.owners[keep])
+        index.hashes = [self.hashes[code] for code in live_codes]
+        index.hash_codes = {content_hash: code for code, content_hash in enumerate(index.hashes)}
+        index.owners = np.searchsorted(live_codes, self.owners[keep]).astype(np.int32)
+        index.deleted = np.zeros(index.size, dtype=bool)
+        index.versions = dict(self.versions)
+        if index.size >= min_train:
+            index.centroids = _train_centroids(index.vectors, int(np.sqrt(index.size)))
+            index.assign = _nearest(index.vectors, index.centroids)
+            index.trained_on = index.size
+        else:
+            index.assign = np.zeros(index.size, dtype=np.int32)
+        index._build_lists()
+        return index
+
+    def _build_lists(self):
+        if self.centroids is None:
+            self.lists = []
+            return
+        order = np.argsort(self.assign[:self.size], kind='stable')
+        bounds = np.searchsorted(self.assign[:self.size][order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[c]:bounds[c + 1]] for c in range(len(self.centroids))]
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix('.tmp')
+        with open(tmp_path, 'wb') as f:
+            np.savez(
+                f,
+                vectors=self.vectors[:self.size],
+                owners=self.owners[:self.size],
+                deleted=self.deleted[:self.size],
+                assign=self.assign[:self.size],
+                ids=np.array(self.ids, dtype=str),
+                hashes=np.array(self.hashes, dtype=str),
+                version_hashes=np.array(list(self.versions), dtype=str),
+                version_values=np.array(list(self.versions.values()), dtype=str),
+                centroids=self.centroids if self.centroids is not None else np.zeros((0, 0), dtype=np.float32),
+                trained_on=np.array(self.trained_on)
+            )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> '_UserIndex':
+        index = cls()
+        with np.load(path, allow_pickle=False) as data:
+            index.vectors = data['vectors']
+            index.size = len(index.vectors)
+            index.owners = data['owners']
+            index.deleted = data['deleted']
+            index.assign = data['assign']
+            index.ids = data['ids'].tolist()
+            index.hashes = data['hashes'].tolist()
+            index.versions = dict(zip(data['version_hashes'].tolist(), data['version_values'].tolist()))
+            if data['centroids'].size:
+                index.centroids = data['centroids']
+            index.trained_on = int(data['trained_on'])
+        index.hash_codes = {content_hash: code for code, content_hash in enumerate(index.hashes)}
+        index.tombstones = int(np.count_nonzero(index.deleted))
+        index._build_lists()
+        return index
+
+
+class AnnVectorIndex:
+    """Per-user IVF indexes, with `fallback` (a LocalVectorIndex) serving
+    blobs that are still being ingested and pre content-hash documents"""
+
+    def __init__(self, db, fallback, directory: Optional[str] = None):
+        self.db = db
+        self.fallback = fallback
+        self.directory = Path(directory or os.environ.get('ANN_INDEX_DIR', '/app/cache/ann'))
+        self.nprobe = int(os.environ.get('ANN_NPROBE', '16'))
+        self.min_train = int(os.environ.get('ANN_MIN_TRAIN', '20000'))
+        self.exact_limit = int(os.environ.get('ANN_EXACT_LIMIT', '20000'))
+        self.flush_interval = float(os.environ.get('ANN_FLUSH_INTERVAL', '30'))
+        self.max_bytes = int(os.environ.get('ANN_INDEX_MAX_BYTES', str(1024 ** 3)))
+        self._indexes: 'OrderedDict[str, _UserIndex]' = OrderedDict()
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._tasks = set()
+        self._flusher: Optional[asyncio.Task] = None
+
+    def _path(self, user_id: str) -> Path:
+        return self.directory / f"{re.sub(r'[^A-Za-z0-9_-]', '_', user_id)}.npz"
+
+    def _lock(self, user_id: str) -> asyncio.Lock:
+        return self._locks.setdefault(user_id, asyncio.Lock())
+
+    def _spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def start(self):
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    async def stop(self):
+        if self._flusher is not None:
+            self._flusher.cancel()
+            await asyncio.gather(self._flusher, return_exceptions=True)
+            self._flusher = None
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.flush()
+
+    async def flush(self):
+        for user_id in list(self._indexes):
+            await self._save(user_id)
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Flushing ANN indexes failed: {e}")
+
+    async def _save(self, user_id: str, index: Optional[_UserIndex] = None):
+        async with self._lock(user_id):
+            index = index or self._indexes.get(user_id)
+            if index is not None and index.dirty:
+                index.dirty = False
+                try:
+                    await asyncio.to_thread(index.save, self._path(user_id))
+                except Exception:
+                    index.dirty = True
+                    raise
+
+    def _remember(self, user_id: str, index: _UserIndex):
+        self._indexes[user_id] = index
+        self._indexes.move_to_end(user_id)
+        while len(self._indexes) > 1 and sum(i.nbytes for i in self._indexes.values()) > self.max_bytes:
+            evicted_user, evicted = self._indexes.popitem(last=False)
+            if evicted.dirty:
+                self._spawn(self._save(evicted_user, evicted))
+
+    async def _index(self, user_id: str) -> _UserIndex:
+        index = self._indexes.get(user_id)
+        if index is not None:
+            self._indexes.move_to_end(user_id)
+            return index
+        async with self._lock(user_id):
+            if user_id in self._indexes:
+                return self._indexes[user_id]
+            index = _UserIndex()
+            path = self._path(user_id)
+            if path.exists():
+                try:
+                    index = await asyncio.to_thread(_UserIndex.load, path)
+                except Exception as e:
+                    logger.warning(f"Discarding unreadable ANN index {path}: {e}")
+            # Drop blobs the user no longer has; missing ones are added on search
+            owned = set(await self.db.documents.distinct('content_hash', {'user_id': user_id}))
+            for content_hash in [h for h in index.versions if h not in owned]:
+                index.remove(content_hash)
+            self._remember(user_id, index)
+            self._maybe_compact(user_id, index)
+            return index
+
+    async def _add(self, user_id: str, versions: Dict[str, str]):
+        async with self._lock(user_id):
+            index = self._indexes.get(user_id)
+            if index is None:
+                return
+            for content_hash, version in versions.items():
+                if index.versions.get(content_hash) == version:
+                    continue
+                chunks = await self.db.document_chunks.find(
+                    {'content_hash': content_hash, **HAS_EMBEDDING},
+                    {'_id': 0, 'id': 1, 'embedding': 1, 'embedding_f32': 1}
+                ).to_list(None)
+                matrix = None
+                if chunks:
+                    matrix = await asyncio.to_thread(lambda: np.vstack([decode_float32(c) for c in chunks]))
+                index.add(content_hash, version, [c['id'] for c in chunks], matrix)
+            self._maybe_compact(user_id, index)
+
+    def _maybe_compact(self, user_id: str, index: _UserIndex):
+        if index.needs_compaction(self.min_train) and not index.compacting:
+            index.compacting = True
+            self._spawn(self._compact(user_id))
+
+    async def _compact(self, user_id: str):
+        async with self._lock(user_id):
+            index = self._indexes.get(user_id)
+            if index is None:
+                return
+            try:
+                compacted = await asyncio.to_thread(index.compacted, self.min_train)
+            except Exception as e:
+                index.compacting = False
+                logger.error(f"Compacting ANN index for {user_id} failed: {e}")
+                return
+            compacted.dirty = True
+            self._remember(user_id, compacted)
+            logger.info(
+                f"Compacted ANN index for {user_id}: {compacted.size} chunks, "
+                f"{0 if compacted.centroids is None else len(compacted.centroids)} lists"
+            )
+        await self._save(user_id)
+
+    async def blob_ingested(self, content_hash: str, ingested_at: str):
+        """Add a freshly ingested blob to the loaded indexes of its owners"""
+        for user_id in await self.db.documents.distinct('user_id', {'content_hash': content_hash}):
+            if user_id in self._indexes:
+                await self._add(user_id, {content_hash: ingested_at})
+
+    async def document_removed(self, user_id: str, content_hash: str):
+        """Tombstone a blob once the user holds no document with it"""
+        if user_id not in self._indexes:
+            return
+        if await self.db.documents.count_documents({'user_id': user_id, 'content_hash': content_hash}, limit=1):
+            return
+        async with self._lock(user_id):
+            index = self._indexes.get(user_id)
+            if index is not None:
+                index.remove(content_hash)
+                self._maybe_compact(user_id, index)
+
+    async def search(self, query_embedding: List[float], documents: List[Dict[str, Any]],
+                     user_id: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k chunks by cosine similarity, with content but no embedding"""
+        content_hashes = list({doc['content_hash'] for doc in documents if doc.get('content_hash')})
+        blobs = await self.db.blobs.find(
+            {'content_hash': {'$in': content_hashes}},
+            {'_id': 0, 'content_hash': 1, 'ingested_at': 1}
+        ).to_list(None)
+        ready = {blob['content_hash']: blob['ingested_at'] for blob in blobs if blob.get('ingested_at')}
+
+        index = await self._index(user_id)
+        stale = {h: version for h, version in ready.items() if index.versions.get(h) != version}
+        if stale:
+            await self._add(user_id, stale)
+            index = self._indexes.get(user_id, index)
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        hits = dict(index.search(query, list(ready), top_k, self.nprobe, self.exact_limit))
+        chunks = await self.db.document_chunks.find(
+            {'id': {'$in': list(hits)}},
+            {'_id': 0, **{field: 0 for field in EMBEDDING_FIELDS}}
+        ).to_list(len(hits))
+        for chunk in chunks:
+            chunk['score'] = hits[chunk['id']]
+
+        pending = [doc for doc in documents if doc.get('content_hash') not in ready]
+        if pending:
+            chunks += await self.fallback.search(query_embedding, pending, user_id, top_k)
+        chunks.sort(key=lambda chunk: chunk['score'], reverse=True)
+        return chunks[:top_k]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'users': len(self._indexes),
+            'chunks': sum(index.live for index in self._indexes.values()),
+            'tombstones': sum(index.tombstones for index in self._indexes.values()),
+            'bytes': sum(index.nbytes for index in self._indexes.values()),
+            'max_bytes': self.max_bytes
+        }
@@ -0,0 +1,119 @@
+import os
+import uuid
+import hashlib
+from datetime import datetime, timezone, timedelta
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+
+class AnswerCache:
+    """Semantic cache of RAG answers in the `answer_cache` collection.
+
+    Entries are scoped by user and a key over the documents in scope (id,
+    content and ingestion version), the system prompt and the model, so an
+    answer is only reused for the same material and the same audience.
+    Within a scope, a question matches a cached one when their embeddings'
+    cosine similarity reaches ANSWER_CACHE_THRESHOLD. Uploads and deletions
+    drop the affected entries; the rest expire after ANSWER_CACHE_TTL.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.enabled = os.environ.get('ANSWER_CACHE_ENABLED', 'true').lower() == 'true'
+        self.threshold = float(os.environ.get('ANSWER_CACHE_THRESHOLD', '0.95'))
+        self.ttl = int(os.environ.get('ANSWER_CACHE_TTL', str(7 * 24 * 3600)))
+        self.max_per_scope = int(os.environ.get('ANSWER_CACHE_MAX_PER_SCOPE', '200'))
+        self.bill_hits = os.environ.get('ANSWER_CACHE_BILL_HITS', 'false').lower() == 'true'
+        self.hits = 0
+        self.misses = 0
+
+    async def ensure_indexes(self):
+        await self.db.answer_cache.create_index([('user_id', 1), ('scope_key', 1), ('created_at', -1)])
+        await self.db.answer_cache.create_index([('user_id', 1), ('document_ids', 1)])
+        await self.db.answer_cache.create_index('expires_at', expireAfterSeconds=0)
+
+    async def scope_key(self, documents: List[Dict[str, Any]], system_message: str, model: str) -> str:
+        content_hashes = [doc['content_hash'] for doc in documents if doc.get('content_hash')]
+        blobs = await self.db.blobs.find(
+            {'content_hash': {'$in': content_hashes}},
+            {'_id': 0, 'content_hash': 1, 'ingested_at': 1}
+        ).to_list(None)
+        ingested = {blob['content_hash']: blob.get('ingested_at') for blob in blobs}
+        versions = sorted(
+            f"{doc['id']}:{doc.get('content_hash')}:{ingested.get(doc.get('content_hash'))}"
+            for doc in documents
+        )
+        key = '\n'.join([model, system_message, *versions])
+        return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+    async def lookup(self, user_id: str, scope_key: str, query_embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """Best cached answer in scope for a similar enough question"""
+        if not self.enabled or not query_embedding:
+            return None
+        entries = await self.db.answer_cache.find(
+            {'user_id': user_id, 'scope_key': scope_key},
+            {'_id': 0, 'id': 1, 'query_embedding': 1}
+        ).sort('created_at', -1).limit(self.max_per_scope).to_list(self.max_per_scope)
+        if not entries:
+            self.misses += 1
+            return None
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        matrix = np.vstack([np.frombuffer(entry['query_embedding'], dtype='<f4') for entry in entries])
+        scores = matrix @ query / (np.linalg.norm(matrix, axis=1) * (np.linalg.norm(query) or 1.0) + 1e-12)
+        best = int(np.argmax(scores))
+        if scores[best] < self.threshold:
+            self.misses += 1
+            return None
+
+        entry = await self.db.answer_cache.find_one(
+            {'id': entries[best]['id']},
+            {'_id': 0, 'query_embedding': 0}
+        )
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        entry['similarity'] = float(scores[best])
+        return entry
+
+    async def store(self, user_id: str, session_id: Optional[str], scope_key: str, documents: List[Dict[str, Any]],
+                    question: str, query_embedding: List[float], result: Dict[str, Any]):
+        if not self.enabled or not query_embedding:
+            return
+        now = datetime.now(timezone.utc)
+        await self.db.answer_cache.insert_one({
+            'id': str(uuid.uuid4()),
+            'user_id': user_id,
+            'scope_key': scope_key,
+            'document_ids': [doc['id'] for doc in documents],
+            'session_id': session_id,
+            'question': question,
+            'query_embedding': np.asarray(query_embedding, dtype='<f4').tobytes(),
+            'answer': result['answer'],
+            'sources': result['sources'],
+            'context_used': result['context_used'],
+            'created_at': now.isoformat(),
+            'expires_at': now + timedelta(seconds=self.ttl)
+        })
+
+    async def invalidate_document(self, user_id: str, document_id: str):
+        """Drop answers that drew on a deleted document"""
+        await self.db.answer_cache.delete_many({'user_id': user_id, 'document_ids': document_id})
+
+    async def invalidate_scope(self, user_id: str, session_id: Optional[str], is_global: bool):
+        """Drop answers whose scope gains a newly uploaded document"""
+        query = {'user_id': user_id}
+        if not is_global:
+            # Scopes are a session's documents plus the global ones
+            query['session_id'] = session_id
+        await self.db.answer_cache.delete_many(query)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,138 @@
+import os
+import asyncio
+import logging
+from datetime import datetime, timezone, timedelta
+from pathlib import Path
+from typing import Dict, Any, Optional, Tuple
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from services.extraction import delete_page_artifact
+
+logger = logging.getLogger(__name__)
+
+
+class BlobStore:
+    """Content-addressed storage for uploaded files.
+
+    Each distinct file (by SHA-256) is stored once as `<hash>.<ext>` and
+    tracked in the `blobs` collection with a reference count. Documents that
+    upload the same content share the file, its page artifact and its RAG
+    chunks; everything is removed when the last reference goes away.
+
+    Freeing a blob first marks its record `deleting`, then removes what
+    belongs to it, then the record. An upload of the same content in the
+    meantime waits for the record to go instead of reusing a file that is
+    about to be unlinked; a cleanup left unfinished for
+    BLOB_DELETE_TIMEOUT seconds (the worker died) is finished by it.
+    """
+
+    def __init__(self, db, upload_dir: Path):
+        self.db = db
+        self.upload_dir = upload_dir
+        self.delete_timeout = timedelta(seconds=float(os.environ.get('BLOB_DELETE_TIMEOUT', '60')))
+        self.poll_interval = 0.2
+
+    async def ensure_indexes(self):
+        await self.db.blobs.create_index('content_hash', unique=True)
+        await self.db.document_chunks.create_index([('content_hash', 1), ('chunk_index', 1)])
+        await self.db.documents.create_index('content_hash')
+
+    def blob_path(self, content_hash: str, extension: str) -> Path:
+        return self.upload_dir / f"{content_hash}.{extension}"
+
+    async def acquire(self, upload_path: Path, content_hash: str, file_type: str,
+                      file_size: int, extension: str) -> Tuple[Dict[str, Any], bool]:
+        """Take a reference on the blob for `content_hash`.
+
+        `upload_path` is the freshly streamed upload. It becomes the blob
+        file when this is the first reference and is discarded otherwise.
+        Returns the blob record and whether it was newly created.
+        """
+        while True:
+            try:
+                blob = await self._reference(content_hash, file_type, file_size, extension)
+                break
+            except DuplicateKeyError:
+                # Being freed (or a concurrent first upload won the insert)
+                await self._wait_for_delete(content_hash)
+        created = blob['ref_count'] == 1
+        if created:
+            upload_path.replace(blob['file_path'])
+        else:
+            upload_path.unlink(missing_ok=True)
+        return blob, created
+
+    async def _reference(self, content_hash: str, file_type: str, file_size: int, extension: str) -> Dict[str, Any]:
+        return await self.db.blobs.find_one_and_update(
+            {'content_hash': content_hash, 'deleting': {'$ne': True}},
+            {
+                '$inc': {'ref_count': 1},
+                '$setOnInsert': {
+                    'content_hash': content_hash,
+                    'file_path': str(self.blob_path(content_hash, extension)),
+                    'file_type': file_type,
+                    'file_size': file_size,
+                    'ingestion_job_id': None,
+                    'created_at': datetime.now(timezone.utc).isoformat()
+                }
+            },
+            upsert=True,
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _wait_for_delete(self, content_hash: str):
+        blob = await self.db.blobs.find_one({'content_hash': content_hash, 'deleting': True}, {'_id': 0})
+        if blob is None:
+            return
+        if datetime.fromisoformat(blob['deleting_at']) < datetime.now(timezone.utc) - self.delete_timeout:
+            await self._purge(blob)
+            return
+        await asyncio.sleep(self.poll_interval)
+
+    async def set_ingestion_job(self, content_hash: str, job_id: str):
+        await self.db.blobs.update_one(
+            {'content_hash': content_hash},
+            {'$set': {'ingestion_job_id': job_id}}
+        )
+
+    async def get(self, content_hash: str) -> Optional[Dict[str, Any]]:
+        return await self.db.blobs.find_one({'content_hash': content_hash}, {'_id': 0})
+
+    async def release(self, content_hash: str) -> bool:
+        """Drop one reference. Returns True if the blob was freed and its
+        file, page artifact, chunks, postings and the shared material and
+        section summaries generated from it were deleted."""
+        blob = await self.db.blobs.find_one_and_update(
+            {'content_hash': content_hash},
+            {'$inc': {'ref_count': -1}},
+            projection={'_id': 0},
+            return_document=ReturnDocument.AFTER
+        )
+        if blob is None or blob['ref_count'] > 0:
+            return False
+
+        # Only the caller that marks the blob cleans up; a concurrent upload
+        # may have taken a new reference in the meantime. Uploads wait for
+        # a marked blob to disappear, so nothing it owns is reused.
+        marked = await self.db.blobs.update_one(
+            {'content_hash': content_hash, 'ref_count': {'$lte': 0}, 'deleting': {'$ne': True}},
+            {'$set': {'deleting': True, 'deleting_at': datetime.now(timezone.utc).isoformat()}}
+        )
+        if marked.modified_count == 0:
+            return False
+        await self._purge(blob)
+        return True
+
+    async def _purge(self, blob: Dict[str, Any]):
+        """Delete a marked blob's file and derived data, then its record"""
+        content_hash = blob['content_hash']
+        Path(blob['file_path']).unlink(missing_ok=True)
+        delete_page_artifact(blob['file_path'])
+        await self.db.document_chunks.delete_many({'content_hash': content_hash})
+        await self.db.chunk_postings.delete_many({'content_hash': content_hash})
+        await self.db.material_cache.delete_many({'content_hash': content_hash})
+        await self.db.section_summaries.delete_many({'content_hash': content_hash})
+        await self.db.blobs.delete_one({'content_hash': content_hash, 'deleting': True})
@@ -0,0 +1,85 @@
+import asyncio
+import logging
+import os
+from typing import List, Dict, Any, Optional
+
+import bson
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+
+class BulkChunkWriter:
+    """Buffers documents and writes them with unordered insert_many.
+
+    A batch is flushed once it holds `max_docs` documents or `max_bytes` of
+    BSON. Flushes run in the background (one at a time) so the caller can
+    keep producing, e.g. embedding the next window of chunks, while the
+    previous batch is written. Per-document failures are collected in
+    `failures` instead of aborting the whole batch.
+    """
+
+    def __init__(self, collection, max_docs: Optional[int] = None, max_bytes: Optional[int] = None):
+        self.collection = collection
+        self.max_docs = max_docs or int(os.environ.get('CHUNK_WRITE_BATCH_DOCS', '500'))
+        self.max_bytes = max_bytes or int(os.environ.get('CHUNK_WRITE_BATCH_BYTES', str(8 * 1024 * 1024)))
+        self.inserted = 0
+        self.failures: List[Dict[str, Any]] = []
+        self._buffer: List[Dict[str, Any]] = []
+        self._buffer_bytes = 0
+        self._pending: Optional[asyncio.Task] = None
+
+    async def add(self, doc: Dict[str, Any]):
+        self._buffer.append(doc)
+        self._buffer_bytes += len(bson.encode(doc))
+        if len(self._buffer) >= self.max_docs or self._buffer_bytes >= self.max_bytes:
+            await self.flush()
+
+    async def flush(self):
+        """Hand the current buffer to a background insert_many"""
+        await self._wait_pending()
+        if not self._buffer:
+            return
+        batch, self._buffer, self._buffer_bytes = self._buffer, [], 0
+        self._pending = asyncio.create_task(self._write(batch))
+
+    async def close(self):
+        """Flush what is left and wait for every write to finish"""
+        await self.flush()
+        await self._wait_pending()
+
+    async def discard(self):
+        """Drop buffered documents and wait for an insert already under way,
+        so a caller cleaning up after a failure doesn't race it"""
+        self._buffer, self._buffer_bytes = [], 0
+        try:
+            await self._wait_pending()
+        except Exception as e:
+            logger.error(f"Bulk insert pending at discard failed: {e}")
+
+    async def _wait_pending(self):
+        if self._pending is not None:
+            task, self._pending = self._pending, None
+            await task
+
+    async def _write(self, batch: List[Dict[str, Any]]):
+        try:
+            result = await self.collection.insert_many(batch, ordered=False)
+            self.inserted += len(result.inserted_ids)
+        except BulkWriteError as e:
+            errors = e.details.get('writeErrors', [])
+            self.inserted += e.details.get('nInserted', len(batch) - len(errors))
+            for error in errors:
+                doc = batch[error['index']]
+                self.failures.append({
+                    'id': doc.get('id'),
+                    'chunk_index': doc.get('chunk_index'),
+                    'code': error.get('code'),
+                    'error': error.get('errmsg')
+                })
+        except Exception as e:
+            logger.error(f"Bulk insert of {len(batch)} documents failed: {e}")
+            self.failures.extend(
+                {'id': doc.get('id'), 'chunk_index': doc.get('chunk_index'), 'code': None, 'error': str(e)}
+                for doc in batch
+            )
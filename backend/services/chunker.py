@@ -0,0 +1,151 @@
+"""
+Chunkers that turn per-page text into RAG chunks.
+
+Every chunker takes the page list produced by extraction.load_pages and
+returns dicts with `content`, `page_number` (first page) and `page_end`
+(last page). CHUNKER selects the implementation:
+
+  token  sentence/paragraph aware chunks sized in embedding-model tokens
+         that may span pages (default)
+  words  the original fixed 1000-word windows with 200-word overlap, one
+         page at a time
+"""
+
+import os
+import re
+import logging
+from typing import List, Dict, Any, Callable
+
+logger = logging.getLogger(__name__)
+
+_PARAGRAPH_BREAK = re.compile(r'\n\s*\n')
+_SENTENCE_END = re.compile(r'(?<=[.!?])\s+(?=[A-Z0-9"\'(\[])')
+
+
+def load_token_counter(encoding_name: str) -> Callable[[str], int]:
+    """Token counter for the embedding model's encoding, or a ~4 chars per
+    token estimate when tiktoken or its encoding file is unavailable"""
+    try:
+        import tiktoken
+        encoding = tiktoken.get_encoding(encoding_name)
+        return lambda text: len(encoding.encode_ordinary(text))
+    except Exception as e:
+        logger.warning(f"tiktoken encoding {encoding_name} unavailable ({e}); estimating token counts")
+        return lambda text: max(1, len(text) // 4)
+
+
+class WordWindowChunker:
+    def __init__(self, chunk_size: int = 1000, chunk_overlap: int = 200):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def chunk(self, pages: List[str]) -> List[Dict[str, Any]]:
+        chunks = []
+        for page_num, text in enumerate(pages, 1):
+            words = text.split()
+            for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
+                chunks.append({
+                    'content': ' '.join(words[i:i + self.chunk_size]),
+                    'page_number': page_num,
+                    'page_end': page_num
+                })
+        return chunks
+
+
+class TokenChunker:
+    """Packs sentences into chunks of at most `max_tokens`.
+
+    Sentences are never split unless a single sentence exceeds the budget,
+    consecutive short pages are merged into one chunk (keeping the page
+    span for citations), and overlap is adaptive: a chunk that ends at a
+    paragraph break starts the next one clean, otherwise up to
+    `overlap_tokens` of trailing sentences are repeated for continuity.
+    """
+
+    def __init__(self, max_tokens: int = 512, overlap_tokens: int = 64, encoding_name: str = 'cl100k_base'):
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.count_tokens = load_token_counter(encoding_name)
+
+    def _units(self, pages: List[str]) -> List[Dict[str, Any]]:
+        """Sentences tagged with page number, token count and whether they end a paragraph"""
+        units = []
+        for page_num, text in enumerate(pages, 1):
+            for paragraph in _PARAGRAPH_BREAK.split(text):
+                sentences = [' '.join(s.split()) for s in _SENTENCE_END.split(paragraph)]
+                sentences = [s for s in sentences if s]
+                for i, sentence in enumerate(sentences):
+                    for piece in self._split_oversized(sentence):
+                        units.append({
+                            'text': piece,
+                            'page': page_num,
+                            'tokens': self.count_tokens(piece),
+                            'paragraph_end': False
+                        })
+                    if i == len(sentences) - 1:
+                        units[-1]['paragraph_end'] = True
+        return units
+
+    def _split_oversized(self, sentence: str) -> List[str]:
+        if self.count_tokens(sentence) <= self.max_tokens:
+            return [sentence]
+        pieces = []
+        current = []
+        current_tokens = 0
+        for word in sentence.split(' '):
+            word_tokens = self.count_tokens(' ' + word)
+            if current and current_tokens + word_tokens > self.max_tokens:
+                pieces.append(' '.join(current))
+                current, current_tokens = [], 0
+            current.append(word)
+            current_tokens += word_tokens
+        if current:
+            pieces.append(' '.join(current))
+        return pieces
+
+    def _emit(self, units: List[Dict[str, Any]]) -> Dict[str, Any]:
+        parts = []
+        for unit in units:
+            parts.append(unit['text'])
+            parts.append('\n\n' if unit['paragraph_end'] else ' ')
+        return {
+            'content': ''.join(parts).strip(),
+            'page_number': units[0]['page'],
+            'page_end': units[-1]['page']
+        }
+
+    def chunk(self, pages: List[str]) -> List[Dict[str, Any]]:
+        chunks = []
+        current: List[Dict[str, Any]] = []
+        current_tokens = 0
+        for unit in self._units(pages):
+            if current and current_tokens + unit['tokens'] > self.max_tokens:
+                chunks.append(self._emit(current))
+                carried = []
+                if not current[-1]['paragraph_end']:
+                    carried_tokens = 0
+                    for previous in reversed(current[1:]):
+                        if carried_tokens + previous['tokens'] > min(self.overlap_tokens, self.max_tokens - unit['tokens']):
+                            break
+                        carried.insert(0, previous)
+                        carried_tokens += previous['tokens']
+                current = carried
+                current_tokens = sum(u['tokens'] for u in carried)
+            current.append(unit)
+            current_tokens += unit['tokens']
+        if current:
+            chunks.append(self._emit(current))
+        return chunks
+
+
+def get_chunker():
+    kind = os.environ.get('CHUNKER', 'token')
+    if kind == 'words':
+        return WordWindowChunker(
+            chunk_size=int(os.environ.get('CHUNK_SIZE_WORDS', '1000')),
+            chunk_overlap=int(os.environ.get('CHUNK_OVERLAP_WORDS', '200'))
+        )
+    return TokenChunker(
+        max_tokens=int(os.environ.get('CHUNK_MAX_TOKENS', '512')),
+        overlap_tokens=int(os.environ.get('CHUNK_OVERLAP_TOKENS', '64'))
+    )
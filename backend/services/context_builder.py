@@ -0,0 +1,113 @@
+"""
+Post-retrieval selection of the passages sent to the LLM.
+
+Retrieval returns more candidates than the prompt needs, and neighbouring
+chunks repeat their overlap. ContextBuilder:
+
+  1. merges consecutive chunks of the same blob into one passage, dropping
+     the words the second chunk repeats from the first,
+  2. orders passages by maximal marginal relevance, trading retrieval rank
+     against word overlap with passages already picked, and drops
+     near-duplicates (overlap of at least CONTEXT_DUPLICATE_THRESHOLD), and
+  3. packs them into CONTEXT_TOKEN_BUDGET tokens of the embedding model's
+     encoding.
+"""
+
+import os
+from typing import List, Dict, Any
+
+from services.chunker import load_token_counter
+from services.lexical_index import tokenize
+
+
+def _source_key(chunk: Dict[str, Any]):
+    return chunk.get('content_hash') or chunk.get('document_id')
+
+
+def _join_overlapping(first: str, second: str, max_overlap_words: int = 400) -> str:
+    """`first` + `second` without the longest prefix of `second` that `first` ends with"""
+    first_words = first.split()
+    second_words = second.split()
+    for size in range(min(len(first_words), len(second_words), max_overlap_words), 0, -1):
+        if first_words[-size:] == second_words[:size]:
+            return first + ' ' + ' '.join(second_words[size:])
+    return first + '\n\n' + second
+
+
+class ContextBuilder:
+    def __init__(self, token_budget: int = None, mmr_lambda: float = None):
+        self.token_budget = token_budget or int(os.environ.get('CONTEXT_TOKEN_BUDGET', '2500'))
+        self.mmr_lambda = mmr_lambda if mmr_lambda is not None else float(os.environ.get('CONTEXT_MMR_LAMBDA', '0.7'))
+        self.duplicate_threshold = float(os.environ.get('CONTEXT_DUPLICATE_THRESHOLD', '0.8'))
+        self.count_tokens = load_token_counter('cl100k_base')
+
+    def merge_adjacent(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Merge runs of consecutive chunk_index from one source. A merged
+        passage keeps the best rank of its parts."""
+        ranked = [dict(chunk, rank=rank) for rank, chunk in enumerate(chunks)]
+        ordered = sorted(
+            ranked,
+            key=lambda chunk: (str(_source_key(chunk)), chunk.get('chunk_index', -1), chunk['rank'])
+        )
+        passages: List[Dict[str, Any]] = []
+        for chunk in ordered:
+            previous = passages[-1] if passages else None
+            if (
+                previous is not None
+                and chunk.get('chunk_index') is not None
+                and _source_key(previous) == _source_key(chunk)
+                and chunk['chunk_index'] - previous['chunk_index'] <= 1
+            ):
+                if chunk['chunk_index'] == previous['chunk_index']:
+                    continue
+                previous['content'] = _join_overlapping(previous['content'], chunk['content'])
+                previous['chunk_index'] = chunk['chunk_index']
+                previous['page_end'] = chunk.get('page_end') or chunk.get('page_number') or previous.get('page_end')
+                previous['rank'] = min(previous['rank'], chunk['rank'])
+                previous['score'] = max(previous.get('score', 0), chunk.get('score', 0))
+                continue
+            passages.append(chunk)
+        passages.sort(key=lambda passage: passage['rank'])
+        return passages
+
+    def mmr_order(self, passages: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Greedy MMR with relevance from retrieval rank and redundancy as
+        Jaccard similarity of the passages' word sets"""
+        if len(passages) <= 1:
+            return passages
+        relevance = [1.0 - position / len(passages) for position in range(len(passages))]
+        terms = [set(tokenize(passage['content'])) for passage in passages]
+
+        def similarity(i: int, j: int) -> float:
+            union = len(terms[i] | terms[j])
+            return len(terms[i] & terms[j]) / union if union else 0.0
+
+        remaining = list(range(len(passages)))
+        redundancy = [0.0] * len(passages)
+        selected: List[int] = []
+        while remaining:
+            best = max(remaining, key=lambda i: self.mmr_lambda * relevance[i] - (1 - self.mmr_lambda) * redundancy[i])
+            remaining.remove(best)
+            if redundancy[best] >= self.duplicate_threshold:
+                continue
+            selected.append(best)
+            for i in remaining:
+                redundancy[i] = max(redundancy[i], similarity(i, best))
+        return [passages[i] for i in selected]
+
+    def build(self, chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Distinct passages from ranked `chunks`, within the token budget"""
+        packed = []
+        used = 0
+        for passage in self.mmr_order(self.merge_adjacent(chunks)):
+            tokens = self.count_tokens(passage['content'])
+            if used + tokens > self.token_budget:
+                # A smaller passage further down may still fit
+                continue
+            passage.pop('rank', None)
+            packed.append(passage)
+            used += tokens
+        if not packed and chunks:
+            # Never send an empty context because the best hit is too long
+            packed.append({key: value for key, value in chunks[0].items() if key != 'rank'})
+        return packed
@@ -0,0 +1,70 @@
+import os
+from typing import List, Dict, Any, Optional
+
+from cachetools import TTLCache
+
+SCOPE_FIELDS = ('id', 'filename', 'content_hash')
+
+
+class DocumentScopeResolver:
+    """Documents a question in a session is answered from.
+
+    Only `id`, `filename` and `content_hash` are read, through an index
+    that covers both branches of the session-or-global query, and the
+    result is cached per (user, session) under the user's scope version.
+    Uploads and deletions bump that version in `scope_versions`, which
+    invalidates every cached scope of the user in every worker, since a
+    global document belongs to all of them. A scope read while the version
+    moved is not cached, and neither is an empty one.
+    """
+
+    def __init__(self, db, limit: int = 100):
+        self.db = db
+        self.limit = limit
+        self._scopes = TTLCache(
+            maxsize=int(os.environ.get('SCOPE_CACHE_USERS', '10000')),
+            ttl=float(os.environ.get('SCOPE_CACHE_TTL', '60'))
+        )
+
+    async def ensure_indexes(self):
+        # user_id + session_id / is_global select; the rest covers the projection
+        await self.db.documents.create_index(
+            [('user_id', 1), ('session_id', 1), ('id', 1), ('filename', 1), ('content_hash', 1)]
+        )
+        await self.db.documents.create_index(
+            [('user_id', 1), ('is_global', 1), ('id', 1), ('filename', 1), ('content_hash', 1)]
+        )
+
+    async def _version(self, user_id: str) -> int:
+        record = await self.db.scope_versions.find_one({'_id': user_id})
+        return record['version'] if record else 0
+
+    async def resolve(self, user_id: str, session_id: Optional[str]) -> List[Dict[str, Any]]:
+        version = await self._version(user_id)
+        cached = self._scopes.get(user_id)
+        if cached is not None and cached[0] == version and session_id in cached[1]:
+            return cached[1][session_id]
+
+        documents = await self.db.documents.find(
+            {
+                'user_id': user_id,
+                '$or': [
+                    {'session_id': session_id},
+                    {'is_global': True}
+                ]
+            },
+            {'_id': 0, **{field: 1 for field in SCOPE_FIELDS}}
+        ).to_list(self.limit)
+
+        # An upload or deletion during the query may have missed it
+        if documents and await self._version(user_id) == version:
+            cached = self._scopes.get(user_id)
+            if cached is None or cached[0] != version:
+                cached = self._scopes[user_id] = (version, {})
+            cached[1][session_id] = documents
+        return documents
+
+    async def invalidate(self, user_id: str):
+        """Call after the user's documents changed"""
+        self._scopes.pop(user_id, None)
+        await self.db.scope_versions.update_one({'_id': user_id}, {'$inc': {'version': 1}}, upsert=True)
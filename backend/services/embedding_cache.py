@@ -0,0 +1,201 @@
+import os
+import asyncio
+import hashlib
+import sqlite3
+import threading
+import time
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import List, Optional, Dict, Any
+
+import numpy as np
+from cachetools import TTLCache
+
+
+def normalize_text(text: str) -> str:
+    """Normalization applied before hashing: NFC and collapsed whitespace"""
+    return ' '.join(unicodedata.normalize('NFC', text).split())
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(normalize_text(text).encode('utf-8')).hexdigest()
+
+
+class EmbeddingCache:
+    """Persistent embedding cache in a local SQLite file.
+
+    Entries are keyed by (model, SHA-256 of the normalized text) and stored
+    as packed float32. `last_used` is refreshed on every hit and the least
+    recently used entries are evicted once the cache holds more than
+    `max_entries`. SQLite calls run in a worker thread.
+    """
+
+    def __init__(self, path: str, max_entries: int):
+        self.path = Path(path)
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._conn: Optional[sqlite3.Connection] = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_env(cls) -> Optional['EmbeddingCache']:
+        path = os.environ.get('EMBEDDING_CACHE_PATH', '/app/cache/embeddings.sqlite3')
+        if not path:
+            return None
+        return cls(path, int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', '100000')))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS embeddings ('
+                ' model TEXT NOT NULL, text_hash TEXT NOT NULL, vector BLOB NOT NULL,'
+                ' last_used REAL NOT NULL, PRIMARY KEY (model, text_hash)) WITHOUT ROWID'
+            )
+            conn.execute('CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)')
+            self._count = conn.execute('SELECT COUNT(*) FROM embeddings').fetchone()[0]
+            self._conn = conn
+        return self._conn
+
+    def _get_many(self, model: str, hashes: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            conn = self._connect()
+            unique = list(dict.fromkeys(hashes))
+            for start in range(0, len(unique), 500):
+                batch = unique[start:start + 500]
+                placeholders = ','.join('?' * len(batch))
+                rows = conn.execute(
+                    f'SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})',
+                    [model, *batch]
+                ).fetchall()
+                for key, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[key] = vector.tolist()
+            if found:
+                now = time.time()
+                conn.executemany(
+                    'UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash = ?',
+                    [(now, model, key) for key in found]
+                )
+                conn.commit()
+        return found
+
+    def _put_many(self, model: str, entries: Dict[str, List[float]]):
+        with self._lock:
+            conn = self._connect()
+            now = time.time()
+            before = conn.total_changes
+            conn.executemany(
+                'INSERT OR IGNORE INTO embeddings (model, text_hash, vector, last_used) VALUES (?, ?, ?, ?)',
+                [(model, key, array('f', vector).tobytes(), now) for key, vector in entries.items()]
+            )
+            self._count += conn.total_changes - before
+            if self._count > self.max_entries:
+                # Evict down to 90% so eviction does not run on every insert
+                excess = self._count - int(self.max_entries * 0.9)
+                conn.execute(
+                    'DELETE FROM embeddings WHERE (model, text_hash) IN '
+                    '(SELECT model, text_hash FROM embeddings ORDER BY last_used LIMIT ?)',
+                    (excess,)
+                )
+                self._count -= excess
+                self.evictions += excess
+            conn.commit()
+
+    async def get_many(self, model: str, texts: List[str]) -> List[Optional[List[float]]]:
+        """Cached embedding for each text, or None on a miss"""
+        hashes = [text_hash(text) for text in texts]
+        found = await asyncio.to_thread(self._get_many, model, hashes)
+        results = [found.get(key) for key in hashes]
+        hits = sum(1 for result in results if result is not None)
+        self.hits += hits
+        self.misses += len(results) - hits
+        return results
+
+    async def put_many(self, model: str, texts: List[str], vectors: List[List[float]]):
+        entries = {text_hash(text): vector for text, vector in zip(texts, vectors)}
+        if entries:
+            await asyncio.to_thread(self._put_many, model, entries)
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': self._count,
+            'max_entries': self.max_entries,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+            'evictions': self.evictions
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+class QueryEmbeddingCache:
+    """In-process LRU/TTL cache of question embeddings.
+
+    Keys are (model, hash of the normalized, case-folded question), so
+    repeated questions skip the embedding round-trip entirely. Vectors are
+    kept as float32 arrays and the cache is bounded by `max_bytes` of
+    vector data; entries also expire after `ttl` seconds.
+    """
+
+    ENTRY_OVERHEAD = 200  # key tuple, hash string and array header
+
+    def __init__(self, max_bytes: int, ttl: float):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._cache = TTLCache(
+            maxsize=max_bytes,
+            ttl=ttl,
+            getsizeof=lambda vector: vector.nbytes + self.ENTRY_OVERHEAD
+        )
+
+    @classmethod
+    def from_env(cls) -> Optional['QueryEmbeddingCache']:
+        max_bytes = int(os.environ.get('QUERY_EMBEDDING_CACHE_BYTES', str(64 * 1024 ** 2)))
+        if max_bytes <= 0:
+            return None
+        return cls(max_bytes, float(os.environ.get('QUERY_EMBEDDING_CACHE_TTL', '86400')))
+
+    @staticmethod
+    def key(model: str, query: str):
+        return model, text_hash(query.casefold())
+
+    def get(self, model: str, query: str) -> Optional[List[float]]:
+        vector = self._cache.get(self.key(model, query))
+        if vector is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return vector.tolist()
+
+    def put(self, model: str, query: str, embedding: List[float]):
+        vector = np.asarray(embedding, dtype=np.float32)
+        if vector.nbytes + self.ENTRY_OVERHEAD <= self.max_bytes:
+            self._cache[self.key(model, query)] = vector
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len(self._cache),
+            'bytes': self._cache.currsize,
+            'max_bytes': self.max_bytes,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
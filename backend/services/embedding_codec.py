@@ -0,0 +1,62 @@
+"""
+Storage formats for chunk embeddings.
+
+EMBEDDING_STORAGE selects how process_document stores a chunk's vector:
+
+  array    `embedding` as a BSON array of doubles (~20 KB for 1536 dims).
+           Required by the Atlas $vectorSearch backend.
+  float32  `embedding_f32`, packed little-endian float32 (6 KB)
+  int8     stored like float32. Only the in-memory matrix of the local
+           index shrinks: it holds symmetric per-vector int8 codes (a
+           quarter of the float32 matrix), quantized on load, and rescores
+           the best candidates against the stored float32 vectors. Scoring
+           int8 codes is several times slower than float32 in numpy, and
+           the ANN backend ignores the setting, so it only pays off when
+           the index does not otherwise fit VECTOR_INDEX_MAX_BYTES.
+
+Chunks written by earlier versions in int8 mode also carry `embedding_q8`
+and `embedding_scale`; they are still read, and migrate_embeddings.py
+drops them.
+"""
+
+import os
+from typing import List, Dict, Any, Optional
+
+import numpy as np
+
+EMBEDDING_STORAGE = os.environ.get('EMBEDDING_STORAGE', 'float32')
+EMBEDDING_FIELDS = ('embedding', 'embedding_f32', 'embedding_q8', 'embedding_scale')
+HAS_EMBEDDING = {'$or': [{'embedding.0': {'$exists': True}}, {'embedding_f32': {'$exists': True}}]}
+
+
+def quantize_int8(vector: np.ndarray):
+    """Symmetric int8 codes and the scale that maps them back to floats"""
+    peak = float(np.abs(vector).max())
+    scale = peak / 127 if peak > 0 else 1.0
+    codes = np.clip(np.rint(vector / scale), -127, 127).astype(np.int8)
+    return codes, scale
+
+
+def encode_embedding(embedding: List[float], storage: str = EMBEDDING_STORAGE) -> Dict[str, Any]:
+    """Chunk fields holding `embedding` in the given storage format"""
+    if storage == 'array':
+        return {'embedding': embedding}
+    # int8 is an in-memory format of the local index; Mongo keeps float32
+    return {'embedding_f32': np.asarray(embedding, dtype='<f4').tobytes()}
+
+
+def decode_float32(chunk: Dict[str, Any]) -> Optional[np.ndarray]:
+    """Full-precision vector of a chunk in any storage format"""
+    if chunk.get('embedding_f32') is not None:
+        return np.frombuffer(chunk['embedding_f32'], dtype='<f4')
+    if chunk.get('embedding'):
+        return np.asarray(chunk['embedding'], dtype=np.float32)
+    return None
+
+
+def decode_int8(chunk: Dict[str, Any]):
+    """int8 codes and scale of a chunk, from the codes earlier versions
+    stored, or quantized from its full-precision vector"""
+    if chunk.get('embedding_q8') is not None:
+        return np.frombuffer(chunk['embedding_q8'], dtype=np.int8), chunk['embedding_scale']
+    return quantize_int8(decode_float32(chunk))
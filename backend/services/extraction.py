@@ -0,0 +1,152 @@
+"""
+Document text extraction in a process pool.
+
+PyPDF2 and python-docx are pure-Python and CPU bound, so parsing inside an
+async handler freezes the event loop. The helpers here run the parsing in
+worker processes; large PDFs are split into page ranges that are extracted
+in parallel and reassembled in page order.
+
+Each file is parsed once. The per-page text is saved next to the upload as
+a `.pages.json` artifact that the preview, the chunker and anything else
+needing the text read instead of parsing the file again.
+"""
+
+import os
+import json
+import asyncio
+import multiprocessing
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Optional
+
+import PyPDF2
+from docx import Document as DocxDocument
+
+EXTRACTION_WORKERS = int(os.environ.get('EXTRACTION_WORKERS', str(min(4, os.cpu_count() or 1))))
+EXTRACTION_PAGES_PER_TASK = int(os.environ.get('EXTRACTION_PAGES_PER_TASK', '25'))
+
+PDF_TYPE = "application/pdf"
+DOCX_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+TEXT_TYPE = "text/plain"
+TEXT_FILE_TYPES = {PDF_TYPE, DOCX_TYPE, TEXT_TYPE}
+PREVIEW_CHARS = 5000
+
+_executor: Optional[ProcessPoolExecutor] = None
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    if _executor is None:
+        # spawn, not fork: the server process runs motor/httpx threads
+        _executor = ProcessPoolExecutor(
+            max_workers=EXTRACTION_WORKERS,
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _executor
+
+
+def shutdown_executor():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+
+
+def _pdf_page_count(file_path: str) -> int:
+    with open(file_path, 'rb') as file:
+        return len(PyPDF2.PdfReader(file).pages)
+
+
+def _pdf_page_range_text(file_path: str, start: int, end: int) -> List[str]:
+    with open(file_path, 'rb') as file:
+        pdf_reader = PyPDF2.PdfReader(file)
+        return [pdf_reader.pages[i].extract_text() or '' for i in range(start, end)]
+
+
+def _docx_text(file_path: str) -> str:
+    doc = DocxDocument(file_path)
+    return "\n".join([para.text for para in doc.paragraphs])
+
+
+async def extract_pdf_pages(file_path: str) -> List[str]:
+    """Return the text of every page, in order"""
+    loop = asyncio.get_running_loop()
+    executor = get_executor()
+    page_count = await loop.run_in_executor(executor, _pdf_page_count, file_path)
+    ranges = [
+        (start, min(start + EXTRACTION_PAGES_PER_TASK, page_count))
+        for start in range(0, page_count, EXTRACTION_PAGES_PER_TASK)
+    ]
+    parts = await asyncio.gather(*(
+        loop.run_in_executor(executor, _pdf_page_range_text, file_path, start, end)
+        for start, end in ranges
+    ))
+    return [page for part in parts for page in part]
+
+
+async def extract_docx_text(file_path: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), _docx_text, file_path)
+
+
+def _read_text_file(file_path: str) -> str:
+    with open(file_path, 'r', encoding='utf-8') as file:
+        return file.read()
+
+
+async def extract_pages(file_path: str, file_type: str) -> List[str]:
+    """Parse a file into per-page text. DOCX and TXT files are one page."""
+    if file_type == PDF_TYPE:
+        return await extract_pdf_pages(file_path)
+    if file_type == DOCX_TYPE:
+        return [await extract_docx_text(file_path)]
+    if file_type == TEXT_TYPE:
+        return [await asyncio.to_thread(_read_text_file, file_path)]
+    return []
+
+
+def page_artifact_path(file_path: str) -> Path:
+    return Path(f"{file_path}.pages.json")
+
+
+def _write_artifact(path: Path, pages: List[str]):
+    tmp_path = path.with_suffix('.tmp')
+    with open(tmp_path, 'w', encoding='utf-8') as file:
+        json.dump({'pages': pages}, file)
+    tmp_path.replace(path)
+
+
+def _read_artifact(path: Path) -> Optional[List[str]]:
+    try:
+        with open(path, 'r', encoding='utf-8') as file:
+            return json.load(file)['pages']
+    except (FileNotFoundError, ValueError, KeyError):
+        return None
+
+
+async def load_pages(file_path: str, file_type: str) -> List[str]:
+    """Per-page text for a stored file, parsing it only if no artifact exists yet"""
+    artifact = page_artifact_path(file_path)
+    pages = await asyncio.to_thread(_read_artifact, artifact)
+    if pages is None:
+        pages = await extract_pages(file_path, file_type)
+        await asyncio.to_thread(_write_artifact, artifact, pages)
+    return pages
+
+
+def build_preview(pages: List[str], limit: int = PREVIEW_CHARS) -> str:
+    """Leading `limit` characters of the document, touching only the pages needed"""
+    parts = []
+    remaining = limit
+    for page in pages:
+        if remaining <= 0:
+            break
+        parts.append(page[:remaining])
+        remaining -= len(parts[-1])
+    return "".join(parts)
+
+
+def delete_page_artifact(file_path: str):
+    artifact = page_artifact_path(file_path)
+    if artifact.exists():
+        artifact.unlink()
@@ -0,0 +1,298 @@
+import os
+import asyncio
+import logging
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Dict, Any, Optional, List
+
+from pymongo import ReturnDocument
+
+from services.extraction import load_pages, build_preview
+
+logger = logging.getLogger(__name__)
+
+
+class IngestionCancelled(Exception):
+    """Raised inside a running job when its blob was freed"""
+
+
+class IngestionService:
+    """Durable ingestion queue backed by the `ingestion_jobs` collection.
+
+    There is one job per stored blob (see BlobStore), so duplicate uploads
+    of the same file are parsed and embedded once.
+
+    Jobs are claimed atomically with find_one_and_update, so several uvicorn
+    workers can share the queue. A job whose heartbeat goes stale (worker
+    crashed or restarted) is picked up again by the next free worker; a
+    running job's heartbeat is refreshed every third of
+    INGESTION_STALE_AFTER, however long a single step takes. A failed
+    attempt is retried no sooner than INGESTION_RETRY_DELAY seconds later,
+    doubling with each attempt.
+    """
+
+    def __init__(self, db, rag_service, pregeneration=None):
+        self.db = db
+        self.rag_service = rag_service
+        self.pregeneration = pregeneration
+        self.concurrency = int(os.environ.get('INGESTION_WORKERS', '2'))
+        self.poll_interval = float(os.environ.get('INGESTION_POLL_INTERVAL', '5'))
+        self.stale_after = timedelta(seconds=int(os.environ.get('INGESTION_STALE_AFTER', '600')))
+        self.max_attempts = int(os.environ.get('INGESTION_MAX_ATTEMPTS', '3'))
+        self.retry_delay = float(os.environ.get('INGESTION_RETRY_DELAY', '30'))
+        self.worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+
+    async def enqueue(self, content_hash: str, file_path: str, file_type: str) -> Dict[str, Any]:
+        """Persist a queued job for a stored blob and wake an idle worker"""
+        now = datetime.now(timezone.utc).isoformat()
+        job = {
+            'id': str(uuid.uuid4()),
+            'content_hash': content_hash,
+            'file_path': file_path,
+            'file_type': file_type,
+            'state': 'queued',
+            'attempts': 0,
+            'progress': {
+                'pages_total': None,
+                'pages_parsed': 0,
+                'chunks_total': None,
+                'chunks_embedded': 0,
+                'chunks_failed': 0
+            },
+            'error': None,
+            'created_at': now,
+            'updated_at': now,
+            'heartbeat_at': None,
+            'not_before': None
+        }
+        await self.db.ingestion_jobs.insert_one(job)
+        job.pop('_id', None)
+        self._wakeup.set()
+        return job
+
+    async def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        return await self.db.ingestion_jobs.find_one({'id': job_id}, {'_id': 0, 'file_path': 0})
+
+    async def retry_failed(self, job_id: str):
+        """Give a job that exhausted its attempts another round"""
+        await self.db.ingestion_jobs.update_one(
+            {'id': job_id, 'state': 'failed'},
+            {'$set': {
+                'state': 'queued',
+                'attempts': 0,
+                'not_before': None,
+                'updated_at': datetime.now(timezone.utc).isoformat()
+            }}
+        )
+        self._wakeup.set()
+
+    async def cancel(self, content_hash: str):
+        """Cancel any pending or running job for a freed blob"""
+        await self.db.ingestion_jobs.update_many(
+            {'content_hash': content_hash, 'state': {'$in': ['queued', 'running']}},
+            {'$set': {'state': 'cancelled', 'updated_at': datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def start(self):
+        await self.db.ingestion_jobs.create_index('id', unique=True)
+        await self.db.ingestion_jobs.create_index('content_hash')
+        await self.db.ingestion_jobs.create_index([('state', 1), ('created_at', 1)])
+        for _ in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker_loop()))
+        # Jobs left over from a previous run are claimable immediately
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        # Hand interrupted jobs back to the queue instead of waiting for them to go stale
+        await self.db.ingestion_jobs.update_many(
+            {'state': 'running', 'worker': self.worker_name},
+            {'$set': {'state': 'queued', 'updated_at': datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def _claim_next(self) -> Optional[Dict[str, Any]]:
+        now = datetime.now(timezone.utc)
+        stale_before = (now - self.stale_after).isoformat()
+        return await self.db.ingestion_jobs.find_one_and_update(
+            {
+                '$or': [
+                    {'state': 'queued', 'not_before': None},
+                    {'state': 'queued', 'not_before': {'$lte': now.isoformat()}},
+                    {'state': 'running', 'heartbeat_at': {'$lt': stale_before}}
+                ]
+            },
+            {
+                '$set': {
+                    'state': 'running',
+                    'worker': self.worker_name,
+                    'claim': str(uuid.uuid4()),
+                    'started_at': now.isoformat(),
+                    'heartbeat_at': now.isoformat(),
+                    'updated_at': now.isoformat()
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                job = await self._claim_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Ingestion queue poll failed: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            await self._run(job)
+
+    async def _report_progress(self, job: Dict[str, Any], progress: Dict[str, Any]):
+        now = datetime.now(timezone.utc).isoformat()
+        updated = await self.db.ingestion_jobs.find_one_and_update(
+            self._owned(job),
+            {'$set': {
+                **{f'progress.{key}': value for key, value in progress.items()},
+                'heartbeat_at': now,
+                'updated_at': now
+            }},
+            projection={'_id': 1}
+        )
+        if updated is None:
+            raise IngestionCancelled(job['id'])
+
+    async def _heartbeat(self, job: Dict[str, Any]):
+        """Keep the claim fresh while a long step (parsing a large PDF, one
+        slow embedding batch) reports no progress"""
+        interval = self.stale_after.total_seconds() / 3
+        while True:
+            await asyncio.sleep(interval)
+            now = datetime.now(timezone.utc).isoformat()
+            result = await self.db.ingestion_jobs.update_one(
+                self._owned(job),
+                {'$set': {'heartbeat_at': now, 'updated_at': now}}
+            )
+            if result.matched_count == 0:
+                # Cancelled or reclaimed; the next progress report stops the run
+                return
+
+    async def _superseded(self, job: Dict[str, Any]) -> bool:
+        """Whether another run now owns the blob's chunks: this job claimed
+        again by another worker, or a newer job for a re-upload of the
+        same file. Its chunks must survive this run's cleanup."""
+        reclaimed = await self.db.ingestion_jobs.find_one(
+            {'id': job['id'], 'state': {'$in': ['running', 'completed']}, 'claim': {'$ne': job['claim']}},
+            {'_id': 1}
+        )
+        if reclaimed is not None:
+            return True
+        newer = await self.db.ingestion_jobs.find_one(
+            {
+                'content_hash': job['content_hash'],
+                'id': {'$ne': job['id']},
+                'state': {'$in': ['queued', 'running', 'completed']}
+            },
+            {'_id': 1}
+        )
+        return newer is not None
+
+    def _owned(self, job: Dict[str, Any]) -> Dict[str, Any]:
+        """Filter matching the job only while this claim of it is running.
+        A worker whose heartbeat went stale loses the job to the next
+        claim, and its updates stop matching."""
+        return {'id': job['id'], 'state': 'running', 'claim': job['claim']}
+
+    async def _run(self, job: Dict[str, Any]):
+        job_id = job['id']
+        content_hash = job['content_hash']
+
+        async def progress(update: Dict[str, Any]):
+            await self._report_progress(job, update)
+
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        try:
+            # Clear whatever an earlier run left behind. `attempts` is not a
+            # reliable signal: retry_failed() resets it for a duplicate upload
+            # of a file whose ingestion failed part way.
+            await self.db.document_chunks.delete_many({'content_hash': content_hash})
+
+            # Single parse shared by the preview and the chunker; every
+            # document sharing this blob gets the preview
+            pages = await load_pages(job['file_path'], job['file_type'])
+            await progress({'pages_total': len(pages), 'pages_parsed': len(pages)})
+            parsed = {'content_preview': build_preview(pages), 'page_count': len(pages)}
+            await self.db.blobs.update_one({'content_hash': content_hash}, {'$set': parsed})
+            await self.db.documents.update_many({'content_hash': content_hash}, {'$set': parsed})
+
+            chunk_count = await self.rag_service.process_document(
+                content_hash=content_hash,
+                file_path=job['file_path'],
+                file_type=job['file_type'],
+                progress=progress,
+                pages=pages
+            )
+            completed = await self.db.ingestion_jobs.update_one(
+                self._owned(job),
+                {'$set': {
+                    'state': 'completed',
+                    'chunk_count': chunk_count,
+                    'error': None,
+                    'completed_at': datetime.now(timezone.utc).isoformat(),
+                    'updated_at': datetime.now(timezone.utc).isoformat()
+                }}
+            )
+            if completed.matched_count == 0:
+                # Cancelled, or claimed by another worker, after the last heartbeat
+                raise IngestionCancelled(job_id)
+            # Lets local vector indexes in every worker refresh their copy
+            ingested_at = datetime.now(timezone.utc).isoformat()
+            await self.db.blobs.update_one(
+                {'content_hash': content_hash},
+                {'$set': {'ingested_at': ingested_at}}
+            )
+            await self.rag_service.blob_ingested(content_hash, ingested_at)
+            if self.pregeneration is not None:
+                try:
+                    await self.pregeneration.blob_ingested(content_hash)
+                except Exception as e:
+                    logger.error(f"Queueing pre-generation for {content_hash} failed: {e}")
+            if self.rag_service.embedding_cache is not None:
+                logger.info(f"Embedding cache after job {job_id}: {self.rag_service.embedding_cache.stats()}")
+        except asyncio.CancelledError:
+            # Shutdown: stop() puts the job back in the queue
+            raise
+        except IngestionCancelled:
+            if not await self._superseded(job):
+                await self.db.document_chunks.delete_many({'content_hash': content_hash})
+                await self.rag_service.lexical_index.delete_blob(content_hash)
+        except Exception as e:
+            logger.error(f"Ingestion job {job_id} failed: {e}")
+            now = datetime.now(timezone.utc)
+            state = 'queued' if job['attempts'] < self.max_attempts else 'failed'
+            delay = timedelta(seconds=self.retry_delay * 2 ** (job['attempts'] - 1))
+            await self.db.ingestion_jobs.update_one(
+                self._owned(job),
+                {'$set': {
+                    'state': state,
+                    'error': str(e),
+                    'not_before': (now + delay).isoformat() if state == 'queued' else None,
+                    'updated_at': now.isoformat()
+                }}
+            )
+        finally:
+            heartbeat.cancel()
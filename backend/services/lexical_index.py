@@ -0,0 +1,154 @@
+"""
+BM25 inverted index over document_chunks content.
+
+Postings are built per blob when it is chunked and stored in
+`chunk_postings`, one record per (content_hash, term) holding packed
+(chunk_index, term frequency, chunk length) triples. Each blob carries
+its chunk count and token total in `blobs.lexical_stats`, so corpus
+statistics for any document scope are summed at query time and adding or
+removing a blob never touches another blob's postings.
+"""
+
+import re
+import math
+import asyncio
+from typing import List, Dict, Any, Iterable
+
+import numpy as np
+from pymongo import InsertOne
+
+from services.embedding_codec import EMBEDDING_FIELDS
+
+_TOKEN = re.compile(r"\w+(?:[.\-']\w+)*")
+_STOPWORDS = frozenset(
+    'a an and are as at be but by for from has have how in is it its of on or that the '
+    'this to was were what when where which who why will with'.split()
+)
+_POSTING = np.dtype([('chunk', '<u4'), ('tf', '<u2'), ('length', '<u2')])
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercased words; section numbers and hyphenated terms stay whole"""
+    return [token for token in _TOKEN.findall(text.lower()) if token not in _STOPWORDS]
+
+
+def reciprocal_rank_fusion(result_lists: Iterable[List[Dict[str, Any]]], k: int = 60) -> List[Dict[str, Any]]:
+    """Merge ranked chunk lists by sum of 1 / (k + rank)"""
+    fused: Dict[str, Dict[str, Any]] = {}
+    scores: Dict[str, float] = {}
+    for results in result_lists:
+        for rank, chunk in enumerate(results, 1):
+            fused.setdefault(chunk['id'], chunk)
+            scores[chunk['id']] = scores.get(chunk['id'], 0.0) + 1.0 / (k + rank)
+    for chunk_id, chunk in fused.items():
+        chunk['score'] = scores[chunk_id]
+    return sorted(fused.values(), key=lambda chunk: chunk['score'], reverse=True)
+
+
+def build_postings(content_hash: str, chunks: List[Dict[str, Any]]):
+    """Posting records of a blob and its total token count"""
+    postings: Dict[str, List[tuple]] = {}
+    total_tokens = 0
+    for chunk_index, chunk in enumerate(chunks):
+        tokens = tokenize(chunk['content'])
+        counts: Dict[str, int] = {}
+        for token in tokens:
+            counts[token] = counts.get(token, 0) + 1
+        total_tokens += len(tokens)
+        length = min(len(tokens), 65535)
+        for term, tf in counts.items():
+            postings.setdefault(term, []).append((chunk_index, min(tf, 65535), length))
+    records = [
+        {
+            'content_hash': content_hash,
+            'term': term,
+            'df': len(entries),
+            'postings': np.array(entries, dtype=_POSTING).tobytes()
+        }
+        for term, entries in postings.items()
+    ]
+    return records, total_tokens
+
+
+class LexicalIndex:
+    def __init__(self, db, k1: float = 1.2, b: float = 0.75):
+        self.db = db
+        self.k1 = k1
+        self.b = b
+
+    async def ensure_indexes(self):
+        await self.db.chunk_postings.create_index([('term', 1), ('content_hash', 1)])
+        await self.db.chunk_postings.create_index('content_hash')
+
+    async def index_blob(self, content_hash: str, chunks: List[Dict[str, Any]]):
+        """(Re)build the postings of a blob from its chunks, in chunk_index order"""
+        records, total_tokens = await asyncio.to_thread(build_postings, content_hash, chunks)
+        await self.delete_blob(content_hash)
+        for start in range(0, len(records), 1000):
+            await self.db.chunk_postings.bulk_write(
+                [InsertOne(record) for record in records[start:start + 1000]],
+                ordered=False
+            )
+        await self.db.blobs.update_one(
+            {'content_hash': content_hash},
+            {'$set': {'lexical_stats': {'chunks': len(chunks), 'tokens': total_tokens}}}
+        )
+
+    async def delete_blob(self, content_hash: str):
+        await self.db.chunk_postings.delete_many({'content_hash': content_hash})
+
+    async def search(self, query: str, documents: List[Dict[str, Any]], top_k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k chunks of the documents' blobs by BM25, with content but no embedding"""
+        terms = list(dict.fromkeys(tokenize(query)))
+        content_hashes = list({doc['content_hash'] for doc in documents if doc.get('content_hash')})
+        if not terms or not content_hashes:
+            return []
+
+        blobs = await self.db.blobs.find(
+            {'content_hash': {'$in': content_hashes}, 'lexical_stats': {'$exists': True}},
+            {'_id': 0, 'content_hash': 1, 'lexical_stats': 1}
+        ).to_list(None)
+        total_chunks = sum(blob['lexical_stats']['chunks'] for blob in blobs)
+        if not total_chunks:
+            return []
+        average_length = sum(blob['lexical_stats']['tokens'] for blob in blobs) / total_chunks or 1.0
+
+        records = await self.db.chunk_postings.find(
+            {'term': {'$in': terms}, 'content_hash': {'$in': [blob['content_hash'] for blob in blobs]}},
+            {'_id': 0}
+        ).to_list(None)
+        if not records:
+            return []
+
+        blob_codes = {blob['content_hash']: code for code, blob in enumerate(blobs)}
+        df: Dict[str, int] = {}
+        for record in records:
+            df[record['term']] = df.get(record['term'], 0) + record['df']
+
+        keys, scores = [], []
+        for record in records:
+            postings = np.frombuffer(record['postings'], dtype=_POSTING)
+            n = df[record['term']]
+            idf = math.log(1 + (total_chunks - n + 0.5) / (n + 0.5))
+            tf = postings['tf'].astype(np.float32)
+            norm = self.k1 * (1 - self.b + self.b * postings['length'] / average_length)
+            scores.append(idf * tf * (self.k1 + 1) / (tf + norm))
+            keys.append((blob_codes[record['content_hash']] << 32) | postings['chunk'].astype(np.int64))
+
+        keys, inverse = np.unique(np.concatenate(keys), return_inverse=True)
+        totals = np.bincount(inverse, weights=np.concatenate(scores))
+        k = min(top_k, len(keys))
+        top = np.argpartition(-totals, k - 1)[:k]
+        score_by_id = {
+            f"{blobs[int(keys[i]) >> 32]['content_hash']}_{int(keys[i]) & 0xFFFFFFFF}": float(totals[i])
+            for i in top
+        }
+
+        chunks = await self.db.document_chunks.find(
+            {'id': {'$in': list(score_by_id)}},
+            {'_id': 0, **{field: 0 for field in EMBEDDING_FIELDS}}
+        ).to_list(len(score_by_id))
+        for chunk in chunks:
+            chunk['score'] = score_by_id[chunk['id']]
+        chunks.sort(key=lambda chunk: chunk['score'], reverse=True)
+        return chunks
@@ -0,0 +1,280 @@
+"""
+Single entry point for LLM calls.
+
+Every AI route goes through one LlmGateway, which owns the backend (and
+with it the API key and client), caps concurrency globally and per model,
+bounds how long a call may wait for a slot and run, and retries rate
+limits and provider errors with jittered exponential backoff.
+
+LLM_BACKEND selects the backend:
+
+  emergent  emergentintegrations LlmChat (default). It has no token
+            stream, so streamed replies arrive as one piece once complete
+  litellm   litellm acompletion with the provider's key (LLM_API_KEY, or
+            litellm's own variables such as GEMINI_API_KEY) and optional
+            LLM_API_BASE; streamed replies arrive token by token
+  fake      canned local replies for tests and load runs, no network
+"""
+
+import os
+import re
+import uuid
+import base64
+import random
+import asyncio
+import logging
+from typing import List, Dict, Any, Optional, Tuple, AsyncIterator
+
+logger = logging.getLogger(__name__)
+
+# (file path, mime type) attachments
+Attachment = Tuple[str, str]
+
+_RETRYABLE_NAMES = {
+    'RateLimitError', 'ServiceUnavailableError', 'InternalServerError',
+    'APIConnectionError', 'APITimeoutError', 'Timeout', 'BadGatewayError'
+}
+_RETRYABLE_STATUS = re.compile(r'\b(429|50[0-4])\b')
+
+
+class LlmError(Exception):
+    pass
+
+
+class LlmOverloaded(LlmError):
+    """No concurrency slot became free within LLM_QUEUE_TIMEOUT"""
+
+
+class LlmTimeout(LlmError):
+    pass
+
+
+class EmergentBackend:
+    """LlmChat keeps per-session history, so each call gets a fresh chat;
+    the underlying HTTP client is pooled by the library."""
+
+    def __init__(self, api_key: str):
+        self.api_key = api_key
+
+    async def complete(self, provider: str, model: str, system_message: str,
+                       text: str, files: List[Attachment]) -> str:
+        from emergentintegrations.llm.chat import LlmChat, UserMessage, FileContentWithMimeType
+
+        chat = LlmChat(
+            api_key=self.api_key,
+            session_id=f"llm_{uuid.uuid4()}",
+            system_message=system_message
+        ).with_model(provider, model)
+        return await chat.send_message(UserMessage(
+            text=text,
+            file_contents=[FileContentWithMimeType(file_path=path, mime_type=mime) for path, mime in files]
+        ))
+
+    async def stream(self, provider: str, model: str, system_message: str,
+                     text: str, files: List[Attachment]) -> AsyncIterator[str]:
+        # LlmChat has no token stream; the reply arrives in one piece
+        yield await self.complete(provider, model, system_message, text, files)
+
+
+class LiteLlmBackend:
+    """Provider calls through litellm, which streams tokens as they are
+    generated. Attachments are sent inline as base64 data URLs."""
+
+    def __init__(self, api_key: Optional[str] = None, api_base: Optional[str] = None):
+        self.api_key = api_key
+        self.api_base = api_base
+
+    async def _messages(self, system_message: str, text: str, files: List[Attachment]) -> List[Dict[str, Any]]:
+        content: List[Dict[str, Any]] = [{'type': 'text', 'text': text}]
+        for path, mime in files:
+            data = await asyncio.to_thread(lambda: open(path, 'rb').read())
+            url = f"data:{mime};base64,{base64.b64encode(data).decode('ascii')}"
+            if mime.startswith('image/'):
+                content.append({'type': 'image_url', 'image_url': {'url': url}})
+            else:
+                content.append({'type': 'file', 'file': {'file_data': url}})
+        return [
+            {'role': 'system', 'content': system_message},
+            {'role': 'user', 'content': content if files else text}
+        ]
+
+    async def _acompletion(self, provider: str, model: str, system_message: str,
+                           text: str, files: List[Attachment], stream: bool):
+        import litellm
+
+        return await litellm.acompletion(
+            model=f"{provider}/{model}",
+            messages=await self._messages(system_message, text, files),
+            api_key=self.api_key,
+            api_base=self.api_base,
+            stream=stream
+        )
+
+    async def complete(self, provider: str, model: str, system_message: str,
+                       text: str, files: List[Attachment]) -> str:
+        response = await self._acompletion(provider, model, system_message, text, files, stream=False)
+        return response.choices[0].message.content or ''
+
+    async def stream(self, provider: str, model: str, system_message: str,
+                     text: str, files: List[Attachment]) -> AsyncIterator[str]:
+        response = await self._acompletion(provider, model, system_message, text, files, stream=True)
+        async for part in response:
+            if part.choices and part.choices[0].delta.content:
+                yield part.choices[0].delta.content
+
+
+class FakeBackend:
+    """Deterministic replies after an optional delay; records every call"""
+
+    def __init__(self, reply: Optional[str] = None, latency: float = 0.0):
+        self.reply = reply
+        self.latency = latency
+        self.calls: List[Dict[str, Any]] = []
+
+    async def complete(self, provider: str, model: str, system_message: str,
+                       text: str, files: List[Attachment]) -> str:
+        self.calls.append({'model': model, 'system_message': system_message, 'text': text, 'files': files})
+        await asyncio.sleep(self.latency)
+        return self.reply if self.reply is not None else f"[{model}] {text[:200]}"
+
+    async def stream(self, provider: str, model: str, system_message: str,
+                     text: str, files: List[Attachment]) -> AsyncIterator[str]:
+        reply = await self.complete(provider, model, system_message, text, files)
+        for start in range(0, len(reply), 16):
+            yield reply[start:start + 16]
+
+
+def _is_retryable(error: Exception) -> bool:
+    status = getattr(error, 'status_code', None) or getattr(error, 'status', None)
+    if isinstance(status, int):
+        return status == 429 or status >= 500
+    if type(error).__name__ in _RETRYABLE_NAMES:
+        return True
+    return bool(_RETRYABLE_STATUS.search(str(error)))
+
+
+class LlmGateway:
+    def __init__(self, backend=None):
+        if backend is None:
+            kind = os.environ.get('LLM_BACKEND', 'emergent')
+            if kind == 'fake':
+                backend = FakeBackend(latency=float(os.environ.get('LLM_FAKE_LATENCY', '0')))
+            elif kind == 'litellm':
+                backend = LiteLlmBackend(os.environ.get('LLM_API_KEY'), os.environ.get('LLM_API_BASE'))
+            else:
+                api_key = os.environ.get('EMERGENT_LLM_KEY')
+                if not api_key:
+                    raise LlmError("EMERGENT_LLM_KEY is not set; set it, or LLM_BACKEND=fake for local runs")
+                backend = EmergentBackend(api_key)
+        self.backend = backend
+        self.provider = 'gemini'
+        self.model = 'gemini-2.0-flash'
+        self.max_concurrency = int(os.environ.get('LLM_MAX_CONCURRENCY', '16'))
+        self.model_concurrency = int(os.environ.get('LLM_MODEL_CONCURRENCY', '8'))
+        self.timeout = float(os.environ.get('LLM_TIMEOUT', '90'))
+        self.queue_timeout = float(os.environ.get('LLM_QUEUE_TIMEOUT', '30'))
+        self.max_retries = int(os.environ.get('LLM_MAX_RETRIES', '3'))
+        self.backoff_base = float(os.environ.get('LLM_BACKOFF_BASE', '1.0'))
+        self.backoff_max = float(os.environ.get('LLM_BACKOFF_MAX', '20'))
+        self._slots = asyncio.Semaphore(self.max_concurrency)
+        self._model_slots: Dict[str, asyncio.Semaphore] = {}
+        self.in_flight = 0
+        self.calls = 0
+        self.retries = 0
+        self.timeouts = 0
+        self.rejected = 0
+
+    def _semaphores(self, model: str) -> List[asyncio.Semaphore]:
+        if model not in self._model_slots:
+            self._model_slots[model] = asyncio.Semaphore(self.model_concurrency)
+        return [self._slots, self._model_slots[model]]
+
+    async def _acquire(self, model: str) -> List[asyncio.Semaphore]:
+        acquired = []
+        try:
+            for semaphore in self._semaphores(model):
+                await asyncio.wait_for(semaphore.acquire(), self.queue_timeout)
+                acquired.append(semaphore)
+        except asyncio.TimeoutError:
+            for semaphore in acquired:
+                semaphore.release()
+            self.rejected += 1
+            raise LlmOverloaded(f"LLM busy: no slot for {model} within {self.queue_timeout:g}s")
+        return acquired
+
+    async def _backoff(self, attempt: int, error: Exception):
+        delay = min(self.backoff_max, self.backoff_base * 2 ** attempt) * random.uniform(0.5, 1.0)
+        self.retries += 1
+        logger.warning(f"LLM call failed ({error.__class__.__name__}: {error}), retrying in {delay:.1f}s")
+        await asyncio.sleep(delay)
+
+    async def complete(self, text: str, system_message: str, files: Optional[List[Attachment]] = None,
+                       model: Optional[str] = None) -> str:
+        """Reply to one message, under the concurrency caps, timeout and retry policy"""
+        model = model or self.model
+        for attempt in range(self.max_retries + 1):
+            slots = await self._acquire(model)
+            self.in_flight += 1
+            self.calls += 1
+            try:
+                return await asyncio.wait_for(
+                    self.backend.complete(self.provider, model, system_message, text, files or []),
+                    self.timeout
+                )
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                error = LlmTimeout(f"LLM call to {model} timed out after {self.timeout:g}s")
+                if attempt == self.max_retries:
+                    raise error
+            except Exception as e:
+                if attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                error = e
+            finally:
+                self.in_flight -= 1
+                for semaphore in slots:
+                    semaphore.release()
+            await self._backoff(attempt, error)
+
+    async def stream(self, text: str, system_message: str, files: Optional[List[Attachment]] = None,
+                     model: Optional[str] = None) -> AsyncIterator[str]:
+        """Reply pieces as they arrive. Failures before the first piece are
+        retried like complete(); once text has been yielded they propagate."""
+        model = model or self.model
+        for attempt in range(self.max_retries + 1):
+            slots = await self._acquire(model)
+            self.in_flight += 1
+            self.calls += 1
+            started = False
+            try:
+                pieces = self.backend.stream(self.provider, model, system_message, text, files or [])
+                while True:
+                    try:
+                        piece = await asyncio.wait_for(pieces.__anext__(), self.timeout)
+                    except StopAsyncIteration:
+                        return
+                    started = True
+                    yield piece
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                error = LlmTimeout(f"LLM stream from {model} stalled for {self.timeout:g}s")
+                if started or attempt == self.max_retries:
+                    raise error
+            except Exception as e:
+                if started or attempt == self.max_retries or not _is_retryable(e):
+                    raise
+                error = e
+            finally:
+                self.in_flight -= 1
+                for semaphore in slots:
+                    semaphore.release()
+            await self._backoff(attempt, error)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'in_flight': self.in_flight,
+            'calls': self.calls,
+            'retries': self.retries,
+            'timeouts': self.timeouts,
+            'rejected': self.rejected
+        }
@@ -0,0 +1,99 @@
+import os
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+from services.single_flight import SingleFlight
+
+
+class MaterialCache:
+    """Generated study material shared across users, in `material_cache`.
+
+    Entries are keyed by the source file's content hash, the material type,
+    the prompt version and the model, so every upload of the same file gets
+    the same summary, flashcards or mindmap without another LLM call, and a
+    prompt or model change starts a fresh set. Concurrent misses for one key
+    coalesce through SingleFlight, across users and workers. Entries hold
+    only generated content; per-user details stay in `study_materials`.
+    Cached material is billed like generated material unless
+    MATERIAL_CACHE_BILL_HITS=false opts into serving hits for free.
+    """
+
+    def __init__(self, db, flights: SingleFlight):
+        self.db = db
+        self.flights = flights
+        self.enabled = os.environ.get('MATERIAL_CACHE_ENABLED', 'true').lower() == 'true'
+        self.bill_hits = os.environ.get('MATERIAL_CACHE_BILL_HITS', 'true').lower() == 'true'
+        self.hits = 0
+        self.misses = 0
+
+    async def ensure_indexes(self):
+        await self.db.material_cache.create_index('key', unique=True)
+        # BlobStore.release drops a freed file's entries
+        await self.db.material_cache.create_index('content_hash')
+
+    @staticmethod
+    def key(content_hash: str, material_type: str, prompt_version: int, model: str) -> str:
+        return hashlib.sha256(f"{content_hash}\n{material_type}\n{prompt_version}\n{model}".encode('utf-8')).hexdigest()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = await self.db.material_cache.find_one({'key': key}, {'_id': 0, 'content': 1})
+        return entry['content'] if entry else None
+
+    async def put(self, content_hash: str, material_type: str, prompt_version: int, model: str,
+                  content: Dict[str, Any]) -> Dict[str, Any]:
+        """Store generated content; returns the cached copy, which is an
+        earlier one if another worker stored the same key first"""
+        key = self.key(content_hash, material_type, prompt_version, model)
+        try:
+            await self.db.material_cache.insert_one({
+                'key': key,
+                'content_hash': content_hash,
+                'type': material_type,
+                'prompt_version': prompt_version,
+                'model': model,
+                'content': content,
+                'created_at': datetime.now(timezone.utc).isoformat()
+            })
+        except DuplicateKeyError:
+            return await self.get(key)
+        return content
+
+    async def get_or_generate(self, content_hash: Optional[str], material_type: str, prompt_version: int,
+                              model: str, generate: Callable[[], Awaitable[Dict[str, Any]]]
+                              ) -> Tuple[Dict[str, Any], Optional[str], bool]:
+        """(content, cache key, whether this call generated it). Files
+        without a content hash are generated every time, uncached."""
+        if not self.enabled or not content_hash:
+            return await generate(), None, True
+
+        key = self.key(content_hash, material_type, prompt_version, model)
+        content = await self.get(key)
+        if content is not None:
+            self.hits += 1
+            return content, key, False
+
+        generated = False
+
+        async def produce():
+            nonlocal generated
+            content = await generate()
+            generated = True
+            return await self.put(content_hash, material_type, prompt_version, model, content), key
+
+        content = await self.flights.run(f"material:{key}", produce, self.get)
+        if generated:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return content, key, generated
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,278 @@
+import os
+import json
+import asyncio
+import logging
+import socket
+import uuid
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+logger = logging.getLogger(__name__)
+
+# Per subscription_plan: material types to pre-generate, concurrent jobs
+# per worker, and credits a job may never dip into (kept for clicks).
+# Metered users pay for pre-generated material whether or not they open
+# it, so the free plan pre-generates nothing unless PREGENERATION_POLICY
+# (JSON, overriding entries plan by plan) opts it in.
+DEFAULT_POLICY = {
+    'free': {'types': [], 'concurrency': 1, 'credit_floor': 4},
+    'monthly': {'types': ['summary', 'flashcard'], 'concurrency': 2, 'credit_floor': 0},
+    'yearly': {'types': ['summary', 'flashcard'], 'concurrency': 4, 'credit_floor': 0}
+}
+
+MATERIAL_CREDITS = 2
+
+
+def _has_active_subscription(user: Dict[str, Any]) -> bool:
+    """Same rule as check_credits: active subscribers are not metered"""
+    if user.get('subscription_status') != 'active':
+        return False
+    end = user.get('subscription_end_date')
+    if isinstance(end, str):
+        end = datetime.fromisoformat(end)
+    return bool(end) and end > datetime.now(timezone.utc)
+
+
+class PregenerationScheduler:
+    """Opt-in background generation of study materials after ingestion.
+
+    When a blob finishes ingestion, or a document is uploaded for a blob
+    that already has, one job per material type in the owner's plan policy
+    is queued in `pregeneration_jobs`. Metered users must have the job's
+    credits available above the plan's credit floor; they are reserved on
+    the user (`reserved_credits`, which clicks cannot spend) until the job
+    finishes, and a job only runs if its user still has them. Jobs are
+    claimed atomically like ingestion jobs, with a per-claim token that
+    fences a stale run's updates, at most the plan's concurrency at a time per worker,
+    and only while the LLM gateway has fewer than PREGENERATION_MAX_LOAD of
+    its slots in use, so clicks always come first. The job itself runs the
+    same coalesced generation as the endpoints, so a click on a material
+    being pre-generated waits for it instead of generating it again.
+    """
+
+    def __init__(self, db, llm):
+        self.db = db
+        self.llm = llm
+        self.enabled = os.environ.get('PREGENERATION_ENABLED', 'false').lower() == 'true'
+        self.workers = int(os.environ.get('PREGENERATION_WORKERS', '2'))
+        self.max_load = float(os.environ.get('PREGENERATION_MAX_LOAD', '0.5'))
+        self.poll_interval = float(os.environ.get('PREGENERATION_POLL_INTERVAL', '10'))
+        self.stale_after = timedelta(seconds=int(os.environ.get('PREGENERATION_STALE_AFTER', '900')))
+        self.max_attempts = int(os.environ.get('PREGENERATION_MAX_ATTEMPTS', '2'))
+        self.policy = {plan: dict(policy) for plan, policy in DEFAULT_POLICY.items()}
+        for plan, policy in json.loads(os.environ.get('PREGENERATION_POLICY', '{}')).items():
+            self.policy[plan] = {**self.policy.get(plan, DEFAULT_POLICY['free']), **policy}
+        self.worker_name = f"{socket.gethostname()}:{os.getpid()}"
+        self._running: Dict[str, int] = {plan: 0 for plan in self.policy}
+        self._wakeup = asyncio.Event()
+        self._workers: List[asyncio.Task] = []
+        self._run_job: Optional[Callable[[Dict[str, Any]], Awaitable[Any]]] = None
+
+    def plan_of(self, user: Dict[str, Any]) -> str:
+        plan = user.get('subscription_plan', 'free') if _has_active_subscription(user) else 'free'
+        return plan if plan in self.policy else 'free'
+
+    async def start(self, run_job: Callable[[Dict[str, Any]], Awaitable[Any]]):
+        """Start the workers; `run_job(job)` generates the job's material"""
+        if not self.enabled:
+            return
+        await self.db.pregeneration_jobs.create_index('id', unique=True)
+        await self.db.pregeneration_jobs.create_index([('document_id', 1), ('type', 1)], unique=True)
+        await self.db.pregeneration_jobs.create_index([('state', 1), ('plan', 1), ('created_at', 1)])
+        self._run_job = run_job
+        for _ in range(self.workers):
+            self._workers.append(asyncio.create_task(self._worker_loop()))
+        self._wakeup.set()
+
+    async def stop(self):
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        await self.db.pregeneration_jobs.update_many(
+            {'state': 'running', 'worker': self.worker_name},
+            {'$set': {'state': 'queued', 'updated_at': datetime.now(timezone.utc).isoformat()}}
+        )
+
+    async def blob_ingested(self, content_hash: str):
+        """Queue jobs for every document of a freshly ingested blob"""
+        if not self.enabled:
+            return
+        documents = await self.db.documents.find(
+            {'content_hash': content_hash},
+            {'_id': 0, 'id': 1, 'user_id': 1, 'content_hash': 1}
+        ).to_list(None)
+        for document in documents:
+            await self.document_added(document)
+
+    async def document_added(self, document: Dict[str, Any]):
+        """Queue the plan's material types for one document"""
+        if not self.enabled:
+            return
+        user = await self.db.users.find_one(
+            {'id': document['user_id']},
+            {'_id': 0, 'subscription_plan': 1, 'subscription_status': 1, 'subscription_end_date': 1}
+        )
+        if user is None:
+            return
+        plan = self.plan_of(user)
+        metered = not _has_active_subscription(user)
+        for material_type in self.policy[plan]['types']:
+            await self._enqueue(document, material_type, plan, MATERIAL_CREDITS if metered else 0)
+        self._wakeup.set()
+
+    async def _reserve(self, user_id: str, credits: int, floor: int) -> bool:
+        if not credits:
+            return True
+        reserved = await self.db.users.update_one(
+            {
+                'id': user_id,
+                '$expr': {'$gte': [
+                    {'$subtract': ['$credits', {'$ifNull': ['$reserved_credits', 0]}]},
+                    credits + floor
+                ]}
+            },
+            {'$inc': {'reserved_credits': credits}}
+        )
+        return reserved.modified_count == 1
+
+    async def _release(self, job: Dict[str, Any]):
+        if job.get('reserved_credits'):
+            await self.db.users.update_one(
+                {'id': job['user_id']},
+                {'$inc': {'reserved_credits': -job['reserved_credits']}}
+            )
+
+    async def _enqueue(self, document: Dict[str, Any], material_type: str, plan: str, credits: int):
+        existing = await self.db.study_materials.find_one(
+            {'document_id': document['id'], 'user_id': document['user_id'], 'type': material_type},
+            {'_id': 0, 'id': 1}
+        )
+        if existing:
+            return
+        if not await self._reserve(document['user_id'], credits, self.policy[plan].get('credit_floor', 0)):
+            return
+        now = datetime.now(timezone.utc).isoformat()
+        job = {
+            'id': str(uuid.uuid4()),
+            'user_id': document['user_id'],
+            'document_id': document['id'],
+            'content_hash': document.get('content_hash'),
+            'type': material_type,
+            'plan': plan,
+            'reserved_credits': credits,
+            'state': 'queued',
+            'attempts': 0,
+            'error': None,
+            'created_at': now,
+            'updated_at': now
+        }
+        try:
+            await self.db.pregeneration_jobs.insert_one(job)
+        except DuplicateKeyError:
+            # Already queued or done for this document
+            await self._release(job)
+
+    async def cancel_document(self, document_id: str):
+        """Drop pending jobs of a deleted document and free their credits"""
+        if not self.enabled:
+            return
+        while True:
+            job = await self.db.pregeneration_jobs.find_one_and_update(
+                {'document_id': document_id, 'state': 'queued'},
+                {'$set': {'state': 'cancelled', 'updated_at': datetime.now(timezone.utc).isoformat()}}
+            )
+            if job is None:
+                return
+            await self._release(job)
+
+    def _idle(self) -> bool:
+        return self.llm.in_flight < self.llm.max_concurrency * self.max_load
+
+    async def _claim_next(self) -> Optional[Dict[str, Any]]:
+        plans = [plan for plan, policy in self.policy.items() if self._running[plan] < policy['concurrency']]
+        if not plans or not self._idle():
+            return None
+        now = datetime.now(timezone.utc)
+        stale_before = (now - self.stale_after).isoformat()
+        job = await self.db.pregeneration_jobs.find_one_and_update(
+            {
+                'plan': {'$in': plans},
+                '$or': [
+                    {'state': 'queued'},
+                    {'state': 'running', 'started_at': {'$lt': stale_before}}
+                ]
+            },
+            {
+                '$set': {
+                    'state': 'running',
+                    'worker': self.worker_name,
+                    'claim': str(uuid.uuid4()),
+                    'started_at': now.isoformat(),
+                    'updated_at': now.isoformat()
+                },
+                '$inc': {'attempts': 1}
+            },
+            sort=[('created_at', 1)],
+            return_document=ReturnDocument.AFTER
+        )
+        if job is not None:
+            # Counted before the next await so sibling workers see the slot taken
+            self._running[job['plan']] += 1
+        return job
+
+    async def _worker_loop(self):
+        while True:
+            try:
+                job = await self._claim_next()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Pre-generation queue poll failed: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            try:
+                await self._run(job)
+            finally:
+                self._running[job['plan']] -= 1
+                # A freed plan slot may unblock a queued job
+                self._wakeup.set()
+
+    async def _finish(self, job: Dict[str, Any], state: str, error: Optional[str] = None):
+        # Only this claim of the job may finish it: a run that went stale
+        # and was claimed again must not release the credits a second time
+        finished = await self.db.pregeneration_jobs.update_one(
+            {'id': job['id'], 'state': 'running', 'claim': job['claim']},
+            {'$set': {'state': state, 'error': error, 'updated_at': datetime.now(timezone.utc).isoformat()}}
+        )
+        if finished.matched_count and state != 'queued':
+            await self._release(job)
+
+    async def _run(self, job: Dict[str, Any]):
+        try:
+            if job.get('reserved_credits'):
+                user = await self.db.users.find_one({'id': job['user_id']}, {'_id': 0, 'credits': 1})
+                # Clicks may have spent the credits since they were reserved
+                if user is None or user.get('credits', 0) < job['reserved_credits']:
+                    await self._finish(job, 'skipped', 'Insufficient credits')
+                    return
+            await self._run_job(job)
+            await self._finish(job, 'completed')
+        except asyncio.CancelledError:
+            # Shutdown: stop() puts the job back in the queue
+            raise
+        except Exception as e:
+            logger.warning(f"Pre-generation job {job['id']} failed: {e}")
+            await self._finish(job, 'queued' if job['attempts'] < self.max_attempts else 'failed', str(e))
+
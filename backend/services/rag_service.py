@@ -1,106 +1,399 @@
 import os
-from typing import List, Dict, Any
+import asyncio
+import random
+from typing import List, Dict, Any, Optional, Callable, Awaitable, AsyncIterator
 import openai
-from pathlib import Path
-import PyPDF2
-from docx import Document as DocxDocument
-import uuid
+import httpx
 from datetime import datetime, timezone
 
+from services.bulk_writer import BulkChunkWriter
+from services.extraction import load_pages
+from services.embedding_cache import EmbeddingCache, QueryEmbeddingCache
+from services.chunker import get_chunker, load_token_counter
+from services.vector_index import LocalVectorIndex
+from services.ann_index import AnnVectorIndex
+from services.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from services.context_builder import ContextBuilder
+from services.llm_gateway import LlmGateway
+from services.embedding_codec import EMBEDDING_STORAGE, encode_embedding
+
 class RAGService:
-    def __init__(self, db):
+    def __init__(self, db, llm: Optional[LlmGateway] = None):
         self.db = db
-        self.chunk_size = 1000
-        self.chunk_overlap = 200
+        self.llm = llm or LlmGateway()
+        self.chunker = get_chunker()
+        self.count_tokens = load_token_counter('cl100k_base')
+        self.embedding_model = "text-embedding-3-small"
+        self.answer_model = "gemini-2.0-flash"
+        self.embedding_batch_size = int(os.environ.get('EMBEDDING_BATCH_SIZE', '64'))
+        self.embedding_concurrency = int(os.environ.get('EMBEDDING_CONCURRENCY', '4'))
+        self.embedding_max_retries = int(os.environ.get('EMBEDDING_MAX_RETRIES', '5'))
+        self.embedding_backoff_base = float(os.environ.get('EMBEDDING_BACKOFF_BASE', '1.0'))
+        self.embedding_backoff_max = float(os.environ.get('EMBEDDING_BACKOFF_MAX', '30'))
+        self.embedding_max_inflight = int(os.environ.get('EMBEDDING_MAX_INFLIGHT', '8'))
+        self.embedding_timeout = float(os.environ.get('EMBEDDING_TIMEOUT', '30'))
+        self.embedding_connect_timeout = float(os.environ.get('EMBEDDING_CONNECT_TIMEOUT', '5'))
+        self.query_embedding_timeout = float(os.environ.get('QUERY_EMBEDDING_TIMEOUT', '3'))
+        self._embedding_slots = asyncio.Semaphore(self.embedding_max_inflight)
+        self.embedding_cache = EmbeddingCache.from_env()
+        self.query_embedding_cache = QueryEmbeddingCache.from_env()
+        self._pending_queries: Dict[tuple, asyncio.Future] = {}
+        self.vector_backend = os.environ.get('VECTOR_SEARCH_BACKEND', 'ann')  # ann, local, atlas
+        self.vector_index = LocalVectorIndex(db)
+        self.ann_index = AnnVectorIndex(db, fallback=self.vector_index)
+        self.lexical_index = LexicalIndex(db)
+        self.retrieval_mode = os.environ.get('RETRIEVAL_MODE', 'hybrid')  # hybrid, vector, lexical
+        self.hybrid_candidates = int(os.environ.get('HYBRID_CANDIDATES', '20'))
+        self.context_builder = ContextBuilder()
+        self.context_candidates = int(os.environ.get('CONTEXT_CANDIDATES', '15'))
+        if self.vector_backend == 'atlas' and EMBEDDING_STORAGE != 'array':
+            print(f"Warning: Atlas vector search needs EMBEDDING_STORAGE=array, got {EMBEDDING_STORAGE}; "
+                  "new chunks will only be found by keyword search")
+        self._http_client = None
         self._openai_client = None
         self._emergent_llm_key = None
     
+    async def ensure_indexes(self):
+        await self.db.document_chunks.create_index('id')
+        await self.lexical_index.ensure_indexes()
+    
+    async def start(self):
+        if self.vector_backend == 'ann':
+            await self.ann_index.start()
+    
+    async def blob_ingested(self, content_hash: str, ingested_at: str):
+        """Called once a blob's chunks are all stored"""
+        if self.vector_backend == 'ann':
+            await self.ann_index.blob_ingested(content_hash, ingested_at)
+    
+    async def document_removed(self, user_id: str, content_hash: str):
+        """Called after a user's document record is deleted"""
+        if self.vector_backend == 'ann':
+            await self.ann_index.document_removed(user_id, content_hash)
+    
     @property
     def openai_client(self):
-        """Lazy initialization of OpenAI client"""
+        """Lazy initialization of the async OpenAI client.
+
+        All embedding calls share one pooled httpx connection pool sized to
+        `embedding_max_inflight`, so requests reuse keep-alive connections
+        and never block the event loop.
+        """
         if self._openai_client is None:
             if self._emergent_llm_key is None:
                 self._emergent_llm_key = os.environ.get('EMERGENT_LLM_KEY', 'sk-emergent-placeholder')
-            self._openai_client = openai.OpenAI(api_key=self._emergent_llm_key)
+            self._http_client = httpx.AsyncClient(
+                limits=httpx.Limits(
+                    max_connections=self.embedding_max_inflight,
+                    max_keepalive_connections=self.embedding_max_inflight
+                ),
+                timeout=httpx.Timeout(self.embedding_timeout, connect=self.embedding_connect_timeout)
+            )
+            # Retries are handled by _embed_batch so they can back off per batch
+            self._openai_client = openai.AsyncOpenAI(
+                api_key=self._emergent_llm_key,
+                http_client=self._http_client,
+                max_retries=0
+            )
         return self._openai_client
-        
-    def extract_text_from_pdf(self, file_path: str) -> List[Dict[str, Any]]:
-        """Extract text from PDF with page numbers"""
-        chunks = []
-        with open(file_path, 'rb') as file:
-            pdf_reader = PyPDF2.PdfReader(file)
-            for page_num, page in enumerate(pdf_reader.pages, 1):
-                text = page.extract_text()
-                if text.strip():
-                    # Split page into chunks if too large
-                    page_chunks = self._split_text(text, page_num)
-                    chunks.extend(page_chunks)
-        return chunks
     
-    def _split_text(self, text: str, page_num: int) -> List[Dict[str, Any]]:
-        """Split text into overlapping chunks"""
-        chunks = []
-        words = text.split()
+    async def aclose(self):
+        """Close the pooled HTTP connections and the embedding cache, and
+        persist the ANN indexes"""
+        if self.vector_backend == 'ann':
+            await self.ann_index.stop()
+        if self._http_client is not None:
+            await self._http_client.aclose()
+            self._http_client = None
+            self._openai_client = None
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        if self.query_embedding_cache is not None:
+            print(f"Query embedding cache: {self.query_embedding_cache.stats()}")
         
-        for i in range(0, len(words), self.chunk_size - self.chunk_overlap):
-            chunk_words = words[i:i + self.chunk_size]
-            chunk_text = ' '.join(chunk_words)
-            chunks.append({
-                'content': chunk_text,
-                'page_number': page_num
-            })
-        
-        return chunks
+    async def _embed_batch(self, texts: List[str]) -> List[List[float]]:
+        """Embed one batch, retrying rate limits and transient errors with jittered backoff"""
+        for attempt in range(self.embedding_max_retries + 1):
+            try:
+                async with self._embedding_slots:
+                    response = await self.openai_client.embeddings.create(
+                        model=self.embedding_model,
+                        input=texts
+                    )
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                if attempt == self.embedding_max_retries:
+                    raise
+                delay = min(self.embedding_backoff_max, self.embedding_backoff_base * 2 ** attempt)
+                delay *= random.uniform(0.5, 1.0)
+                print(f"Embedding batch failed ({e.__class__.__name__}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
     
     async def generate_embedding(self, text: str) -> List[float]:
         """Generate embedding using OpenAI"""
+        return (await self.generate_embeddings([text]))[0] or []
+    
+    @property
+    def needs_query_embedding(self) -> bool:
+        return self.retrieval_mode != 'lexical'
+    
+    async def _embed_query_once(self, query: str) -> List[float]:
+        """One attempt bounded by QUERY_EMBEDDING_TIMEOUT, or [] on failure.
+        A user is waiting: when embeddings are unavailable the question is
+        answered from BM25 instead of sitting through ingestion's backoff."""
         try:
-            response = self.openai_client.embeddings.create(
-                model="text-embedding-3-small",
-                input=text
+            response = await asyncio.wait_for(
+                self.openai_client.embeddings.create(model=self.embedding_model, input=[query]),
+                self.query_embedding_timeout
             )
             return response.data[0].embedding
         except Exception as e:
-            print(f"Error generating embedding: {e}")
+            print(f"Query embedding failed ({e.__class__.__name__}); continuing without it")
             return []
     
-    async def process_document(self, document_id: str, user_id: str, file_path: str, file_type: str):
-        """Process document and store chunks with embeddings"""
-        # Extract text
-        if file_type == 'application/pdf':
-            chunks = self.extract_text_from_pdf(file_path)
-        else:
-            # Handle other file types if needed
-            chunks = []
-        
-        # Generate embeddings and store chunks
-        for idx, chunk in enumerate(chunks):
-            embedding = await self.generate_embedding(chunk['content'])
-            
-            chunk_doc = {
-                'id': str(uuid.uuid4()),
-                'document_id': document_id,
-                'user_id': user_id,
-                'chunk_index': idx,
-                'content': chunk['content'],
-                'page_number': chunk.get('page_number'),
-                'embedding': embedding,
-                'created_at': datetime.now(timezone.utc).isoformat()
-            }
-            
-            await self.db.document_chunks.insert_one(chunk_doc)
+    async def embed_query(self, query: str) -> List[float]:
+        """Embedding of a user question, served from the in-process query
+        cache when the same (normalized) question was asked recently.
+        Concurrent misses for one question share a single API call. [] when
+        the question could not be embedded."""
+        cache = self.query_embedding_cache
+        if cache is None:
+            return await self._embed_query_once(query)
+        embedding = cache.get(self.embedding_model, query)
+        if embedding is not None:
+            return embedding
+        
+        key = cache.key(self.embedding_model, query)
+        if key in self._pending_queries:
+            return list(await asyncio.shield(self._pending_queries[key]))
+        future = asyncio.get_running_loop().create_future()
+        self._pending_queries[key] = future
+        try:
+            embedding = await self._embed_query_once(query)
+            if embedding:
+                cache.put(self.embedding_model, query, embedding)
+            future.set_result(embedding)
+            return embedding
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        finally:
+            del self._pending_queries[key]
+    
+    async def generate_embeddings(self, texts: List[str]) -> List[Optional[List[float]]]:
+        """Embed texts in batches of `embedding_batch_size`, running up to
+        `embedding_concurrency` batches at once. Texts already in the
+        persistent embedding cache are not sent to the API. Texts whose
+        batch failed come back as None."""
+        results: List[Optional[List[float]]] = [None] * len(texts)
+        if self.embedding_cache is not None:
+            try:
+                results = await self.embedding_cache.get_many(self.embedding_model, texts)
+            except Exception as e:
+                print(f"Embedding cache lookup failed: {e}")
+        
+        missing = [i for i, embedding in enumerate(results) if embedding is None]
+        semaphore = asyncio.Semaphore(self.embedding_concurrency)
+        
+        async def run_batch(start: int):
+            batch = missing[start:start + self.embedding_batch_size]
+            async with semaphore:
+                try:
+                    embeddings = await self._embed_batch([texts[i] for i in batch])
+                except Exception as e:
+                    print(f"Error generating embeddings for batch at {start}: {e}")
+                    return
+            for i, embedding in zip(batch, embeddings):
+                results[i] = embedding
+        
+        await asyncio.gather(*(
+            run_batch(start) for start in range(0, len(missing), self.embedding_batch_size)
+        ))
+        
+        embedded = [i for i in missing if results[i] is not None]
+        if self.embedding_cache is not None and embedded:
+            try:
+                await self.embedding_cache.put_many(
+                    self.embedding_model, [texts[i] for i in embedded], [results[i] for i in embedded]
+                )
+            except Exception as e:
+                print(f"Embedding cache update failed: {e}")
+        return results
+    
+    async def process_document(self, content_hash: str, file_path: str, file_type: str,
+                               progress: Optional[Callable[[Dict[str, Any]], Awaitable[None]]] = None,
+                               pages: Optional[List[str]] = None):
+        """Process a stored file and store chunks with embeddings.
+
+        Chunks are keyed by the file's `content_hash`, so every document
+        that shares the blob shares them too.
+
+        `pages` is the per-page text from extraction.load_pages; it is loaded
+        (and parsed once if needed) when not given. `progress` is awaited
+        with partial progress dicts (chunks_total, chunks_embedded, ...) so
+        the ingestion queue can expose job status. Chunks whose embedding
+        could not be generated are stored with `embedding_status: "failed"`
+        and no embedding, so keyword search still covers them, and the call
+        then raises: the ingestion job is retried instead of completing with
+        chunks vector search can never find. Embeddings that succeeded are
+        in the embedding cache, so a retry only embeds the failed ones. The
+        vector format follows EMBEDDING_STORAGE (see
+        services.embedding_codec).
+        """
+        if pages is None:
+            pages = await load_pages(file_path, file_type)
+        # Token counting over a whole textbook is CPU heavy; keep it off the loop
+        chunks = await asyncio.to_thread(self.chunker.chunk, pages)
+        # Keyword search works as soon as the text is chunked, even if
+        # embedding fails
+        await self.lexical_index.index_blob(content_hash, chunks)
+        # Lets SectionSummarizer tell whether the text fits a prompt as it is
+        token_count = await asyncio.to_thread(lambda: sum(self.count_tokens(chunk['content']) for chunk in chunks))
+        await self.db.blobs.update_one({'content_hash': content_hash}, {'$set': {'token_count': token_count}})
+        
+        if progress:
+            await progress({'chunks_total': len(chunks)})
+        
+        # Embed a window of concurrent batches at a time; the bulk writer
+        # stores the previous window while the next one is being embedded
+        window = self.embedding_batch_size * self.embedding_concurrency
+        created_at = datetime.now(timezone.utc).isoformat()
+        writer = BulkChunkWriter(self.db.document_chunks)
+        embedded = 0
+        failed = 0
+        try:
+            for start in range(0, len(chunks), window):
+                window_chunks = chunks[start:start + window]
+                embeddings = await self.generate_embeddings([chunk['content'] for chunk in window_chunks])
+                
+                for offset, (chunk, embedding) in enumerate(zip(window_chunks, embeddings)):
+                    chunk_index = start + offset
+                    chunk_doc = {
+                        'id': f"{content_hash}_{chunk_index}",
+                        'content_hash': content_hash,
+                        'chunk_index': chunk_index,
+                        'content': chunk['content'],
+                        'page_number': chunk.get('page_number'),
+                        'page_end': chunk.get('page_end'),
+                        'created_at': created_at
+                    }
+                    if embedding is None:
+                        chunk_doc['embedding_status'] = 'failed'
+                        failed += 1
+                    else:
+                        chunk_doc.update(encode_embedding(embedding))
+                        chunk_doc['embedding_status'] = 'ok'
+                        embedded += 1
+                    
+                    await writer.add(chunk_doc)
+                
+                if progress:
+                    await progress({'chunks_embedded': embedded, 'chunks_failed': failed})
+        
+            await writer.close()
+        except BaseException:
+            # Cancellation or a failed window: let the background insert
+            # land before the caller deletes this blob's chunks
+            await writer.discard()
+            raise
+        if writer.failures:
+            for failure in writer.failures:
+                print(f"Failed to store chunk {failure['chunk_index']} of {content_hash}: {failure['error']}")
+            failed_indexes = sorted(failure['chunk_index'] for failure in writer.failures)
+            raise Exception(f"Failed to store {len(failed_indexes)} of {len(chunks)} chunks: {failed_indexes[:20]}")
+        if failed:
+            raise Exception(f"Failed to embed {failed} of {len(chunks)} chunks")
         
         return len(chunks)
     
-    async def search_similar_chunks(self, query: str, document_ids: List[str], user_id: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """Search for similar chunks using vector similarity"""
-        # Generate query embedding
-        query_embedding = await self.generate_embedding(query)
+    def _scope_filter(self, documents: List[Dict[str, Any]], user_id: str) -> Dict[str, Any]:
+        """Chunk filter for a set of the user's documents.
+
+        Deduplicated documents share chunks by content hash; documents
+        uploaded before deduplication still own chunks by document id.
+        """
+        content_hashes = list({doc['content_hash'] for doc in documents if doc.get('content_hash')})
+        legacy_ids = [doc['id'] for doc in documents if not doc.get('content_hash')]
+        return {
+            "$or": [
+                {"content_hash": {"$in": content_hashes}},
+                {"user_id": user_id, "document_id": {"$in": legacy_ids}}
+            ]
+        }
+    
+    def _attach_document_ids(self, chunks: List[Dict[str, Any]], documents: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Point shared chunks back at the user's document holding that content"""
+        hash_to_document = {}
+        for doc in documents:
+            if doc.get('content_hash'):
+                hash_to_document.setdefault(doc['content_hash'], doc['id'])
+        for chunk in chunks:
+            if chunk.get('content_hash'):
+                chunk['document_id'] = hash_to_document.get(chunk['content_hash'])
+        return chunks
+    
+    async def search_similar_chunks(self, query: str, documents: List[Dict[str, Any]], user_id: str, top_k: int = 5,
+                                    query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Search for the chunks most relevant to `query`.
+
+        RETRIEVAL_MODE picks BM25 (`lexical`), embeddings (`vector`, falling
+        back to BM25 when the query cannot be embedded) or reciprocal rank
+        fusion of both (`hybrid`). `documents` are the user's document
+        records in scope (`id` and `content_hash` are used). A
+        `query_embedding` the caller already has is used instead of
+        embedding the query again; [] means it could not be embedded.
+        """
+        if self.retrieval_mode == 'lexical':
+            results = await self.lexical_index.search(query, documents, top_k)
+            return self._attach_document_ids(results, documents)
+        
+        if self.retrieval_mode == 'vector':
+            results = await self._vector_search(query, documents, user_id, top_k, query_embedding)
+            if not results:
+                # Embeddings unavailable (API down, chunks still embedding)
+                results = await self.lexical_index.search(query, documents, top_k)
+            return self._attach_document_ids(results, documents)
+        
+        # Hybrid: fuse both rankings so exact terms (formulas, names,
+        # section numbers) and paraphrases both surface
+        candidates = max(top_k, self.hybrid_candidates)
+        vector_results, lexical_results = await asyncio.gather(
+            self._vector_search(query, documents, user_id, candidates, query_embedding),
+            self.lexical_index.search(query, documents, candidates)
+        )
+        results = reciprocal_rank_fusion([vector_results, lexical_results])[:top_k]
+        return self._attach_document_ids(results, documents)
+    
+    async def retrieve_context(self, query: str, documents: List[Dict[str, Any]], user_id: str,
+                               query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Passages for answering `query`: CONTEXT_CANDIDATES retrieved chunks
+        merged, diversified and packed into the context token budget"""
+        chunks = await self.search_similar_chunks(
+            query, documents, user_id, top_k=self.context_candidates, query_embedding=query_embedding
+        )
+        return await asyncio.to_thread(self.context_builder.build, chunks)
+    
+    async def _vector_search(self, query: str, documents: List[Dict[str, Any]], user_id: str, top_k: int,
+                             query_embedding: Optional[List[float]] = None) -> List[Dict[str, Any]]:
+        """Nearest chunks by embedding, or [] if the query cannot be embedded"""
+        if query_embedding is None:
+            query_embedding = await self.embed_query(query)
         
         if not query_embedding:
             return []
         
-        # MongoDB vector search pipeline
+        if self.vector_backend == 'ann':
+            return await self.ann_index.search(query_embedding, documents, user_id, top_k)
+        
+        if self.vector_backend == 'local':
+            return await self.vector_index.search(query_embedding, documents, user_id, top_k)
+        
+        # MongoDB Atlas vector search pipeline. The Atlas index must declare
+        # content_hash, user_id and document_id as filter fields.
         pipeline = [
             {
                 "$vectorSearch": {
@@ -109,10 +402,7 @@ class RAGService:
                     "queryVector": query_embedding,
                     "numCandidates": top_k * 10,
                     "limit": top_k,
-                    "filter": {
-                        "user_id": user_id,
-                        "document_id": {"$in": document_ids}
-                    }
+                    "filter": self._scope_filter(documents, user_id)
                 }
             },
             {
@@ -120,73 +410,79 @@ class RAGService:
                     "_id": 0,
                     "id": 1,
                     "document_id": 1,
+                    "content_hash": 1,
                     "content": 1,
                     "page_number": 1,
+                    "page_end": 1,
                     "score": {"$meta": "vectorSearchScore"}
                 }
             }
         ]
         
         try:
-            results = await self.db.document_chunks.aggregate(pipeline).to_list(top_k)
-            return results
+            return await self.db.document_chunks.aggregate(pipeline).to_list(top_k)
         except Exception as e:
             print(f"Vector search error: {e}")
-            # Fallback to text search if vector search fails
-            return await self._fallback_text_search(query, document_ids, user_id, top_k)
+            return []
     
-    async def _fallback_text_search(self, query: str, document_ids: List[str], user_id: str, top_k: int) -> List[Dict[str, Any]]:
-        """Fallback text-based search"""
-        chunks = await self.db.document_chunks.find({
-            'user_id': user_id,
-            'document_id': {'$in': document_ids},
-            '$text': {'$search': query}
-        }, {'_id': 0}).limit(top_k).to_list(top_k)
-        
-        return chunks
+    def _page_label(self, chunk: Dict[str, Any]) -> str:
+        start = chunk.get('page_number')
+        end = chunk.get('page_end') or start
+        if start is None:
+            return "Page N/A"
+        return f"Page {start}" if end == start else f"Pages {start}-{end}"
     
-    async def generate_answer_with_context(self, query: str, relevant_chunks: List[Dict[str, Any]], age: int = None) -> Dict[str, Any]:
-        """Generate answer using LLM with retrieved context"""
-        from emergentintegrations.llm.chat import LlmChat, UserMessage
-        
-        # Get API key
-        emergent_llm_key = os.environ.get('EMERGENT_LLM_KEY', 'sk-emergent-placeholder')
-        
+    def answer_system_message(self, age: int = None) -> str:
+        system_message = "You are an expert study assistant. Answer questions based ONLY on the provided context. Include citations with document ID and page numbers."
+        if age:
+            system_message += f" The student is {age} years old."
+        return system_message
+    
+    def _answer_prompt(self, query: str, relevant_chunks: List[Dict[str, Any]]) -> str:
         # Prepare context
         context = "\n\n".join([
-            f"[Document {chunk['document_id']}, Page {chunk.get('page_number', 'N/A')}]:\n{chunk['content']}"
+            f"[Document {chunk['document_id']}, {self._page_label(chunk)}]:\n{chunk['content']}"
             for chunk in relevant_chunks
         ])
         
-        # Create system message
-        system_message = f"You are an expert study assistant. Answer questions based ONLY on the provided context. Include citations with document ID and page numbers. The student is {age} years old." if age else "You are an expert study assistant. Answer questions based ONLY on the provided context. Include citations with document ID and page numbers."
-        
-        chat = LlmChat(
-            api_key=emergent_llm_key,
-            session_id=f"rag_{uuid.uuid4()}",
-            system_message=system_message
-        ).with_model("gemini", "gemini-2.0-flash")
-        
-        user_message = UserMessage(
-            text=f"Context:\n{context}\n\nQuestion: {query}\n\nProvide a detailed answer with specific citations (document ID and page numbers)."
-        )
-        
+        return f"Context:\n{context}\n\nQuestion: {query}\n\nProvide a detailed answer with specific citations (document ID and page numbers)."
+    
+    def answer_sources(self, relevant_chunks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        return [
+            {
+                'document_id': chunk['document_id'],
+                'page': chunk.get('page_number'),
+                'page_end': chunk.get('page_end') or chunk.get('page_number'),
+                'score': chunk.get('score', 0)
+            }
+            for chunk in relevant_chunks
+        ]
+    
+    async def generate_answer_with_context(self, query: str, relevant_chunks: List[Dict[str, Any]], age: int = None) -> Dict[str, Any]:
+        """Generate answer using LLM with retrieved context"""
         try:
-            answer = await chat.send_message(user_message)
-            
-            # Extract sources from relevant chunks
-            sources = []
-            for chunk in relevant_chunks:
-                sources.append({
-                    'document_id': chunk['document_id'],
-                    'page': chunk.get('page_number'),
-                    'score': chunk.get('score', 0)
-                })
+            answer = await self.llm.complete(
+                text=self._answer_prompt(query, relevant_chunks),
+                system_message=self.answer_system_message(age),
+                model=self.answer_model
+            )
             
             return {
                 'answer': answer,
-                'sources': sources,
+                'sources': self.answer_sources(relevant_chunks),
                 'context_used': len(relevant_chunks)
             }
         except Exception as e:
             raise Exception(f"Error generating answer: {str(e)}")
+    
+    async def stream_answer_with_context(self, query: str, relevant_chunks: List[Dict[str, Any]], age: int = None) -> AsyncIterator[str]:
+        """Answer text pieces as the LLM produces them; pair with answer_sources()"""
+        try:
+            async for delta in self.llm.stream(
+                text=self._answer_prompt(query, relevant_chunks),
+                system_message=self.answer_system_message(age),
+                model=self.answer_model
+            ):
+                yield delta
+        except Exception as e:
+            raise Exception(f"Error generating answer: {str(e)}")
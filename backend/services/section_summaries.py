@@ -0,0 +1,214 @@
+"""
+Map-reduce summaries of ingested documents.
+
+Instead of attaching a whole file to every study material prompt,
+SectionSummarizer builds an outline from the chunks that
+RAGService.process_document already stored. Chunks that fit in
+MAP_REDUCE_OUTLINE_TOKENS are the outline as they are, with no LLM call;
+larger documents are condensed:
+
+  map     consecutive chunks are grouped into MAP_REDUCE_GROUP_TOKENS
+          sections, summarized in parallel (MAP_REDUCE_CONCURRENCY calls at
+          a time per worker)
+  reduce  while the summaries exceed MAP_REDUCE_OUTLINE_TOKENS, consecutive
+          summaries are grouped the same way and summarized again
+
+Every summary is persisted in `section_summaries`, keyed by the blob's
+content hash and the summarization layout (prompt version, model, group
+size), so summaries, flashcards and mindmaps of the same file, by any
+user, share one outline, and a failed run resumes where it stopped.
+Wall time grows with the number of levels, not with the number of
+sections.
+
+STUDY_GENERATION_MODE selects when outlines are used:
+
+  auto        ingested files of more than MAP_REDUCE_MIN_TOKENS tokens, by
+              default the outline budget (default)
+  map_reduce  every ingested file
+  file        never; the file is attached to the prompt as before
+"""
+
+import os
+import asyncio
+from datetime import datetime, timezone
+from typing import List, Dict, Any, Optional
+
+from services.chunker import load_token_counter
+from services.llm_gateway import LlmGateway
+from services.single_flight import SingleFlight
+
+# Bump when the section prompts change, so outlines are rebuilt
+SECTION_PROMPT_VERSION = 1
+
+_SYSTEM_MESSAGE = "You are an expert study assistant. Write dense, faithful summaries of study material."
+
+
+def _page_label(start: Optional[int], end: Optional[int]) -> str:
+    if start is None:
+        return "Pages N/A"
+    return f"Page {start}" if (end or start) == start else f"Pages {start}-{end}"
+
+
+class SectionSummarizer:
+    def __init__(self, db, llm: LlmGateway, flights: SingleFlight):
+        self.db = db
+        self.llm = llm
+        self.flights = flights
+        self.mode = os.environ.get('STUDY_GENERATION_MODE', 'auto')  # auto, map_reduce, file
+        self.group_tokens = int(os.environ.get('MAP_REDUCE_GROUP_TOKENS', '6000'))
+        self.outline_tokens = int(os.environ.get('MAP_REDUCE_OUTLINE_TOKENS', '8000'))
+        self.min_tokens = int(os.environ.get('MAP_REDUCE_MIN_TOKENS', str(self.outline_tokens)))
+        self.summary_words = int(os.environ.get('MAP_REDUCE_SUMMARY_WORDS', '250'))
+        self.concurrency = int(os.environ.get('MAP_REDUCE_CONCURRENCY', '8'))
+        self._slots = asyncio.Semaphore(self.concurrency)
+        self.count_tokens = load_token_counter('cl100k_base')
+
+    async def ensure_indexes(self):
+        await self.db.section_summaries.create_index(
+            [('content_hash', 1), ('layout', 1), ('level', 1), ('index', 1)], unique=True
+        )
+
+    @property
+    def layout(self) -> str:
+        return f"v{SECTION_PROMPT_VERSION}:{self.llm.model}:{self.group_tokens}:{self.summary_words}"
+
+    async def applies(self, content_hash: Optional[str]) -> bool:
+        """Whether material for this blob should be generated from its outline"""
+        if self.mode == 'file' or not content_hash:
+            return False
+        blob = await self.db.blobs.find_one(
+            {'content_hash': content_hash},
+            {'_id': 0, 'ingested_at': 1, 'lexical_stats': 1, 'token_count': 1}
+        )
+        if not blob or not blob.get('ingested_at'):
+            # Chunks are incomplete until ingestion finishes
+            return False
+        chunks = (blob.get('lexical_stats') or {}).get('chunks', 0)
+        # Blobs ingested before token counts were recorded stay on the file
+        tokens = blob.get('token_count', 0)
+        return chunks > 0 and (self.mode == 'map_reduce' or tokens > self.min_tokens)
+
+    async def outline(self, content_hash: str) -> str:
+        """The document as ordered, page-labelled text that fits
+        MAP_REDUCE_OUTLINE_TOKENS: its chunks when they fit, otherwise
+        section summaries built once per blob and layout"""
+        result_id = f"{content_hash}:{self.layout}"
+        outline = await self._load(result_id)
+        if outline is not None:
+            return outline
+        chunks = await self.db.document_chunks.find(
+            {'content_hash': content_hash},
+            {'_id': 0, 'chunk_index': 1, 'content': 1, 'page_number': 1, 'page_end': 1}
+        ).sort('chunk_index', 1).to_list(None)
+        if not chunks:
+            raise ValueError(f"No stored chunks for {content_hash}")
+        if await asyncio.to_thread(self._fits, chunks, 'content'):
+            return self._format(chunks, 'content')
+        return await self.flights.run(f"outline:{result_id}", lambda: self._build(content_hash, chunks), self._load)
+
+    async def _load(self, result_id: str) -> Optional[str]:
+        content_hash, layout = result_id.split(':', 1)
+        top = await self.db.section_summaries.find_one(
+            {'content_hash': content_hash, 'layout': layout, 'final': True},
+            {'_id': 0, 'level': 1}
+        )
+        if top is None:
+            return None
+        return self._format(await self._level(content_hash, top['level']), 'summary')
+
+    async def _level(self, content_hash: str, level: int) -> List[Dict[str, Any]]:
+        return await self.db.section_summaries.find(
+            {'content_hash': content_hash, 'layout': self.layout, 'level': level},
+            {'_id': 0}
+        ).sort('index', 1).to_list(None)
+
+    def _format(self, sections: List[Dict[str, Any]], text_field: str) -> str:
+        return "\n\n".join(
+            f"[{_page_label(section.get('page_number'), section.get('page_end'))}]\n{section[text_field]}"
+            for section in sections
+        )
+
+    def _fits(self, items: List[Dict[str, Any]], text_field: str) -> bool:
+        """Whether the items fit in the outline budget; stops counting once they don't"""
+        used = 0
+        for item in items:
+            used += self.count_tokens(item[text_field])
+            if used > self.outline_tokens:
+                return False
+        return True
+
+    def _group(self, items: List[Dict[str, Any]], text_field: str) -> List[List[Dict[str, Any]]]:
+        """Consecutive runs of items of up to group_tokens, at least two per
+        group when reducing so every level shrinks"""
+        groups: List[List[Dict[str, Any]]] = []
+        used = 0
+        for item in items:
+            tokens = self.count_tokens(item[text_field])
+            if groups and (used + tokens <= self.group_tokens or (text_field == 'summary' and len(groups[-1]) < 2)):
+                groups[-1].append(item)
+                used += tokens
+            else:
+                groups.append([item])
+                used = tokens
+        return groups
+
+    async def _summarize(self, prompt: str) -> str:
+        async with self._slots:
+            return await self.llm.complete(text=prompt, system_message=_SYSTEM_MESSAGE)
+
+    async def _summarize_level(self, content_hash: str, level: int, groups: List[List[Dict[str, Any]]],
+                               text_field: str) -> List[Dict[str, Any]]:
+        """Summaries of `groups` at `level`, generating only the missing ones"""
+        stored = {section['index']: section for section in await self._level(content_hash, level)}
+        instruction = (
+            "Summarize this section of a document" if level == 0
+            else "Combine these consecutive section summaries of a document into one summary"
+        )
+
+        async def summarize_group(index: int, group: List[Dict[str, Any]]) -> Dict[str, Any]:
+            if index in stored:
+                return stored[index]
+            page_number = group[0].get('page_number')
+            page_end = group[-1].get('page_end') or group[-1].get('page_number')
+            text = "\n\n".join(item[text_field] for item in group)
+            summary = await self._summarize(
+                f"{instruction} ({_page_label(page_number, page_end)}) in at most {self.summary_words} words. "
+                "Keep every key concept, definition, formula, date and example a student needs, "
+                "and add nothing that is not in the text.\n\n"
+                f"{text}"
+            )
+            section = {
+                'content_hash': content_hash,
+                'layout': self.layout,
+                'level': level,
+                'index': index,
+                'page_number': page_number,
+                'page_end': page_end,
+                'summary': summary,
+                'final': False,
+                'created_at': datetime.now(timezone.utc).isoformat()
+            }
+            await self.db.section_summaries.update_one(
+                {'content_hash': content_hash, 'layout': self.layout, 'level': level, 'index': index},
+                {'$setOnInsert': section},
+                upsert=True
+            )
+            return section
+
+        return list(await asyncio.gather(*(summarize_group(index, group) for index, group in enumerate(groups))))
+
+    async def _build(self, content_hash: str, chunks: List[Dict[str, Any]]):
+        """Map `chunks`, which exceed the outline budget, then reduce"""
+        level = 0
+        # Counting the tokens of a whole textbook is CPU heavy; keep it off the loop
+        groups = await asyncio.to_thread(self._group, chunks, 'content')
+        sections = await self._summarize_level(content_hash, level, groups, 'content')
+        while len(sections) > 1 and not self._fits(sections, 'summary'):
+            level += 1
+            sections = await self._summarize_level(content_hash, level, self._group(sections, 'summary'), 'summary')
+
+        await self.db.section_summaries.update_many(
+            {'content_hash': content_hash, 'layout': self.layout, 'level': level},
+            {'$set': {'final': True}}
+        )
+        return self._format(sections, 'summary'), f"{content_hash}:{self.layout}"
@@ -0,0 +1,123 @@
+import os
+import uuid
+import asyncio
+from datetime import datetime, timezone, timedelta
+from typing import Any, Awaitable, Callable, Dict, Tuple
+
+from pymongo.errors import DuplicateKeyError
+
+
+class SingleFlightTimeout(Exception):
+    pass
+
+
+class SingleFlight:
+    """Coalesces concurrent identical generations into one.
+
+    Callers in this process share an in-memory future. Across worker
+    processes a lock record in `generation_locks` (keyed by the caller's
+    key) elects one producer; the others poll it until it is marked done
+    with the result's id, or vanishes because the producer failed, in
+    which case they compete for the lock again. Locks carry an expiry that
+    the producer extends while it works, so a crashed worker's lock is
+    taken over. A finished lock keeps pointing at its result for
+    GENERATION_RESULT_TTL seconds, which also absorbs double clicks that
+    arrive just after the first generation completed.
+    """
+
+    def __init__(self, db):
+        self.db = db
+        self.lock_ttl = float(os.environ.get('GENERATION_LOCK_TTL', '60'))
+        self.result_ttl = float(os.environ.get('GENERATION_RESULT_TTL', '10'))
+        self.wait_timeout = float(os.environ.get('GENERATION_WAIT_TIMEOUT', '600'))
+        self.poll_interval = float(os.environ.get('GENERATION_POLL_INTERVAL', '0.5'))
+        self._inflight: Dict[str, asyncio.Future] = {}
+
+    async def ensure_indexes(self):
+        await self.db.generation_locks.create_index('expires_at', expireAfterSeconds=0)
+
+    def _expiry(self, seconds: float) -> datetime:
+        return datetime.now(timezone.utc) + timedelta(seconds=seconds)
+
+    async def run(self, key: str, produce: Callable[[], Awaitable[Tuple[Any, str]]],
+                  load_result: Callable[[str], Awaitable[Any]]) -> Any:
+        """Result of `produce()`, or of the identical generation already
+        running. `produce` returns (result, result id); `load_result` turns a
+        result id written by another process back into a result."""
+        if key in self._inflight:
+            return await asyncio.shield(self._inflight[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[key] = future
+        try:
+            result = await self._run_locked(key, produce, load_result)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Nobody else may be waiting; mark the exception as retrieved
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._inflight[key]
+
+    async def _try_acquire(self, key: str, token: str) -> bool:
+        lock = {'owner': token, 'state': 'running', 'result_id': None, 'expires_at': self._expiry(self.lock_ttl)}
+        try:
+            await self.db.generation_locks.insert_one({'_id': key, **lock})
+            return True
+        except DuplicateKeyError:
+            # Take over a lock whose owner died before the TTL monitor removed it
+            taken = await self.db.generation_locks.find_one_and_update(
+                {'_id': key, 'expires_at': {'$lt': datetime.now(timezone.utc)}},
+                {'$set': lock}
+            )
+            return taken is not None
+
+    async def _keep_alive(self, key: str, token: str):
+        while True:
+            await asyncio.sleep(self.lock_ttl / 3)
+            await self.db.generation_locks.update_one(
+                {'_id': key, 'owner': token},
+                {'$set': {'expires_at': self._expiry(self.lock_ttl)}}
+            )
+
+    async def _run_locked(self, key: str, produce, load_result) -> Any:
+        deadline = asyncio.get_running_loop().time() + self.wait_timeout
+        while True:
+            token = str(uuid.uuid4())
+            if await self._try_acquire(key, token):
+                return await self._produce(key, token, produce)
+
+            # Someone else is generating (or just finished)
+            while True:
+                lock = await self.db.generation_locks.find_one({'_id': key})
+                if lock is None:
+                    break
+                if lock['state'] == 'done':
+                    result = await load_result(lock['result_id'])
+                    if result is not None:
+                        return result
+                    break
+                if asyncio.get_running_loop().time() > deadline:
+                    raise SingleFlightTimeout(f"Timed out waiting for generation {key}")
+                await asyncio.sleep(self.poll_interval)
+
+    async def _produce(self, key: str, token: str, produce) -> Any:
+        keep_alive = asyncio.create_task(self._keep_alive(key, token))
+        try:
+            result, result_id = await produce()
+        except BaseException:
+            keep_alive.cancel()
+            await self.db.generation_locks.delete_one({'_id': key, 'owner': token})
+            raise
+        keep_alive.cancel()
+        await self.db.generation_locks.update_one(
+            {'_id': key, 'owner': token},
+            {'$set': {'state': 'done', 'result_id': result_id, 'expires_at': self._expiry(self.result_ttl)}}
+        )
+        return result
@@ -0,0 +1,19 @@
+import json
+from typing import AsyncIterator, Dict, Any
+
+from fastapi.responses import StreamingResponse
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> str:
+    """One Server-Sent Events frame with a JSON payload"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
+def sse_response(events: AsyncIterator[str]) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type='text/event-stream',
+        # Proxies must pass frames through as they are written
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
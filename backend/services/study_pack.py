@@ -0,0 +1,58 @@
+"""
+Schemas of generated study material and parsing of study pack replies.
+
+A study pack is a summary, flashcards and a mindmap produced by one
+structured LLM call. STUDY_PACK_PARTS maps each material type to the
+reply field that holds it and the description the prompt gives for it.
+"""
+
+from typing import List, Optional, Dict, Any
+
+from pydantic import BaseModel, Field, ConfigDict
+
+
+class Flashcard(BaseModel):
+    question: str = Field(min_length=1)
+    answer: str = Field(min_length=1)
+
+
+class MindmapNode(BaseModel):
+    title: str = Field(min_length=1)
+    children: List["MindmapNode"] = []
+
+
+class StudyPack(BaseModel):
+    """Schema of the study pack reply; only the requested parts are set"""
+    model_config = ConfigDict(extra="ignore")
+
+    summary: Optional[str] = Field(default=None, min_length=1)
+    flashcards: Optional[List[Flashcard]] = Field(default=None, min_length=1)
+    mindmap: Optional[MindmapNode] = None
+
+
+STUDY_PACK_PARTS = {
+    "summary": ("summary", "a comprehensive summary string with the key points, main ideas and important details, in a clear, structured format"),
+    "flashcard": ("flashcards", "an array of 10-15 objects with non-empty \"question\" and \"answer\" strings"),
+    "mindmap": ("mindmap", "a hierarchical object {\"title\": string, \"children\": [objects of the same shape]}")
+}
+
+
+def parse_study_pack(response: str, material_types: List[str]) -> Dict[str, Dict[str, Any]]:
+    """Contents per material type from a study pack reply; raises
+    ValueError unless every requested part matches the schema"""
+    start, end = response.find('{'), response.rfind('}')
+    if start == -1 or end < start:
+        raise ValueError("reply contains no JSON object")
+    pack = StudyPack.model_validate_json(response[start:end + 1])
+    contents = {}
+    for material_type in material_types:
+        field = STUDY_PACK_PARTS[material_type][0]
+        value = getattr(pack, field)
+        if value is None:
+            raise ValueError(f"reply is missing \"{field}\"")
+        if isinstance(value, list):
+            value = [item.model_dump() for item in value]
+        elif isinstance(value, BaseModel):
+            value = value.model_dump()
+        contents[material_type] = {field: value}
+    return contents
@@ -0,0 +1,52 @@
+import os
+import hashlib
+from pathlib import Path
+from typing import Dict, Any
+
+import anyio
+from fastapi import UploadFile
+
+UPLOAD_CHUNK_SIZE = int(os.environ.get('UPLOAD_CHUNK_SIZE', str(1024 * 1024)))
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(50 * 1024 * 1024)))
+
+
+class UploadTooLarge(Exception):
+    def __init__(self, max_bytes: int):
+        super().__init__(f"File exceeds the {max_bytes // (1024 * 1024)} MB upload limit")
+        self.max_bytes = max_bytes
+
+
+async def save_upload(upload: UploadFile, destination: Path, max_bytes: int = MAX_UPLOAD_BYTES) -> Dict[str, Any]:
+    """Copy an upload to `destination` in UPLOAD_CHUNK_SIZE pieces.
+
+    The SHA-256 and byte size are computed while writing, and the copy is
+    aborted as soon as it passes `max_bytes`. Data goes to a `.part` file
+    that is renamed into place only once complete, so a failed upload never
+    leaves a truncated file behind.
+
+    Starlette has already received the whole multipart body into its spool
+    file by the time an endpoint runs, so `max_bytes` bounds what is copied
+    and kept, not what the client can send. Only the `upload.size` check
+    rejects before copying; limits on the request itself belong in the
+    proxy in front of the app.
+    """
+    if upload.size is not None and upload.size > max_bytes:
+        raise UploadTooLarge(max_bytes)
+
+    digest = hashlib.sha256()
+    size = 0
+    part_path = destination.with_name(destination.name + '.part')
+    try:
+        async with await anyio.open_file(part_path, 'wb') as out:
+            while chunk := await upload.read(UPLOAD_CHUNK_SIZE):
+                size += len(chunk)
+                if size > max_bytes:
+                    raise UploadTooLarge(max_bytes)
+                digest.update(chunk)
+                await out.write(chunk)
+        await anyio.Path(part_path).rename(destination)
+    except BaseException:
+        await anyio.Path(part_path).unlink(missing_ok=True)
+        raise
+
+    return {'path': destination, 'size': size, 'sha256': digest.hexdigest()}
@@ -0,0 +1,213 @@
+import os
+import asyncio
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional, Tuple
+
+import numpy as np
+
+from services.embedding_codec import (
+    EMBEDDING_STORAGE, EMBEDDING_FIELDS, HAS_EMBEDDING, decode_float32, decode_int8
+)
+
+
+class _Segment:
+    """Row-normalized float32 embeddings of one blob (or legacy document)"""
+
+    def __init__(self, ids: List[str], matrix: np.ndarray):
+        self.ids = ids
+        self.matrix = matrix
+
+    @property
+    def nbytes(self) -> int:
+        return self.matrix.nbytes
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        return self.matrix @ query
+
+
+class _QuantizedSegment:
+    """int8 codes of one blob; a quarter of the float32 working set"""
+
+    BLOCK_ROWS = 8192
+
+    def __init__(self, ids: List[str], codes: np.ndarray, inv_norms: np.ndarray):
+        self.ids = ids
+        self.codes = codes
+        self.inv_norms = inv_norms
+
+    @property
+    def nbytes(self) -> int:
+        return self.codes.nbytes + self.inv_norms.nbytes
+
+    def scores(self, query: np.ndarray) -> np.ndarray:
+        # Cosine against the dequantized rows; the per-vector scale cancels
+        # out. Blocks bound the float32 temporaries.
+        out = np.empty(len(self.ids), dtype=np.float32)
+        for start in range(0, len(self.ids), self.BLOCK_ROWS):
+            block = self.codes[start:start + self.BLOCK_ROWS].astype(np.float32)
+            out[start:start + len(block)] = block @ query
+        return out * self.inv_norms
+
+
+class LocalVectorIndex:
+    """In-process cosine search over document_chunks embeddings.
+
+    Embeddings are loaded from Mongo once per ingested blob into a
+    contiguous matrix, so a query is one matmul per segment plus an
+    argpartition for the top k. With EMBEDDING_STORAGE=int8 the matrix
+    holds int8 codes, quantized on load, and the best
+    `top_k * VECTOR_RESCORE_FACTOR` candidates are rescored against their
+    stored float32 vectors: a quarter of the memory for slower scoring.
+    Segments are kept in an LRU bounded by VECTOR_INDEX_MAX_BYTES and keyed
+    by the blob's `ingested_at`, so re-ingestion in any worker process is
+    picked up. Blobs still being ingested are read fresh on every query.
+    """
+
+    def __init__(self, db, max_bytes: Optional[int] = None, quantized: Optional[bool] = None):
+        self.db = db
+        self.max_bytes = max_bytes or int(os.environ.get('VECTOR_INDEX_MAX_BYTES', str(1024 ** 3)))
+        self.quantized = EMBEDDING_STORAGE == 'int8' if quantized is None else quantized
+        self.rescore_factor = int(os.environ.get('VECTOR_RESCORE_FACTOR', '4'))
+        self._segments: 'OrderedDict[Tuple, Any]' = OrderedDict()
+        self._bytes = 0
+        self._loading: Dict[Tuple, asyncio.Future] = {}
+
+    def _build_segment(self, chunks: List[Dict[str, Any]]):
+        ids = [chunk['id'] for chunk in chunks]
+        if not ids:
+            return _Segment([], np.zeros((0, 0), dtype=np.float32))
+        if self.quantized:
+            codes = np.vstack([decode_int8(chunk)[0] for chunk in chunks])
+            norms = np.linalg.norm(codes.astype(np.float32), axis=1)
+            return _QuantizedSegment(ids, codes, (1 / np.where(norms == 0, 1, norms)).astype(np.float32))
+        matrix = np.vstack([decode_float32(chunk) for chunk in chunks]).astype(np.float32)
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        matrix /= np.where(norms == 0, 1, norms)
+        return _Segment(ids, np.ascontiguousarray(matrix))
+
+    async def _fetch_segment(self, chunk_filter: Dict[str, Any]):
+        if self.quantized:
+            # int8 codes stored by earlier versions where present; the rest
+            # are quantized on load
+            chunks = await self.db.document_chunks.find(
+                {**chunk_filter, 'embedding_q8': {'$exists': True}},
+                {'_id': 0, 'id': 1, 'embedding_q8': 1, 'embedding_scale': 1}
+            ).to_list(None)
+            chunks += await self.db.document_chunks.find(
+                {**chunk_filter, 'embedding_q8': {'$exists': False}, **HAS_EMBEDDING},
+                {'_id': 0, 'id': 1, 'embedding': 1, 'embedding_f32': 1}
+            ).to_list(None)
+        else:
+            chunks = await self.db.document_chunks.find(
+                {**chunk_filter, **HAS_EMBEDDING},
+                {'_id': 0, 'id': 1, 'embedding': 1, 'embedding_f32': 1}
+            ).to_list(None)
+        return await asyncio.to_thread(self._build_segment, chunks)
+
+    def _remember(self, key: Tuple, segment):
+        self._segments[key] = segment
+        self._bytes += segment.nbytes
+        while self._bytes > self.max_bytes and len(self._segments) > 1:
+            _, evicted = self._segments.popitem(last=False)
+            self._bytes -= evicted.nbytes
+
+    async def _segment(self, key: Tuple, chunk_filter: Dict[str, Any], cacheable: bool):
+        if not cacheable:
+            return await self._fetch_segment(chunk_filter)
+        if key in self._segments:
+            self._segments.move_to_end(key)
+            return self._segments[key]
+        if key in self._loading:
+            return await asyncio.shield(self._loading[key])
+
+        future = asyncio.get_running_loop().create_future()
+        self._loading[key] = future
+        try:
+            segment = await self._fetch_segment(chunk_filter)
+        except BaseException as e:
+            if isinstance(e, Exception):
+                future.set_exception(e)
+                # Nobody else may be waiting; mark the exception as retrieved
+                future.exception()
+            else:
+                future.cancel()
+            raise
+        else:
+            self._remember(key, segment)
+            future.set_result(segment)
+            return segment
+        finally:
+            del self._loading[key]
+
+    async def _segments_for(self, documents: List[Dict[str, Any]], user_id: str) -> List[Any]:
+        content_hashes = list({doc['content_hash'] for doc in documents if doc.get('content_hash')})
+        blobs = await self.db.blobs.find(
+            {'content_hash': {'$in': content_hashes}},
+            {'_id': 0, 'content_hash': 1, 'ingested_at': 1}
+        ).to_list(None)
+
+        loads = [
+            self._segment(
+                ('blob', blob['content_hash'], blob.get('ingested_at')),
+                {'content_hash': blob['content_hash']},
+                cacheable=blob.get('ingested_at') is not None
+            )
+            for blob in blobs
+        ]
+        # Documents uploaded before content-addressed storage never change
+        loads += [
+            self._segment(
+                ('document', doc['id']),
+                {'user_id': user_id, 'document_id': doc['id']},
+                cacheable=True
+            )
+            for doc in documents if not doc.get('content_hash')
+        ]
+        return await asyncio.gather(*loads)
+
+    async def search(self, query_embedding: List[float], documents: List[Dict[str, Any]],
+                     user_id: str, top_k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k chunks by cosine similarity, with content but no embedding"""
+        segments = [segment for segment in await self._segments_for(documents, user_id) if segment.ids]
+        if not segments:
+            return []
+
+        query = np.asarray(query_embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1.0
+        scores = np.concatenate([segment.scores(query) for segment in segments])
+        ends = np.cumsum([len(segment.ids) for segment in segments])
+
+        candidates = min(top_k * self.rescore_factor if self.quantized else top_k, len(scores))
+        top = np.argpartition(-scores, candidates - 1)[:candidates]
+        score_by_id = {}
+        for i in top:
+            owner = int(np.searchsorted(ends, i, side='right'))
+            offset = i - (ends[owner - 1] if owner else 0)
+            score_by_id[segments[owner].ids[offset]] = float(scores[i])
+
+        projection = {'_id': 0, **{field: 0 for field in EMBEDDING_FIELDS}}
+        if self.quantized:
+            # Keep the full-precision vectors for rescoring
+            projection = {'_id': 0, 'embedding_q8': 0, 'embedding_scale': 0}
+        chunks = await self.db.document_chunks.find(
+            {'id': {'$in': list(score_by_id)}},
+            projection
+        ).to_list(candidates)
+
+        for chunk in chunks:
+            chunk['score'] = score_by_id[chunk['id']]
+            if self.quantized:
+                vector = decode_float32(chunk)
+                if vector is not None:
+                    chunk['score'] = float(vector @ query / (np.linalg.norm(vector) or 1.0))
+                chunk.pop('embedding', None)
+                chunk.pop('embedding_f32', None)
+        chunks.sort(key=lambda chunk: chunk['score'], reverse=True)
+        return chunks[:top_k]
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'segments': len(self._segments),
+            'bytes': self._bytes,
+            'max_bytes': self.max_bytes
+        }
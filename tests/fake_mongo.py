@@ -0,0 +1,260 @@
+"""Just enough of Motor's collection API for the services under test.
+
+Documents live in plain lists; queries support equality (matching any
+element of an array field), dotted paths, $in/$nin/$ne/$lt/$lte/$gt/$gte/
+$exists and $or/$and, and updates support $set/$setOnInsert/$inc/$unset
+with upserts and unique indexes.
+"""
+
+import copy
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional
+
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+
+def _get(document: Dict[str, Any], path: str):
+    value = document
+    for part in path.split('.'):
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+
+def _set(document: Dict[str, Any], path: str, value):
+    *parents, last = path.split('.')
+    for part in parents:
+        document = document.setdefault(part, {})
+    document[last] = value
+
+
+def _unset(document: Dict[str, Any], path: str):
+    *parents, last = path.split('.')
+    for part in parents:
+        document = document.get(part, {})
+    document.pop(last, None)
+
+
+def _compare(value, operator: str, operand) -> bool:
+    if operator == '$in':
+        return value in operand
+    if operator == '$nin':
+        return value not in operand
+    if operator == '$ne':
+        return value != operand
+    if operator == '$exists':
+        return (value is not _MISSING) == bool(operand)
+    if value is _MISSING or value is None:
+        return False
+    if operator == '$lt':
+        return value < operand
+    if operator == '$lte':
+        return value <= operand
+    if operator == '$gt':
+        return value > operand
+    if operator == '$gte':
+        return value >= operand
+    raise NotImplementedError(operator)
+
+
+def matches(document: Dict[str, Any], query: Dict[str, Any]) -> bool:
+    for field, condition in query.items():
+        if field == '$or':
+            if not any(matches(document, clause) for clause in condition):
+                return False
+            continue
+        if field == '$and':
+            if not all(matches(document, clause) for clause in condition):
+                return False
+            continue
+        value = _get(document, field)
+        if isinstance(condition, dict) and condition and all(key.startswith('$') for key in condition):
+            if value is _MISSING and '$ne' in condition and len(condition) == 1:
+                continue
+            if value is _MISSING and '$nin' in condition and len(condition) == 1:
+                continue
+            if not all(_compare(value, operator, operand) for operator, operand in condition.items()):
+                return False
+        elif isinstance(value, list) and not isinstance(condition, list):
+            # Equality on an array field matches any element
+            if condition not in value:
+                return False
+        elif (None if value is _MISSING else value) != condition:
+            return False
+    return True
+
+
+def _project(document: Dict[str, Any], projection: Optional[Dict[str, int]]) -> Dict[str, Any]:
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    included = [field for field, flag in projection.items() if flag and field != '_id']
+    if included:
+        projected = {field: document[field] for field in included if field in document}
+        if projection.get('_id', 1) and '_id' in document:
+            projected['_id'] = document['_id']
+        return projected
+    return {field: value for field, value in document.items() if projection.get(field, 1)}
+
+
+def _sort_key(sort):
+    if isinstance(sort, str):
+        sort = [(sort, 1)]
+    return sort
+
+
+def _sorted(documents: List[Dict[str, Any]], sort) -> List[Dict[str, Any]]:
+    for field, direction in reversed(_sort_key(sort)):
+        documents = sorted(
+            documents,
+            key=lambda document: (_get(document, field) is _MISSING, _get(document, field) if _get(document, field) is not _MISSING else None),
+            reverse=direction < 0
+        )
+    return documents
+
+
+class FakeCursor:
+    def __init__(self, documents: List[Dict[str, Any]]):
+        self.documents = documents
+
+    def sort(self, field, direction: int = 1):
+        self.documents = _sorted(self.documents, field if isinstance(field, list) else [(field, direction)])
+        return self
+
+    def limit(self, count: int):
+        if count:
+            self.documents = self.documents[:count]
+        return self
+
+    async def to_list(self, length=None):
+        return self.documents if length is None else self.documents[:length]
+
+
+class FakeCollection:
+    def __init__(self):
+        self.documents: List[Dict[str, Any]] = []
+        self.unique: List[List[str]] = []
+
+    async def create_index(self, keys, unique: bool = False, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        if unique:
+            self.unique.append([field for field, _ in keys])
+
+    def _check_unique(self, document: Dict[str, Any], ignore: Optional[Dict[str, Any]] = None):
+        for fields in self.unique + [['_id']]:
+            key = [_get(document, field) for field in fields]
+            for other in self.documents:
+                if other is not ignore and [_get(other, field) for field in fields] == key:
+                    raise DuplicateKeyError(f"duplicate key {dict(zip(fields, key))}")
+
+    async def insert_one(self, document: Dict[str, Any]):
+        document.setdefault('_id', ObjectId())
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self.documents.append(stored)
+        return SimpleNamespace(inserted_id=document['_id'])
+
+    async def insert_many(self, documents, ordered: bool = True):
+        for document in documents:
+            await self.insert_one(document)
+        return SimpleNamespace(inserted_ids=[document['_id'] for document in documents])
+
+    def _matching(self, query, sort=None) -> List[Dict[str, Any]]:
+        documents = [document for document in self.documents if matches(document, query or {})]
+        return _sorted(documents, sort) if sort else documents
+
+    def find(self, query=None, projection=None):
+        return FakeCursor([_project(document, projection) for document in self._matching(query)])
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        documents = self._matching(query, sort)
+        return _project(documents[0], projection) if documents else None
+
+    async def count_documents(self, query):
+        return len(self._matching(query))
+
+    def _apply(self, document: Dict[str, Any], update: Dict[str, Any], inserting: bool):
+        for path, value in update.get('$set', {}).items():
+            _set(document, path, copy.deepcopy(value))
+        if inserting:
+            for path, value in update.get('$setOnInsert', {}).items():
+                _set(document, path, copy.deepcopy(value))
+        for path, amount in update.get('$inc', {}).items():
+            current = _get(document, path)
+            _set(document, path, (0 if current is _MISSING else current) + amount)
+        for path in update.get('$unset', {}):
+            _unset(document, path)
+
+    def _upsert(self, query: Dict[str, Any], update: Dict[str, Any]) -> Dict[str, Any]:
+        document = {
+            field: value for field, value in query.items()
+            if not field.startswith('$') and not isinstance(value, dict)
+        }
+        document.setdefault('_id', ObjectId())
+        self._apply(document, update, inserting=True)
+        self._check_unique(document)
+        self.documents.append(document)
+        return document
+
+    async def update_one(self, query, update, upsert: bool = False):
+        documents = self._matching(query)
+        if documents:
+            before = copy.deepcopy(documents[0])
+            self._apply(documents[0], update, inserting=False)
+            return SimpleNamespace(matched_count=1, modified_count=int(before != documents[0]), upserted_id=None)
+        if upsert:
+            return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=self._upsert(query, update)['_id'])
+        return SimpleNamespace(matched_count=0, modified_count=0, upserted_id=None)
+
+    async def update_many(self, query, update):
+        documents = self._matching(query)
+        for document in documents:
+            self._apply(document, update, inserting=False)
+        return SimpleNamespace(matched_count=len(documents), modified_count=len(documents))
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert: bool = False,
+                                  return_document=ReturnDocument.BEFORE):
+        documents = self._matching(query, sort)
+        if not documents:
+            if not upsert:
+                return None
+            document = self._upsert(query, update)
+            return _project(document, projection) if return_document == ReturnDocument.AFTER else None
+        document = documents[0]
+        before = _project(document, projection)
+        self._apply(document, update, inserting=False)
+        return _project(document, projection) if return_document == ReturnDocument.AFTER else before
+
+    async def delete_one(self, query):
+        documents = self._matching(query)
+        if documents:
+            self.documents.remove(documents[0])
+        return SimpleNamespace(deleted_count=len(documents[:1]))
+
+    async def delete_many(self, query):
+        documents = self._matching(query)
+        self.documents = [document for document in self.documents if document not in documents]
+        return SimpleNamespace(deleted_count=len(documents))
+
+    async def bulk_write(self, requests, ordered: bool = True):
+        for request in requests:
+            await self.insert_one(request._doc)
+
+
+class FakeDatabase:
+    def __init__(self):
+        self._collections: Dict[str, FakeCollection] = {}
+
+    def __getattr__(self, name: str) -> FakeCollection:
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return self._collections.setdefault(name, FakeCollection())
+
+    def __getitem__(self, name: str) -> FakeCollection:
+        return getattr(self, name)
@@ -0,0 +1,82 @@
+import numpy as np
+
+from services.ann_index import _UserIndex
+
+
+def _vectors(count, dimensions=8, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dimensions)).astype(np.float32)
+
+
+def _index(blobs, min_train=None):
+    index = _UserIndex()
+    for content_hash, matrix in blobs.items():
+        index.add(content_hash, 'v1', [f'{content_hash}_{i}' for i in range(len(matrix))], matrix)
+    if min_train is not None:
+        index = index.compacted(min_train)
+    return index
+
+
+def test_search_returns_the_nearest_chunk_in_scope():
+    a, b = _vectors(20, seed=1), _vectors(20, seed=2)
+    index = _index({'a': a, 'b': b})
+
+    query = a[7] / np.linalg.norm(a[7])
+    hits = index.search(query, ['a'], top_k=3, nprobe=4, exact_limit=1000)
+    assert max(hits, key=lambda hit: hit[1])[0] == 'a_7'
+    assert all(chunk_id.startswith('a_') for chunk_id, _ in hits)
+    assert index.search(query, ['missing'], top_k=3, nprobe=4, exact_limit=1000) == []
+
+
+def test_add_replaces_and_remove_tombstones_a_blob():
+    index = _index({'a': _vectors(10), 'b': _vectors(5, seed=3)})
+    index.add('a', 'v2', ['a_new'], _vectors(1, seed=4))
+
+    assert index.versions == {'a': 'v2', 'b': 'v1'}
+    assert index.tombstones == 10
+    assert index.live == 6
+    query = np.ones(8, dtype=np.float32)
+    assert [chunk_id for chunk_id, _ in index.search(query, ['a'], 10, 4, 1000)] == ['a_new']
+
+    index.remove('b')
+    assert index.live == 1
+    assert 'b' not in index.versions
+    assert index.search(query, ['b'], 10, 4, 1000) == []
+
+
+def test_compaction_drops_tombstones_and_trains_centroids():
+    index = _index({'a': _vectors(300, seed=5), 'b': _vectors(100, seed=6)})
+    index.remove('b')
+    assert index.needs_compaction(min_train=256)
+
+    compacted = index.compacted(min_train=256)
+    assert compacted.size == compacted.live == 300
+    assert compacted.hashes == ['a']
+    assert compacted.centroids is not None
+    assert compacted.trained_on == 300
+    assert sum(len(rows) for rows in compacted.lists) == 300
+    assert not compacted.needs_compaction(min_train=256)
+
+    # Probing every list finds the same best chunk as an exact scan
+    query = _vectors(1, seed=7)[0]
+    query /= np.linalg.norm(query)
+    probed = compacted.search(query, ['a'], 5, nprobe=len(compacted.lists), exact_limit=0)
+    exact = compacted.search(query, ['a'], 5, nprobe=1, exact_limit=1000)
+    assert sorted(probed) == sorted(exact)
+
+
+def test_save_and_load_round_trip(tmp_path):
+    index = _index({'a': _vectors(300, seed=8), 'b': _vectors(10, seed=9)}, min_train=256)
+    index.remove('b')
+    path = tmp_path / 'user.npz'
+    index.save(path)
+
+    loaded = _UserIndex.load(path)
+    assert loaded.ids == index.ids
+    assert loaded.hashes == index.hashes
+    assert loaded.versions == index.versions
+    assert loaded.tombstones == index.tombstones
+    assert loaded.trained_on == index.trained_on
+    np.testing.assert_array_equal(loaded.centroids, index.centroids)
+    query = _vectors(1, seed=10)[0]
+    assert loaded.search(query, ['a', 'b'], 5, 4, 0) == index.search(query, ['a', 'b'], 5, 4, 0)
+    assert not path.with_suffix('.tmp').exists()
@@ -0,0 +1,88 @@
+import asyncio
+
+from services.answer_cache import AnswerCache
+from tests.fake_mongo import FakeDatabase
+
+_RESULT = {'answer': 'Mitochondria.', 'sources': [], 'context_used': True}
+
+
+def _document(document_id):
+    return {'id': document_id, 'content_hash': f'hash-{document_id}'}
+
+
+def _cache():
+    cache = AnswerCache(FakeDatabase())
+    cache.enabled = True
+    cache.threshold = 0.95
+    return cache
+
+
+async def _store(cache, session_id, documents, embedding=(1.0, 0.0)):
+    scope_key = await cache.scope_key(documents, 'system', 'model')
+    await cache.store('user', session_id, scope_key, documents, 'What makes ATP?', list(embedding), _RESULT)
+    return scope_key
+
+
+def test_similar_questions_in_the_same_scope_hit():
+    cache = _cache()
+
+    async def run():
+        scope_key = await _store(cache, 's1', [_document('a')])
+        hit = await cache.lookup('user', scope_key, [0.99, 0.05])
+        miss = await cache.lookup('user', scope_key, [0.0, 1.0])
+        return hit, miss
+
+    hit, miss = asyncio.run(run())
+    assert hit['answer'] == 'Mitochondria.' and hit['similarity'] > 0.95
+    assert miss is None
+    assert cache.stats()['hits'] == 1 and cache.stats()['misses'] == 1
+
+
+def test_reingesting_a_document_changes_the_scope():
+    cache = _cache()
+    cache.db.blobs.documents.append({'content_hash': 'hash-a', 'ingested_at': '2026-01-01T00:00:00'})
+
+    async def run():
+        scope_key = await _store(cache, 's1', [_document('a')])
+        await cache.db.blobs.update_one({'content_hash': 'hash-a'}, {'$set': {'ingested_at': '2026-02-01T00:00:00'}})
+        new_key = await cache.scope_key([_document('a')], 'system', 'model')
+        return scope_key, new_key, await cache.lookup('user', new_key, [1.0, 0.0])
+
+    scope_key, new_key, entry = asyncio.run(run())
+    assert scope_key != new_key and entry is None
+
+
+def test_a_session_upload_drops_only_that_sessions_answers():
+    cache = _cache()
+
+    async def run():
+        await _store(cache, 's1', [_document('a')])
+        await _store(cache, 's2', [_document('b')])
+        await cache.invalidate_scope('user', 's1', is_global=False)
+
+    asyncio.run(run())
+    assert [entry['session_id'] for entry in cache.db.answer_cache.documents] == ['s2']
+
+
+def test_a_global_upload_drops_every_answer_of_the_user():
+    cache = _cache()
+
+    async def run():
+        await _store(cache, 's1', [_document('a')])
+        await _store(cache, None, [_document('b')])
+        await cache.invalidate_scope('user', None, is_global=True)
+
+    asyncio.run(run())
+    assert cache.db.answer_cache.documents == []
+
+
+def test_deleting_a_document_drops_the_answers_that_used_it():
+    cache = _cache()
+
+    async def run():
+        await _store(cache, 's1', [_document('a'), _document('b')])
+        await _store(cache, 's1', [_document('c')])
+        await cache.invalidate_document('user', 'b')
+
+    asyncio.run(run())
+    assert [entry['document_ids'] for entry in cache.db.answer_cache.documents] == [['c']]
@@ -0,0 +1,86 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+from services.blob_store import BlobStore
+from tests.fake_mongo import FakeDatabase
+
+
+def _upload(tmp_path, name, data=b'%PDF-1.4 data'):
+    path = tmp_path / name
+    path.write_bytes(data)
+    return path
+
+
+def _store(tmp_path):
+    store = BlobStore(FakeDatabase(), tmp_path)
+    store.poll_interval = 0
+    asyncio.run(store.ensure_indexes())
+    return store
+
+
+def test_same_content_shares_one_file_until_the_last_release(tmp_path):
+    store = _store(tmp_path)
+
+    async def run():
+        first, created = await store.acquire(_upload(tmp_path, 'a.part'), 'h', 'pdf', 13, 'pdf')
+        assert created
+        second, created = await store.acquire(_upload(tmp_path, 'b.part'), 'h', 'pdf', 13, 'pdf')
+        assert not created and second['ref_count'] == 2
+        assert not (tmp_path / 'b.part').exists()
+        await store.db.document_chunks.insert_one({'content_hash': 'h', 'chunk_index': 0})
+
+        assert not await store.release('h')
+        assert (tmp_path / 'h.pdf').exists()
+        assert await store.release('h')
+        return first
+
+    blob = asyncio.run(run())
+    assert blob['file_path'] == str(tmp_path / 'h.pdf')
+    assert not (tmp_path / 'h.pdf').exists()
+    assert store.db.blobs.documents == []
+    assert store.db.document_chunks.documents == []
+
+
+def test_an_upload_during_cleanup_waits_and_keeps_its_file(tmp_path):
+    store = _store(tmp_path)
+    purge = store._purge
+
+    async def run():
+        await store.acquire(_upload(tmp_path, 'a.part'), 'h', 'pdf', 13, 'pdf')
+        reacquired = asyncio.Event()
+
+        async def slow_purge(blob):
+            # The new upload arrives while the old blob is being freed
+            upload = asyncio.create_task(store.acquire(_upload(tmp_path, 'b.part', b'new'), 'h', 'pdf', 3, 'pdf'))
+            await asyncio.sleep(0)
+            assert not upload.done()
+            await purge(blob)
+            reacquired.set()
+            return await upload
+
+        store._purge = slow_purge
+        assert await store.release('h')
+        await reacquired.wait()
+
+    asyncio.run(run())
+    [blob] = store.db.blobs.documents
+    assert blob['ref_count'] == 1 and not blob.get('deleting')
+    assert (tmp_path / 'h.pdf').read_bytes() == b'new'
+
+
+def test_an_abandoned_cleanup_is_finished_by_the_next_upload(tmp_path):
+    store = _store(tmp_path)
+
+    async def run():
+        await store.acquire(_upload(tmp_path, 'a.part'), 'h', 'pdf', 13, 'pdf')
+        await store.db.document_chunks.insert_one({'content_hash': 'h', 'chunk_index': 0})
+        stale = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+        await store.db.blobs.update_one(
+            {'content_hash': 'h'}, {'$set': {'ref_count': 0, 'deleting': True, 'deleting_at': stale}}
+        )
+        return await store.acquire(_upload(tmp_path, 'b.part', b'new'), 'h', 'pdf', 3, 'pdf')
+
+    blob, created = asyncio.run(run())
+    assert created and blob['ref_count'] == 1
+    assert (tmp_path / 'h.pdf').read_bytes() == b'new'
+    assert store.db.document_chunks.documents == []
@@ -0,0 +1,77 @@
+import asyncio
+from types import SimpleNamespace
+
+from pymongo.errors import BulkWriteError
+
+from services.bulk_writer import BulkChunkWriter
+
+
+class Collection:
+    """Records batches; documents whose content is 'bad' fail to insert"""
+
+    def __init__(self, error=None):
+        self.batches = []
+        self.error = error
+
+    async def insert_many(self, documents, ordered=True):
+        self.batches.append(list(documents))
+        if self.error is not None:
+            raise self.error
+        errors = [
+            {'index': index, 'code': 11000, 'errmsg': 'duplicate key'}
+            for index, document in enumerate(documents) if document['content'] == 'bad'
+        ]
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(documents) - len(errors)})
+        return SimpleNamespace(inserted_ids=list(range(len(documents))))
+
+
+def _chunk(index, content='text'):
+    return {'id': f'c{index}', 'chunk_index': index, 'content': content}
+
+
+def _write(writer, chunks):
+    async def run():
+        for chunk in chunks:
+            await writer.add(chunk)
+        await writer.close()
+    asyncio.run(run())
+
+
+def test_batches_are_flushed_by_document_count():
+    collection = Collection()
+    writer = BulkChunkWriter(collection, max_docs=2)
+    _write(writer, [_chunk(index) for index in range(5)])
+    assert [len(batch) for batch in collection.batches] == [2, 2, 1]
+    assert writer.inserted == 5 and writer.failures == []
+
+
+def test_per_document_failures_are_reported_and_the_rest_counted():
+    collection = Collection()
+    writer = BulkChunkWriter(collection, max_docs=3)
+    _write(writer, [_chunk(0), _chunk(1, 'bad'), _chunk(2), _chunk(3, 'bad')])
+    assert writer.inserted == 2
+    assert [(failure['id'], failure['chunk_index'], failure['code']) for failure in writer.failures] == [
+        ('c1', 1, 11000), ('c3', 3, 11000)
+    ]
+
+
+def test_a_failed_batch_reports_every_document():
+    writer = BulkChunkWriter(Collection(error=ConnectionError('primary stepped down')), max_docs=10)
+    _write(writer, [_chunk(0), _chunk(1)])
+    assert writer.inserted == 0
+    assert [failure['chunk_index'] for failure in writer.failures] == [0, 1]
+    assert writer.failures[0]['error'] == 'primary stepped down'
+
+
+def test_discard_drops_the_buffer():
+    collection = Collection()
+    writer = BulkChunkWriter(collection, max_docs=10)
+
+    async def run():
+        await writer.add(_chunk(0))
+        await writer.discard()
+        await writer.close()
+
+    asyncio.run(run())
+    assert collection.batches == [] and writer.inserted == 0
@@ -0,0 +1,59 @@
+from services.chunker import TokenChunker, WordWindowChunker
+
+
+def _sentences(count, words=8, start=0):
+    return ' '.join(
+        'Sentence ' + str(start + i) + ' ' + ' '.join(f'word{j}' for j in range(words)) + '.'
+        for i in range(count)
+    )
+
+
+def test_word_window_chunker_overlaps_within_a_page():
+    pages = [' '.join(f'w{i}' for i in range(25)), 'second page']
+    chunks = WordWindowChunker(chunk_size=10, chunk_overlap=2).chunk(pages)
+
+    first_page = [chunk for chunk in chunks if chunk['page_number'] == 1]
+    assert [chunk['content'].split()[0] for chunk in first_page] == ['w0', 'w8', 'w16', 'w24']
+    assert first_page[0]['content'].split()[-2:] == first_page[1]['content'].split()[:2]
+    assert chunks[-1] == {'content': 'second page', 'page_number': 2, 'page_end': 2}
+
+
+def test_token_chunker_respects_budget_and_keeps_sentences_whole():
+    chunker = TokenChunker(max_tokens=60, overlap_tokens=0)
+    text = _sentences(30)
+    chunks = chunker.chunk([text])
+
+    assert len(chunks) > 1
+    for chunk in chunks:
+        assert chunker.count_tokens(chunk['content']) <= 60
+        assert chunk['content'].startswith('Sentence ')
+        assert chunk['content'].endswith('.')
+    assert ' '.join(chunk['content'] for chunk in chunks) == text
+
+
+def test_token_chunker_merges_short_pages_and_keeps_page_span():
+    chunks = TokenChunker(max_tokens=500).chunk(['First page.', 'Second page.', 'Third page.'])
+
+    assert len(chunks) == 1
+    assert chunks[0]['page_number'] == 1
+    assert chunks[0]['page_end'] == 3
+
+
+def test_token_chunker_overlaps_only_inside_paragraphs():
+    chunker = TokenChunker(max_tokens=60, overlap_tokens=20)
+
+    chunks = chunker.chunk([_sentences(20)])
+    for previous, chunk in zip(chunks, chunks[1:]):
+        first_sentence = chunk['content'].split('. ')[0] + '.'
+        assert first_sentence in previous['content']
+
+    chunks = chunker.chunk([_sentences(3) + '\n\n' + _sentences(3, start=100)])
+    assert chunks[1]['content'].startswith('Sentence 100 ')
+
+def test_token_chunker_splits_an_oversized_sentence():
+    chunker = TokenChunker(max_tokens=20, overlap_tokens=0)
+    chunks = chunker.chunk([' '.join(f'token{i}' for i in range(200)) + '.'])
+
+    # Pieces are cut by summing per-word token counts
+    assert len(chunks) > 5
+    assert ' '.join(chunk['content'] for chunk in chunks).split() == [f'token{i}' for i in range(199)] + ['token199.']
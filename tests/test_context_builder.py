@@ -0,0 +1,59 @@
+from services.context_builder import ContextBuilder
+
+
+def _chunk(index, content, content_hash='hash', page=1):
+    return {'content_hash': content_hash, 'chunk_index': index, 'content': content,
+            'page_number': page, 'page_end': page}
+
+
+def test_merge_adjacent_joins_consecutive_chunks_without_repeating_overlap():
+    builder = ContextBuilder(token_budget=1000)
+    passages = builder.merge_adjacent([
+        _chunk(1, 'gamma delta epsilon', page=2),
+        _chunk(0, 'alpha beta gamma', page=1),
+        _chunk(5, 'unrelated text'),
+        _chunk(1, 'other blob', content_hash='other')
+    ])
+
+    assert passages[0]['content'] == 'alpha beta gamma delta epsilon'
+    assert (passages[0]['page_number'], passages[0]['page_end']) == (1, 2)
+    assert passages[0]['rank'] == 0
+    assert [passage['content'] for passage in passages[1:]] == ['unrelated text', 'other blob']
+
+
+def test_mmr_drops_near_duplicates_and_keeps_rank_order_otherwise():
+    builder = ContextBuilder(token_budget=1000)
+    passages = builder.mmr_order([
+        {'content': 'cells divide by mitosis into two daughter cells'},
+        {'content': 'cells divide by mitosis into two daughter cells'},
+        {'content': 'photosynthesis happens in chloroplasts'}
+    ])
+
+    assert [passage['content'] for passage in passages] == [
+        'cells divide by mitosis into two daughter cells',
+        'photosynthesis happens in chloroplasts'
+    ]
+
+
+def test_build_packs_within_the_token_budget():
+    builder = ContextBuilder(token_budget=50)
+    builder.count_tokens = lambda text: len(text.split())
+    long_passage = ' '.join(f'long{i}' for i in range(45))
+    passages = builder.build([
+        _chunk(0, long_passage),
+        _chunk(10, ' '.join(f'big{i}' for i in range(20))),
+        _chunk(20, 'short answer here')
+    ])
+
+    # The second passage would overflow the budget; a later one still fits
+    assert [passage['chunk_index'] for passage in passages] == [0, 20]
+    assert all('rank' not in passage for passage in passages)
+
+
+def test_build_never_returns_an_empty_context():
+    builder = ContextBuilder(token_budget=5)
+    builder.count_tokens = lambda text: len(text.split())
+    chunks = [_chunk(0, ' '.join(['word'] * 10))]
+
+    assert builder.build(chunks) == [chunks[0]]
+    assert builder.build([]) == []
@@ -0,0 +1,60 @@
+import asyncio
+
+from services.document_scope import DocumentScopeResolver
+from tests.fake_mongo import FakeDatabase
+
+
+def _document(document_id, session_id=None):
+    return {'id': document_id, 'user_id': 'user', 'session_id': session_id, 'is_global': session_id is None,
+            'filename': f'{document_id}.pdf', 'content_hash': f'hash-{document_id}'}
+
+
+def test_invalidation_reaches_every_worker():
+    db = FakeDatabase()
+    db.documents.documents.append(_document('a'))
+    first, second = DocumentScopeResolver(db), DocumentScopeResolver(db)
+
+    async def run():
+        assert [d['id'] for d in await first.resolve('user', 's1')] == ['a']
+        assert [d['id'] for d in await second.resolve('user', 's1')] == ['a']
+        db.documents.documents.append(_document('b', 's1'))
+        await first.invalidate('user')
+        return await second.resolve('user', 's1')
+
+    assert sorted(d['id'] for d in asyncio.run(run())) == ['a', 'b']
+
+
+def test_empty_scopes_are_not_cached():
+    db = FakeDatabase()
+    resolver = DocumentScopeResolver(db)
+
+    async def run():
+        assert await resolver.resolve('user', None) == []
+        db.documents.documents.append(_document('a'))
+        return await resolver.resolve('user', None)
+
+    assert [d['id'] for d in asyncio.run(run())] == ['a']
+
+
+def test_a_scope_read_across_an_invalidation_is_not_cached():
+    db = FakeDatabase()
+    db.documents.documents.append(_document('a'))
+    resolver = DocumentScopeResolver(db)
+    find = db.documents.find
+
+    def find_then_upload_elsewhere(*args, **kwargs):
+        cursor = find(*args, **kwargs)
+        # Another worker stores a document and bumps the scope version
+        db.documents.documents.append(_document('b'))
+        db.scope_versions.documents.append({'_id': 'user', 'version': 1})
+        return cursor
+
+    async def run():
+        db.documents.find = find_then_upload_elsewhere
+        stale = await resolver.resolve('user', None)
+        db.documents.find = find
+        return stale, await resolver.resolve('user', None)
+
+    stale, fresh = asyncio.run(run())
+    assert [d['id'] for d in stale] == ['a']
+    assert sorted(d['id'] for d in fresh) == ['a', 'b']
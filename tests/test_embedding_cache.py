@@ -0,0 +1,45 @@
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+import pytest
+
+from services import embedding_cache
+from services.embedding_cache import EmbeddingCache
+
+
+@pytest.fixture(autouse=True)
+def _clock(monkeypatch):
+    # Every SQLite write gets a distinct last_used
+    ticks = itertools.count(1)
+    monkeypatch.setattr(embedding_cache, 'time', SimpleNamespace(time=lambda: float(next(ticks))))
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = EmbeddingCache(str(tmp_path / 'embeddings.sqlite3'), max_entries=10)
+
+    async def run():
+        for index in range(10):
+            await cache.put_many('m', [f'text {index}'], [[float(index)]])
+        await cache.get_many('m', ['text 0', 'text 1', 'text 2'])
+        await cache.put_many('m', ['text 10'], [[10.0]])
+        return await cache.get_many('m', [f'text {index}' for index in range(11)])
+
+    found = asyncio.run(run())
+    assert [index for index, vector in enumerate(found) if vector is None] == [3, 4]
+    assert cache.stats()['entries'] == 9 and cache.stats()['evictions'] == 2
+    cache.close()
+
+
+def test_entries_persist_and_match_normalized_text(tmp_path):
+    path = str(tmp_path / 'embeddings.sqlite3')
+    cache = EmbeddingCache(path, max_entries=10)
+    asyncio.run(cache.put_many('m', ['The  cell\nwall'], [[0.5, 0.25]]))
+    cache.close()
+
+    reopened = EmbeddingCache(path, max_entries=10)
+    assert asyncio.run(reopened.get_many('m', ['The cell wall', 'other'])) == [[0.5, 0.25], None]
+    assert asyncio.run(reopened.get_many('other-model', ['The cell wall'])) == [None]
+    assert reopened.stats()['entries'] == 1 and reopened.stats()['hits'] == 1
+    reopened.close()
+
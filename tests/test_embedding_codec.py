@@ -0,0 +1,45 @@
+import numpy as np
+import pytest
+
+from services.embedding_codec import decode_float32, decode_int8, encode_embedding, quantize_int8
+
+
+def _embedding(seed=0, dimensions=64):
+    return np.random.default_rng(seed).normal(size=dimensions).astype(np.float32).tolist()
+
+
+def test_array_storage_round_trips():
+    embedding = _embedding()
+    fields = encode_embedding(embedding, 'array')
+
+    assert fields == {'embedding': embedding}
+    np.testing.assert_allclose(decode_float32(fields), embedding, rtol=1e-6)
+
+
+@pytest.mark.parametrize('storage', ['float32', 'int8'])
+def test_packed_storage_keeps_only_float32(storage):
+    embedding = _embedding(1)
+    fields = encode_embedding(embedding, storage)
+
+    assert set(fields) == {'embedding_f32'}
+    assert len(fields['embedding_f32']) == 4 * len(embedding)
+    np.testing.assert_array_equal(decode_float32(fields), np.asarray(embedding, dtype=np.float32))
+
+
+def test_int8_codes_are_quantized_on_load_or_read_from_older_chunks():
+    vector = np.asarray(_embedding(2), dtype=np.float32)
+    codes, scale = decode_int8(encode_embedding(vector.tolist(), 'int8'))
+
+    assert codes.dtype == np.int8 and np.abs(codes).max() == 127
+    assert np.abs(codes * scale - vector).max() <= scale / 2 + 1e-6
+
+    stored_codes, stored_scale = quantize_int8(vector)
+    older = {'embedding_q8': stored_codes.tobytes(), 'embedding_scale': stored_scale}
+    codes, scale = decode_int8(older)
+    np.testing.assert_array_equal(codes, stored_codes)
+    assert scale == stored_scale
+
+
+def test_missing_embeddings_decode_to_none():
+    assert decode_float32({'embedding_status': 'failed'}) is None
+    assert quantize_int8(np.zeros(4, dtype=np.float32))[1] == 1.0
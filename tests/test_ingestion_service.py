@@ -0,0 +1,149 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+from types import SimpleNamespace
+
+import pytest
+
+from services import ingestion_service
+from services.ingestion_service import IngestionService
+from tests.fake_mongo import FakeDatabase
+
+
+class FakeRag:
+    """Stores one chunk, then runs `during` before reporting progress"""
+
+    def __init__(self, db, during=None):
+        self.db = db
+        self.during = during
+        self.embedding_cache = None
+        self.ingested = []
+        self.lexical_index = SimpleNamespace(delete_blob=self._delete_postings)
+
+    async def _delete_postings(self, content_hash):
+        await self.db.chunk_postings.delete_many({'content_hash': content_hash})
+
+    async def process_document(self, content_hash, file_path, file_type, progress, pages):
+        await self.db.document_chunks.insert_one({'content_hash': content_hash, 'chunk_index': 0})
+        if self.during is not None:
+            await self.during()
+        await progress({'chunks_total': 1, 'chunks_embedded': 1})
+        return 1
+
+    async def blob_ingested(self, content_hash, ingested_at):
+        self.ingested.append(content_hash)
+
+
+@pytest.fixture(autouse=True)
+def _pages(monkeypatch):
+    async def load_pages(file_path, file_type):
+        return ['page one']
+    monkeypatch.setattr(ingestion_service, 'load_pages', load_pages)
+
+
+def _service(db, during=None):
+    service = IngestionService(db, FakeRag(db, during))
+    service.retry_delay = 60
+    return service
+
+
+def test_a_job_cancelled_while_running_drops_its_chunks():
+    db = FakeDatabase()
+
+    async def run():
+        service = _service(db, during=lambda: service.cancel('h'))
+        await service.enqueue('h', '/tmp/h.pdf', 'pdf')
+        await service._run(await service._claim_next())
+        return service
+
+    service = asyncio.run(run())
+    assert db.ingestion_jobs.documents[0]['state'] == 'cancelled'
+    assert db.document_chunks.documents == []
+    assert service.rag_service.ingested == []
+
+
+def test_a_stale_claim_cannot_complete_or_clean_up_after_a_reclaim():
+    db = FakeDatabase()
+
+    async def run():
+        async def reclaim():
+            # The first worker stalls long enough for its claim to go stale
+            stale = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+            await db.ingestion_jobs.update_one({'id': job['id']}, {'$set': {'heartbeat_at': stale}})
+            assert await _service(db)._claim_next() is not None
+
+        service = _service(db, during=reclaim)
+        job = await service.enqueue('h', '/tmp/h.pdf', 'pdf')
+        job = await service._claim_next()
+        await service._run(job)
+        return job
+
+    job = asyncio.run(run())
+    [stored] = db.ingestion_jobs.documents
+    assert stored['state'] == 'running' and stored['claim'] != job['claim']
+    assert stored['attempts'] == 2
+    # The new claim owns the chunks now
+    assert len(db.document_chunks.documents) == 1
+
+
+def test_a_failed_attempt_waits_before_it_is_claimed_again():
+    db = FakeDatabase()
+
+    async def fail():
+        raise RuntimeError('embedding provider down')
+
+    async def run():
+        service = _service(db, during=fail)
+        await service.enqueue('h', '/tmp/h.pdf', 'pdf')
+        await service._run(await service._claim_next())
+        assert await service._claim_next() is None
+        await db.ingestion_jobs.update_one(
+            {'content_hash': 'h'},
+            {'$set': {'not_before': datetime.now(timezone.utc).isoformat()}}
+        )
+        return await service._claim_next()
+
+    job = asyncio.run(run())
+    assert job['attempts'] == 2 and job['error'] == 'embedding provider down'
+
+
+def test_retry_delay_doubles_with_each_attempt():
+    db = FakeDatabase()
+
+    async def fail():
+        raise RuntimeError('boom')
+
+    async def run():
+        service = _service(db, during=fail)
+        await service.enqueue('h', '/tmp/h.pdf', 'pdf')
+        delays = []
+        for _ in range(2):
+            before = datetime.now(timezone.utc)
+            await service._run(await service._claim_next())
+            not_before = datetime.fromisoformat(db.ingestion_jobs.documents[0]['not_before'])
+            delays.append((not_before - before).total_seconds())
+            await db.ingestion_jobs.update_one({'content_hash': 'h'}, {'$set': {'not_before': None}})
+        return delays
+
+    first, second = asyncio.run(run())
+    assert 59 < first <= 61 and 119 < second <= 121
+
+
+def test_the_heartbeat_advances_during_a_long_step():
+    db = FakeDatabase()
+
+    async def run():
+        async def slow():
+            await asyncio.sleep(0.1)
+            heartbeats.append(db.ingestion_jobs.documents[0]['heartbeat_at'])
+
+        heartbeats = []
+        service = _service(db, during=slow)
+        service.stale_after = timedelta(seconds=0.03)
+        await service.enqueue('h', '/tmp/h.pdf', 'pdf')
+        job = await service._claim_next()
+        await service._run(job)
+        return job, heartbeats
+
+    job, [heartbeat] = asyncio.run(run())
+    assert heartbeat > job['heartbeat_at']
+    assert db.ingestion_jobs.documents[0]['state'] == 'completed'
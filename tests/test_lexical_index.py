@@ -0,0 +1,72 @@
+import asyncio
+
+import numpy as np
+
+from services.lexical_index import LexicalIndex, _POSTING, build_postings, reciprocal_rank_fusion, tokenize
+from tests.fake_mongo import FakeDatabase
+
+
+def test_tokenize_drops_stopwords_and_keeps_compound_terms():
+    assert tokenize("The Krebs-cycle in section 3.2 isn't what it was") == ['krebs-cycle', 'section', '3.2', "isn't"]
+
+
+def test_build_postings_counts_terms_per_chunk():
+    chunks = [{'content': 'mitosis mitosis cell'}, {'content': 'cell division'}]
+    records, total_tokens = build_postings('hash', chunks)
+
+    assert total_tokens == 5
+    by_term = {record['term']: record for record in records}
+    assert set(by_term) == {'mitosis', 'cell', 'division'}
+    assert by_term['cell']['df'] == 2
+    postings = np.frombuffer(by_term['mitosis']['postings'], dtype=_POSTING)
+    assert postings.tolist() == [(0, 2, 3)]
+    postings = np.frombuffer(by_term['cell']['postings'], dtype=_POSTING)
+    assert postings.tolist() == [(0, 1, 3), (1, 1, 2)]
+
+
+def _index_with_blob(chunk_texts):
+    db = FakeDatabase()
+    chunks = [
+        {'id': f'hash_{i}', 'content_hash': 'hash', 'chunk_index': i, 'content': text, 'embedding': [0.0]}
+        for i, text in enumerate(chunk_texts)
+    ]
+    records, total_tokens = build_postings('hash', chunks)
+    db.chunk_postings.documents.extend(records)
+    db.document_chunks.documents.extend(chunks)
+    db.blobs.documents.append({
+        'content_hash': 'hash',
+        'lexical_stats': {'chunks': len(chunks), 'tokens': total_tokens}
+    })
+    return LexicalIndex(db)
+
+
+def test_bm25_ranks_chunks_matching_rarer_terms_higher():
+    index = _index_with_blob([
+        'plants grow',
+        'plants need photosynthesis',
+        'photosynthesis in leaves',
+        'plants eat',
+        'plants sleep'
+    ])
+    results = asyncio.run(index.search('photosynthesis plants', [{'content_hash': 'hash'}], top_k=3))
+
+    # Both terms first, then the rare term alone, then the common one
+    assert [chunk['id'] for chunk in results[:2]] == ['hash_1', 'hash_2']
+    assert results[2]['id'] in {'hash_0', 'hash_3', 'hash_4'}
+    assert results[0]['score'] > results[1]['score'] > results[2]['score']
+    assert all('embedding' not in chunk for chunk in results)
+
+
+def test_bm25_search_is_scoped_to_the_documents_blobs():
+    index = _index_with_blob(['enzymes speed up reactions'])
+
+    assert asyncio.run(index.search('enzymes', [{'content_hash': 'other'}])) == []
+    assert asyncio.run(index.search('the of and', [{'content_hash': 'hash'}])) == []
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    fused = reciprocal_rank_fusion([
+        [{'id': 'a'}, {'id': 'b'}],
+        [{'id': 'b'}, {'id': 'c'}]
+    ])
+    assert [chunk['id'] for chunk in fused] == ['b', 'a', 'c']
@@ -0,0 +1,144 @@
+import sys
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from services.llm_gateway import FakeBackend, LlmError, LlmGateway, LlmOverloaded, LlmTimeout
+
+
+class RateLimitError(Exception):
+    pass
+
+
+class FlakyBackend(FakeBackend):
+    """Raises the queued errors, one per call, before replying"""
+
+    def __init__(self, errors, reply='ok', latency=0.0):
+        super().__init__(reply=reply, latency=latency)
+        self.errors = list(errors)
+
+    async def complete(self, provider, model, system_message, text, files):
+        if self.errors:
+            self.calls.append({'model': model, 'text': text})
+            raise self.errors.pop(0)
+        return await super().complete(provider, model, system_message, text, files)
+
+
+@pytest.fixture
+def gateway_env(monkeypatch):
+    monkeypatch.setenv('LLM_MAX_RETRIES', '2')
+    monkeypatch.setenv('LLM_BACKOFF_BASE', '0')
+    monkeypatch.setenv('LLM_TIMEOUT', '0.05')
+    monkeypatch.setenv('LLM_QUEUE_TIMEOUT', '0.05')
+
+
+def test_complete_uses_the_backend(gateway_env):
+    backend = FakeBackend(reply='answer')
+    gateway = LlmGateway(backend)
+
+    assert asyncio.run(gateway.complete('question', 'system')) == 'answer'
+    assert backend.calls == [{'model': gateway.model, 'system_message': 'system', 'text': 'question', 'files': []}]
+    assert gateway.stats()['in_flight'] == 0
+
+
+def test_retryable_errors_are_retried(gateway_env):
+    backend = FlakyBackend([RateLimitError('slow down'), Exception('HTTP 503 from provider')])
+    gateway = LlmGateway(backend)
+
+    assert asyncio.run(gateway.complete('question', 'system')) == 'ok'
+    assert len(backend.calls) == 3
+    assert gateway.retries == 2
+
+
+def test_other_errors_and_exhausted_retries_propagate(gateway_env):
+    gateway = LlmGateway(FlakyBackend([ValueError('bad request')]))
+    with pytest.raises(ValueError):
+        asyncio.run(gateway.complete('question', 'system'))
+    assert gateway.retries == 0
+
+    gateway = LlmGateway(FlakyBackend([RateLimitError('1'), RateLimitError('2'), RateLimitError('3')]))
+    with pytest.raises(RateLimitError):
+        asyncio.run(gateway.complete('question', 'system'))
+    assert gateway.calls == 3
+
+
+def test_slow_calls_time_out_after_retries(gateway_env):
+    gateway = LlmGateway(FakeBackend(latency=1))
+
+    with pytest.raises(LlmTimeout):
+        asyncio.run(gateway.complete('question', 'system'))
+    assert gateway.timeouts == 3
+    assert gateway.in_flight == 0
+
+
+def test_calls_without_a_free_slot_are_rejected(gateway_env, monkeypatch):
+    monkeypatch.setenv('LLM_MAX_CONCURRENCY', '1')
+    monkeypatch.setenv('LLM_TIMEOUT', '1')
+    gateway = LlmGateway(FakeBackend(latency=0.2))
+
+    async def run():
+        return await asyncio.gather(
+            gateway.complete('first', 'system'),
+            gateway.complete('second', 'system'),
+            return_exceptions=True
+        )
+
+    first, second = asyncio.run(run())
+    assert first.startswith('[')
+    assert isinstance(second, LlmOverloaded)
+    assert gateway.rejected == 1
+
+
+def test_stream_yields_pieces_and_retries_before_the_first(gateway_env):
+    backend = FlakyBackend([RateLimitError('slow down')], reply='x' * 40)
+    gateway = LlmGateway(backend)
+
+    async def collect():
+        return [piece async for piece in gateway.stream('question', 'system')]
+
+    pieces = asyncio.run(collect())
+    assert ''.join(pieces) == 'x' * 40
+    assert len(pieces) == 3
+    assert gateway.retries == 1
+
+
+def test_the_emergent_backend_requires_a_key(monkeypatch):
+    monkeypatch.delenv('LLM_BACKEND', raising=False)
+    monkeypatch.delenv('EMERGENT_LLM_KEY', raising=False)
+    with pytest.raises(LlmError, match='EMERGENT_LLM_KEY'):
+        LlmGateway()
+
+    monkeypatch.setenv('EMERGENT_LLM_KEY', 'key')
+    assert LlmGateway().backend.api_key == 'key'
+
+
+def test_litellm_backend_streams_provider_deltas(monkeypatch, tmp_path):
+    requests = []
+
+    async def acompletion(**kwargs):
+        requests.append(kwargs)
+
+        async def parts():
+            for text in ['Mito', None, 'sis']:
+                yield SimpleNamespace(choices=[SimpleNamespace(delta=SimpleNamespace(content=text))])
+
+        return parts()
+
+    monkeypatch.setitem(sys.modules, 'litellm', SimpleNamespace(acompletion=acompletion))
+    monkeypatch.setenv('LLM_BACKEND', 'litellm')
+    monkeypatch.setenv('LLM_API_KEY', 'key')
+    attachment = tmp_path / 'notes.pdf'
+    attachment.write_bytes(b'%PDF')
+    gateway = LlmGateway()
+
+    async def collect():
+        return [piece async for piece in gateway.stream('question', 'system', files=[(str(attachment), 'application/pdf')])]
+
+    assert asyncio.run(collect()) == ['Mito', 'sis']
+    request = requests[0]
+    assert request['model'] == f'{gateway.provider}/{gateway.model}'
+    assert request['stream'] is True and request['api_key'] == 'key'
+    assert request['messages'][1]['content'][1] == {
+        'type': 'file', 'file': {'file_data': 'data:application/pdf;base64,JVBERg=='}
+    }
@@ -0,0 +1,49 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from services.pregeneration import PregenerationScheduler
+from tests.fake_mongo import FakeDatabase
+
+
+class IdleLlm:
+    in_flight = 0
+    max_concurrency = 16
+
+
+def _scheduler(monkeypatch, **env):
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    db = FakeDatabase()
+    return db, PregenerationScheduler(db, IdleLlm())
+
+
+def test_free_plan_pregenerates_nothing_by_default(monkeypatch):
+    db, scheduler = _scheduler(monkeypatch, PREGENERATION_ENABLED='true')
+    db.users.documents.append({'id': 'user', 'credits': 10, 'subscription_status': 'inactive'})
+
+    asyncio.run(scheduler.document_added({'id': 'doc', 'user_id': 'user', 'content_hash': 'hash'}))
+    assert db.pregeneration_jobs.documents == []
+    assert 'reserved_credits' not in db.users.documents[0]
+
+
+def test_a_reclaimed_job_releases_its_credits_once(monkeypatch):
+    db, scheduler = _scheduler(monkeypatch, PREGENERATION_ENABLED='true', PREGENERATION_STALE_AFTER='60')
+    db.users.documents.append({'id': 'user', 'credits': 10, 'reserved_credits': 2})
+    long_ago = (datetime.now(timezone.utc) - timedelta(hours=1)).isoformat()
+    db.pregeneration_jobs.documents.append({
+        'id': 'job', 'user_id': 'user', 'document_id': 'doc', 'type': 'summary', 'plan': 'free',
+        'reserved_credits': 2, 'state': 'queued', 'attempts': 0, 'created_at': long_ago
+    })
+
+    async def run():
+        stale = await scheduler._claim_next()
+        db.pregeneration_jobs.documents[0]['started_at'] = long_ago
+        scheduler._running['free'] -= 1
+        current = await scheduler._claim_next()
+        await scheduler._finish(stale, 'completed')
+        assert db.users.documents[0]['reserved_credits'] == 2
+        await scheduler._finish(current, 'completed')
+
+    asyncio.run(run())
+    assert db.users.documents[0]['reserved_credits'] == 0
+    assert db.pregeneration_jobs.documents[0]['state'] == 'completed'
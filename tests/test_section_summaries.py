@@ -0,0 +1,56 @@
+import asyncio
+
+from services.llm_gateway import FakeBackend, LlmGateway
+from services.section_summaries import SectionSummarizer
+from services.single_flight import SingleFlight
+from tests.fake_mongo import FakeDatabase
+
+
+def _summarizer(chunk_count, words_per_chunk=20):
+    db = FakeDatabase()
+    backend = FakeBackend(reply='condensed section')
+    summarizer = SectionSummarizer(db, LlmGateway(backend), SingleFlight(db))
+    summarizer.count_tokens = lambda text: len(text.split())
+    summarizer.outline_tokens = 100
+    summarizer.group_tokens = 50
+    summarizer.min_tokens = 100
+    db.document_chunks.documents.extend(
+        {'content_hash': 'hash', 'chunk_index': i, 'content': f'chunk{i} ' + 'word ' * (words_per_chunk - 1),
+         'page_number': i + 1, 'page_end': i + 1}
+        for i in range(chunk_count)
+    )
+    return db, backend, summarizer
+
+
+def test_chunks_that_fit_are_the_outline_without_llm_calls():
+    db, backend, summarizer = _summarizer(4)
+    outline = asyncio.run(summarizer.outline('hash'))
+
+    assert backend.calls == []
+    assert outline.startswith('[Page 1]\nchunk0 word')
+    assert '[Page 4]\nchunk3' in outline
+    assert db.section_summaries.documents == []
+
+
+def test_large_documents_are_mapped_and_reduced_once():
+    db, backend, summarizer = _summarizer(10)
+
+    async def build_twice():
+        return await summarizer.outline('hash'), await summarizer.outline('hash')
+
+    first, second = asyncio.run(build_twice())
+    # Groups of two 20-token chunks, summarized once; the summaries fit
+    assert len(backend.calls) == 5
+    assert first == second
+    assert first.startswith('[Pages 1-2]\ncondensed section')
+
+
+def test_auto_mode_applies_by_token_count():
+    db, _, summarizer = _summarizer(1)
+    db.blobs.documents.append({'content_hash': 'small', 'ingested_at': 'now', 'lexical_stats': {'chunks': 40}, 'token_count': 90})
+    db.blobs.documents.append({'content_hash': 'large', 'ingested_at': 'now', 'lexical_stats': {'chunks': 3}, 'token_count': 900})
+    db.blobs.documents.append({'content_hash': 'pending', 'lexical_stats': {'chunks': 3}, 'token_count': 900})
+
+    assert asyncio.run(summarizer.applies('small')) is False
+    assert asyncio.run(summarizer.applies('large')) is True
+    assert asyncio.run(summarizer.applies('pending')) is False
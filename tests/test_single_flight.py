@@ -0,0 +1,104 @@
+import asyncio
+from datetime import datetime, timezone, timedelta
+
+import pytest
+
+from services.single_flight import SingleFlight, SingleFlightTimeout
+from tests.fake_mongo import FakeDatabase
+
+
+def _flights(db):
+    flights = SingleFlight(db)
+    flights.poll_interval = 0.01
+    return flights
+
+
+def test_concurrent_calls_in_one_process_share_a_generation():
+    flights = _flights(FakeDatabase())
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return 'outline', 'result-1'
+
+    async def run():
+        return await asyncio.gather(*(flights.run('k', produce, None) for _ in range(3)))
+
+    assert asyncio.run(run()) == ['outline'] * 3
+    assert calls == [1]
+
+
+def test_another_worker_waits_for_the_lock_and_loads_the_result():
+    db = FakeDatabase()
+    first, second = _flights(db), _flights(db)
+    calls = []
+
+    async def produce():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return 'outline', 'result-1'
+
+    async def load_result(result_id):
+        return f'loaded {result_id}'
+
+    async def run():
+        producer = asyncio.create_task(first.run('k', produce, load_result))
+        await asyncio.sleep(0)
+        return await asyncio.gather(producer, second.run('k', produce, load_result))
+
+    assert asyncio.run(run()) == ['outline', 'loaded result-1']
+    assert calls == [1]
+    assert db.generation_locks.documents[0]['state'] == 'done'
+
+
+def test_a_waiter_takes_over_when_the_producer_fails():
+    db = FakeDatabase()
+    first, second = _flights(db), _flights(db)
+
+    async def fail():
+        await asyncio.sleep(0.02)
+        raise RuntimeError('llm down')
+
+    async def produce():
+        return 'outline', 'result-2'
+
+    async def run():
+        failing = asyncio.create_task(first.run('k', fail, None))
+        await asyncio.sleep(0)
+        waiting = await second.run('k', produce, None)
+        with pytest.raises(RuntimeError):
+            await failing
+        return waiting
+
+    assert asyncio.run(run()) == 'outline'
+
+
+def test_an_expired_lock_of_a_dead_worker_is_taken_over():
+    db = FakeDatabase()
+    db.generation_locks.documents.append({
+        '_id': 'k', 'owner': 'dead', 'state': 'running', 'result_id': None,
+        'expires_at': datetime.now(timezone.utc) - timedelta(seconds=1)
+    })
+
+    async def produce():
+        return 'outline', 'result-3'
+
+    assert asyncio.run(_flights(db).run('k', produce, None)) == 'outline'
+    assert db.generation_locks.documents[0]['result_id'] == 'result-3'
+
+
+def test_waiting_on_a_live_lock_times_out():
+    db = FakeDatabase()
+    db.generation_locks.documents.append({
+        '_id': 'k', 'owner': 'busy', 'state': 'running', 'result_id': None,
+        'expires_at': datetime.now(timezone.utc) + timedelta(minutes=1)
+    })
+    flights = _flights(db)
+    flights.wait_timeout = 0.05
+
+    async def produce():
+        return 'outline', 'result-4'
+
+    with pytest.raises(SingleFlightTimeout):
+        asyncio.run(flights.run('k', produce, None))
@@ -0,0 +1,40 @@
+import json
+
+import pytest
+
+from services.study_pack import STUDY_PACK_PARTS, parse_study_pack
+
+PACK = {
+    'summary': 'Cells divide by mitosis.',
+    'flashcards': [{'question': 'What is mitosis?', 'answer': 'Cell division.', 'hint': 'ignored'}],
+    'mindmap': {'title': 'Cells', 'children': [{'title': 'Mitosis'}]}
+}
+
+
+def test_parses_every_requested_part_from_a_fenced_reply():
+    reply = f"Here you go:\n```json\n{json.dumps(PACK)}\n```"
+    contents = parse_study_pack(reply, list(STUDY_PACK_PARTS))
+
+    assert contents == {
+        'summary': {'summary': 'Cells divide by mitosis.'},
+        'flashcard': {'flashcards': [{'question': 'What is mitosis?', 'answer': 'Cell division.'}]},
+        'mindmap': {'mindmap': {'title': 'Cells', 'children': [{'title': 'Mitosis', 'children': []}]}}
+    }
+
+
+def test_only_requested_parts_are_required():
+    contents = parse_study_pack(json.dumps({'summary': 'Short.'}), ['summary'])
+    assert contents == {'summary': {'summary': 'Short.'}}
+
+
+@pytest.mark.parametrize('reply', [
+    'no json here',
+    json.dumps({'summary': 'Only a summary.'}),
+    json.dumps({**PACK, 'flashcards': []}),
+    json.dumps({**PACK, 'flashcards': [{'question': 'Q?', 'answer': ''}]}),
+    json.dumps({**PACK, 'mindmap': {'children': []}}),
+    '{"summary": "unterminated'
+])
+def test_invalid_replies_raise_value_error(reply):
+    with pytest.raises(ValueError):
+        parse_study_pack(reply, list(STUDY_PACK_PARTS))